@@ -0,0 +1 @@
+default_app_config = 'peer_review.apps.PeerReviewConfig'
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from .models import QuestionType, QuestionGrouping, Question, Choice, Rank, Rate, User, Questionnaire, \
-    RoundDetail, TeamDetail, Label, QuestionOrder, FreeformItem, Response
+    RoundDetail, TeamDetail, Label, QuestionOrder, FreeformItem, Response, LatestResponse, ExportJob, \
+    ResponseAggregate, AnswerCount, OutgoingEmail, ArchivedRound
 
 admin.site.register(QuestionType)
 admin.site.register(QuestionGrouping)
@@ -17,3 +18,9 @@ admin.site.register(TeamDetail)
 admin.site.register(Label)
 admin.site.register(FreeformItem)
 admin.site.register(Response)
+admin.site.register(LatestResponse)
+admin.site.register(ExportJob)
+admin.site.register(ResponseAggregate)
+admin.site.register(AnswerCount)
+admin.site.register(OutgoingEmail)
+admin.site.register(ArchivedRound)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class PeerReviewConfig(AppConfig):
+    name = 'peer_review'
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,21 @@
+"""
+Splits large reads and writes into statements the database accepts. SQLite
+refuses statements with more than MAX_PARAMETERS parameters, so long IN lists
+and bulk INSERTs are sent in batches.
+"""
+MAX_PARAMETERS = 999
+
+# Values per IN (...) list, leaving room for the other parameters of a query
+BATCH_SIZE = 500
+
+
+def chunks(items, size=BATCH_SIZE):
+    """Yields the items in lists of at most size."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def rows_per_insert(model):
+    """The most rows of model that a single bulk INSERT can hold."""
+    return MAX_PARAMETERS // len(model._meta.concrete_fields)
@@ -0,0 +1,80 @@
+"""
+Deletes many users, questions or questionnaires at once. The selected rows are
+read with one query per batch of pks and removed together in one
+transaction, so their cascades cost one query per related table and batch
+instead of a round of queries for every row. preview_deletion counts what a
+deletion would remove without removing anything, for the confirmation shown
+before it.
+"""
+from django.db import router, transaction
+from django.db.models.deletion import Collector
+
+from .batches import chunks
+from .liveAggregates import rebuild_aggregates
+from .models import RoundDetail, TeamDetail
+from .questionnaireCache import questionnaires_changed
+from .teamProgress import recount_round
+
+def find(model, pks):
+    """Returns the rows of model with the given pks, or None if any of them does not exist."""
+    pks = list(set(pks))
+    objects = []
+    for batch in chunks(pks):
+        objects.extend(model.objects.filter(pk__in=batch))
+    return objects if len(objects) == len(pks) else None
+
+
+def collect(objects):
+    # Gathers all the rows and everything that cascades from them at once. The related rows of each table are
+    # read with one query per batch of parent rows, sized by the database's parameter limit.
+    collector = Collector(using=router.db_for_write(type(objects[0])) if objects else 'default')
+    collector.collect(objects)
+    return collector
+
+
+def preview_deletion(objects):
+    """Returns the number of rows of every kind that deleting the objects would remove, by name."""
+    collector = collect(objects)
+    counts = {}
+    for model, instances in collector.data.items():
+        counts[model._meta.verbose_name_plural] = counts.get(model._meta.verbose_name_plural, 0) + len(instances)
+    for queryset in collector.fast_deletes:
+        name = queryset.model._meta.verbose_name_plural
+        counts[name] = counts.get(name, 0) + queryset.count()
+    return {str(name): count for name, count in counts.items() if count}
+
+
+def delete_users(users):
+    """Deletes the users with their team places and answers, then recounts the rounds they were in."""
+    with transaction.atomic():
+        # Read in the transaction, so a user placed in a round meanwhile cannot leave it uncounted
+        round_pks = set()
+        for batch in chunks(users):
+            round_pks.update(TeamDetail.objects.filter(user__in=batch).values_list('roundDetail_id', flat=True))
+        deleted = collect(users).delete()
+        for round_pk in round_pks:
+            rebuild_aggregates(round_pk)
+            recount_round(round_pk)
+    return deleted
+
+
+def delete_questions(questions):
+    """Deletes the questions with their items and answers, then recounts the rounds that asked them."""
+    with transaction.atomic():
+        round_pks = set()
+        for batch in chunks(questions):
+            round_pks.update(RoundDetail.objects.filter(
+                questionnaire__questionorder__question__in=batch).values_list('pk', flat=True))
+        deleted = collect(questions).delete()
+        questionnaires_changed()
+        for round_pk in round_pks:
+            recount_round(round_pk)
+    return deleted
+
+
+def delete_questionnaires(questionnaires):
+    """Deletes the questionnaires along with the rounds that use them."""
+    with transaction.atomic():
+        deleted = collect(questionnaires).delete()
+        questionnaires_changed()
+    return deleted
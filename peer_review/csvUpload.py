@@ -0,0 +1,46 @@
+"""
+Reads uploaded CSV files straight from the upload, which Django keeps in
+memory or in a temporary file depending on its size. Nothing is written under
+media/documents unless CSV_UPLOAD_ARCHIVE is on, and then only for uploads
+that were imported.
+"""
+import io
+
+from django.conf import settings
+
+from .models import Document
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def csv_lines(upload):
+    """
+    Returns the lines of an uploaded CSV file, decoded as they are read. Raises UploadTooLarge
+    for files over CSV_UPLOAD_MAX_BYTES and UnicodeDecodeError, while reading, for files that
+    are not UTF-8.
+    """
+    if upload.size > settings.CSV_UPLOAD_MAX_BYTES:
+        raise UploadTooLarge()
+    upload.seek(0)
+    return decoded_lines(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''))
+
+
+def decoded_lines(lines):
+    try:
+        yield from lines
+    finally:
+        # Leaves the upload open once its lines are read, so it can still be archived
+        lines.detach()
+
+
+def too_large_message():
+    return "The file is larger than the limit of " + str(settings.CSV_UPLOAD_MAX_BYTES // 1024) + " KB."
+
+
+def archive_upload(upload):
+    # Keeps a copy of an imported upload as a Document when archiving is on
+    if settings.CSV_UPLOAD_ARCHIVE:
+        upload.seek(0)
+        Document(doc_file=upload).save()
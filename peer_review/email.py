@@ -1,34 +1,63 @@
 import os
+import re
 import time
 
-from django.core.mail import send_mail
+from peer_review.emailOutbox import queue_email
 
+TEXT_DIR = os.path.join(os.path.dirname(__file__), 'text')
 
-def generate_otp_email(user_otp, post_name, post_surname, email, user_id):
-    fn = "{first_name}"
-    ln = "{last_name}"
-    otp = "{otp}"
-    datetime = "{datetime}"
-    login = "{login}"
-    post_user_id = "{user_id}"
+# A placeholder such as {first_name} in an email template
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
 
-    module_dir = os.path.dirname(__file__)
-    file_path = os.path.join(module_dir)
-    file = open(file_path + '/text/otp_email.txt', 'a+')
-    file.seek(0)
-    email_text = file.read()
-    file.close()
+# File name -> the compiled template and the modification time of the file it was read from
+_templates = {}
 
-    email_subject = "Pinocchio Confirm Registration"
 
-    email_text = email_text.replace(fn, post_name)
-    email_text = email_text.replace(ln, post_surname)
-    email_text = email_text.replace(otp, user_otp)
-    email_text = email_text.replace(datetime, time.strftime("%H:%M:%S %d/%m/%Y"))
-    email_text = email_text.replace(login, email)
-    email_text = email_text.replace(post_user_id, user_id)
+class EmailTemplate:
+    # An email template split once into literal text and placeholder names, so that rendering it is a single join
+    def __init__(self, text):
+        self.text = text
+        self.parts = PLACEHOLDER.split(text)
+
+    def render(self, **values):
+        # Odd parts are placeholder names; placeholders without a value are left as they are
+        return ''.join(part if index % 2 == 0 else str(values[part]) if part in values else '{' + part + '}'
+                       for index, part in enumerate(self.parts))
+
+
+def email_template(name):
+    """Returns the compiled template in peer_review/text/<name>, reading the file again only once it has changed."""
+    path = os.path.join(TEXT_DIR, name)
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        modified = None
+    cached = _templates.get(name)
+    if cached is not None and cached[1] == modified:
+        return cached[0]
+    text = ''
+    if modified is not None:
+        with open(path, encoding='utf-8') as file:
+            text = file.read()
+    template = EmailTemplate(text)
+    _templates[name] = (template, modified)
+    return template
+
+
+def save_email_template(name, text):
+    with open(os.path.join(TEXT_DIR, name), 'w', encoding='utf-8') as file:
+        file.write(text)
+    _templates.pop(name, None)
+
+
+# template is the compiled otp_email.txt; callers sending many emails may look it up once and pass it in
+def generate_otp_email(user_otp, post_name, post_surname, email, user_id, template=None):
+    if template is None:
+        template = email_template('otp_email.txt')
+
+    email_subject = "Pinocchio Confirm Registration"
 
-    print(email_text)
+    email_text = template.render(first_name=post_name, last_name=post_surname, otp=user_otp,
+                                 datetime=time.strftime("%H:%M:%S %d/%m/%Y"), login=email, user_id=user_id)
 
-    # TODO: REMOVE THIS COMMENT IN THE LIVE VERSION
-    send_mail(email_subject, email_text, 'pinocchio@cs.up.ac.za', [email], fail_silently=False)
+    queue_email(email_subject, email_text, email)
@@ -0,0 +1,137 @@
+"""
+A database-backed outbox for the emails the application sends. Emails are
+queued as OutgoingEmail rows inside the caller's transaction, so a request
+never waits for the mail server and a failed delivery cannot undo the work
+that caused it. A background thread delivers queued emails in batches over a
+single SMTP connection, no faster than OUTBOX_RATE_LIMIT emails a second.
+An email that cannot be delivered is retried after OUTBOX_RETRY_DELAY
+seconds, doubling the wait after every attempt, until OUTBOX_MAX_ATTEMPTS
+attempts have failed. The send_emails management command delivers the
+queue from outside the web process.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+FROM_ADDRESS = 'pinocchio@cs.up.ac.za'
+
+# An email that has been sending for longer than this is assumed to have died with its sender
+STALE_SEND_AGE = timedelta(minutes=10)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+_scheduled = False
+
+
+def queue_email(subject, body, to_address, from_address=FROM_ADDRESS):
+    """Adds an email to the outbox. The background sender is woken once the transaction commits."""
+    email = OutgoingEmail.objects.create(subject=subject[:200], body=body, fromAddress=from_address,
+                                         toAddress=to_address)
+    if settings.OUTBOX_SENDER:
+        transaction.on_commit(wake_sender)
+    return email
+
+
+def wake_sender():
+    global _scheduled, _executor
+    with _lock:
+        if _scheduled:
+            return
+        _scheduled = True
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1)
+    _executor.submit(run_sender)
+
+
+def run_sender():
+    global _scheduled
+    with _lock:
+        _scheduled = False
+    try:
+        while send_queued_emails():
+            pass
+        # Emails waiting for a retry wake the sender again when they are due
+        due = OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED).order_by('nextAttempt').values_list(
+            'nextAttempt', flat=True).first()
+        if due is not None:
+            timer = threading.Timer(max(1.0, (due - timezone.now()).total_seconds()), wake_sender)
+            timer.daemon = True
+            timer.start()
+    except Exception:
+        logger.exception("The outbox sender stopped")
+    finally:
+        connection.close()
+
+
+def due_emails(limit):
+    now = timezone.now()
+    return list(OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED, nextAttempt__lte=now).order_by(
+        'nextAttempt', 'pk')[:limit]) + list(OutgoingEmail.objects.filter(
+        status=OutgoingEmail.SENDING, nextAttempt__lte=now - STALE_SEND_AGE).order_by('pk')[:limit])
+
+
+def claim(email):
+    # Marks an email as being sent, unless another sender claimed it first
+    claimed = OutgoingEmail.objects.filter(pk=email.pk, status=email.status, nextAttempt=email.nextAttempt).update(
+        status=OutgoingEmail.SENDING, nextAttempt=timezone.now())
+    return claimed == 1
+
+
+def send_queued_emails(limit=None):
+    """
+    Delivers up to OUTBOX_BATCH_SIZE due emails over one connection. Returns how many emails
+    were attempted; 0 means nothing was due.
+    """
+    emails = [email for email in due_emails(limit or settings.OUTBOX_BATCH_SIZE) if claim(email)]
+    if not emails:
+        return 0
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        mail_connection.open()
+    except Exception as e:
+        for email in emails:
+            failed(email, e)
+        return len(emails)
+
+    interval = 1.0 / settings.OUTBOX_RATE_LIMIT if settings.OUTBOX_RATE_LIMIT else 0
+    last_sent = None
+    try:
+        for email in emails:
+            if last_sent is not None and interval:
+                time.sleep(max(0.0, last_sent + interval - time.time()))
+            last_sent = time.time()
+            try:
+                mail_connection.send_messages([EmailMessage(email.subject, email.body, email.fromAddress,
+                                                            [email.toAddress])])
+            except Exception as e:
+                failed(email, e)
+            else:
+                OutgoingEmail.objects.filter(pk=email.pk).update(status=OutgoingEmail.SENT, sent=timezone.now(),
+                                                                 attempts=email.attempts + 1, error='')
+    finally:
+        try:
+            mail_connection.close()
+        except Exception:
+            pass
+    return len(emails)
+
+
+def failed(email, error):
+    attempts = email.attempts + 1
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        changes = {'status': OutgoingEmail.FAILED}
+    else:
+        delay = settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+        changes = {'status': OutgoingEmail.QUEUED, 'nextAttempt': timezone.now() + timedelta(seconds=delay)}
+    OutgoingEmail.objects.filter(pk=email.pk).update(attempts=attempts, error=str(error)[:300], **changes)
@@ -0,0 +1,163 @@
+"""
+Builds round dumps in the background. Jobs are ExportJob rows run by a
+pool of worker threads in this process. A finished dump is handed out again
+for as long as the round's responses have not changed, and old dumps are
+deleted once they pass an age or total size limit. A running job updates
+its heartbeat as it makes progress; one that stops doing so is taken to have
+died with its worker.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ExportJob, LatestResponse, RoundDetail
+from .responseStore import response_stamp
+from .roundArchive import archive_of
+from .roundExport import EXPORT_FORMATS, export_chunks
+
+DUMP_DIR = os.path.join(settings.MEDIA_ROOT, 'dumps', 'jobs')
+
+# Queued jobs that have not started after this long are assumed to have died with their worker
+STALE_JOB_AGE = timedelta(hours=1)
+# Running jobs that have not reported progress for this long are too, as are their half-written dumps
+STALE_HEARTBEAT_AGE = timedelta(minutes=10)
+STALE_JOB_ERROR = "The export stopped before it finished."
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def request_export(round_pk, export_format):
+    """
+    Returns a job for a dump of the round: a finished job whose dump is still current,
+    a job already working on it, or a newly queued one.
+    """
+    stamp = response_stamp(round_pk)
+    jobs = ExportJob.objects.filter(roundDetail_id=round_pk, exportFormat=export_format, responseStamp=stamp)
+
+    for job in jobs.filter(status=ExportJob.DONE).order_by('-finished'):
+        if os.path.isfile(job.dumpFile):
+            return job
+    # A job whose worker died is not waited for again
+    fail_stale_jobs(jobs)
+    pending = jobs.filter(status__in=(ExportJob.QUEUED, ExportJob.RUNNING)).first()
+    if pending is not None:
+        return pending
+
+    job = ExportJob.objects.create(roundDetail_id=round_pk, exportFormat=export_format, responseStamp=stamp)
+    if settings.EXPORT_WORKERS:
+        # The worker uses its own connection, so it may only start once the job row is committed
+        transaction.on_commit(lambda: executor().submit(run_export_job, job.pk))
+    else:
+        run_export_job(job.pk)
+        job.refresh_from_db()
+    return job
+
+
+def fail_stale_jobs(jobs):
+    """
+    Marks the jobs among the given ones as failed that have been queued for longer than
+    STALE_JOB_AGE or running without a heartbeat for longer than STALE_HEARTBEAT_AGE.
+    """
+    now = timezone.now()
+    return jobs.filter(Q(status=ExportJob.QUEUED, heartbeat__lt=now - STALE_JOB_AGE)
+                       | Q(status=ExportJob.RUNNING, heartbeat__lt=now - STALE_HEARTBEAT_AGE)).update(
+        status=ExportJob.FAILED, error=STALE_JOB_ERROR, finished=now)
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS)
+    return _executor
+
+
+def run_export_job(job_pk):
+    """Builds the dump for a queued job, recording progress as it goes."""
+    try:
+        job = ExportJob.objects.select_related('roundDetail').get(pk=job_pk)
+        ExportJob.objects.filter(pk=job_pk).update(status=ExportJob.RUNNING, heartbeat=timezone.now())
+        archive = archive_of(job.roundDetail_id)
+        total = archive.latestCount if archive is not None else LatestResponse.objects.filter(
+            roundDetail_id=job.roundDetail_id).count()
+
+        os.makedirs(DUMP_DIR, exist_ok=True)
+        dump_file = os.path.join(DUMP_DIR, 'round_' + str(job.roundDetail_id) + '_job_' + str(job.pk) + '.'
+                                 + EXPORT_FORMATS[job.exportFormat][0])
+
+        def progress(count):
+            ExportJob.objects.filter(pk=job_pk).update(progress=min(99, count * 100 // max(total, 1)),
+                                                       heartbeat=timezone.now())
+            # Formats written only at the end would otherwise leave the half-written dump looking abandoned
+            os.utime(dump_file + '.part')
+
+        # Write under a temporary name so a half-written dump is never handed out
+        with open(dump_file + '.part', 'wb') as output:
+            for chunk in export_chunks(job.roundDetail_id, job.exportFormat, progress):
+                output.write(chunk)
+        os.replace(dump_file + '.part', dump_file)
+
+        ExportJob.objects.filter(pk=job_pk).update(status=ExportJob.DONE, progress=100, dumpFile=dump_file,
+                                                   finished=timezone.now())
+    except (ExportJob.DoesNotExist, RoundDetail.DoesNotExist):
+        return
+    except Exception as e:
+        logger.exception("Export job %s failed", job_pk)
+        ExportJob.objects.filter(pk=job_pk).update(status=ExportJob.FAILED, error=str(e)[:300],
+                                                   finished=timezone.now())
+    finally:
+        collect_old_dumps()
+        if settings.EXPORT_WORKERS:
+            connection.close()
+
+
+def collect_old_dumps(max_age=None, max_bytes=None):
+    """
+    Deletes dumps older than max_age seconds, then the oldest remaining dumps until
+    together they take at most max_bytes. Jobs whose dumps are deleted are removed.
+    Half-written dumps untouched for STALE_HEARTBEAT_AGE were left by dead workers
+    and are deleted too.
+    """
+    max_age = settings.EXPORT_DUMP_MAX_AGE if max_age is None else max_age
+    max_bytes = settings.EXPORT_DUMP_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(DUMP_DIR):
+        return []
+
+    dumps = []
+    now = time.time()
+    for name in os.listdir(DUMP_DIR):
+        path = os.path.join(DUMP_DIR, name)
+        try:
+            stat = os.stat(path)
+            if name.endswith('.part'):
+                if now - stat.st_mtime > STALE_HEARTBEAT_AGE.total_seconds():
+                    os.remove(path)
+                continue
+        except FileNotFoundError:
+            # Removed by another worker collecting at the same time
+            continue
+        dumps.append((stat.st_mtime, stat.st_size, path))
+    dumps.sort()
+
+    removed = []
+    total = sum(size for _, size, _ in dumps)
+    for modified, size, path in dumps:
+        if now - modified <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        removed.append(path)
+        total -= size
+    if removed:
+        ExportJob.objects.filter(dumpFile__in=removed).delete()
+    return removed
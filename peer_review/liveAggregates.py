@@ -0,0 +1,223 @@
+"""
+Keeps ResponseAggregate and AnswerCount in step with the latest answers, so the
+live report reads a few small rows instead of recomputing a round.
+
+Whenever an answer becomes current it is added to the totals of its team, and
+the answer it replaced is subtracted. The rows a save touches are read in
+batches, the missing ones inserted in bulk and the rest changed with one
+UPDATE of F() expressions per batch, so concurrent saves cannot overwrite each
+other's counts. The rows are unique on a non-null itemKey, so two saves that
+both find no row cannot both insert one. Rows whose count drops to zero are kept for the next answer and
+skipped by readers.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+
+from .batches import MAX_PARAMETERS, chunks, rows_per_insert
+from .models import AnswerCount, LatestResponse, Question, ResponseAggregate, TeamDetail, item_key
+from .roundArchive import archive_of, archived_latest
+
+# Question types that are counted, and those whose answers are also summed
+COUNTED_TYPES = ('Rate', 'Rank', 'Choice')
+NUMERIC_TYPES = ('Rate', 'Rank')
+
+# The fields that identify an aggregate row; AnswerCount rows also have an answer
+IDENTITY_FIELDS = ('roundDetail_id', 'teamName', 'question_id', 'itemKey', 'answer')
+
+
+def answer_value(question_type, answer):
+    # The number a Rate or Rank answer adds to the totals, or None if it adds nothing. Rank positions are stored
+    # from 0 but counted from 1, and a negative rating is an optional question the user skipped.
+    try:
+        value = float(answer)
+    except (TypeError, ValueError):
+        return None
+    if question_type == 'Rank':
+        return value + 1
+    return value if value >= 0 else None
+
+
+def question_types(responses):
+    # Question pk -> type name, for the counted questions among the answers
+    question_pks = {response.question_id for response in responses}
+    return {str(pk): name for pk, name in Question.objects.filter(
+        pk__in=question_pks, questionType__name__in=COUNTED_TYPES).values_list('pk', 'questionType__name')}
+
+
+def team_names(responses):
+    # (round pk, user id) -> the name of the user's team in that round
+    responses = list(responses)
+    teams = TeamDetail.objects.filter(roundDetail_id__in={response.roundDetail_id for response in responses},
+                                      user_id__in={str(response.user_id) for response in responses})
+    return {(str(round_pk), str(user_id)): team_name
+            for round_pk, user_id, team_name in teams.values_list('roundDetail_id', 'user_id', 'teamName')}
+
+
+def tally(responses, sign, types, team_of, totals, counts):
+    """
+    Adds (sign 1) or subtracts (sign -1) answers to the totals and counts being collected.
+    team_of maps an answer to the team it counts for, or None to leave it out.
+    """
+    for response in responses:
+        question_type = types.get(str(response.question_id))
+        team_name = team_of(response)
+        if question_type is None or team_name is None:
+            continue
+        key = (str(response.roundDetail_id), team_name, str(response.question_id),
+               None if response.label_id is None else str(response.label_id),
+               None if response.subjectUser_id is None else str(response.subjectUser_id))
+        counts[key + (response.answer,)] = counts.get(key + (response.answer,), 0) + sign
+        if question_type in NUMERIC_TYPES:
+            value = answer_value(question_type, response.answer)
+            if value is not None:
+                total = totals.setdefault(key, [0, 0.0, 0.0])
+                total[0] += sign
+                total[1] += sign * value
+                total[2] += sign * value * value
+
+
+def record_answers(added, removed):
+    """Updates the totals for answers that became current and the answers they replaced."""
+    responses = list(added) + list(removed)
+    if not responses:
+        return
+    types = question_types(responses)
+    if not types:
+        return
+    teams = team_names(responses)
+
+    def team_of(response):
+        return teams.get((str(response.roundDetail_id), str(response.user_id)))
+
+    totals = {}
+    counts = {}
+    tally(added, 1, types, team_of, totals, counts)
+    tally(removed, -1, types, team_of, totals, counts)
+    apply_changes(totals, counts)
+
+
+def move_answers(round_pk, user_id, old_team, new_team):
+    """Moves a user's answers in a round from one team's totals to another's. Either team may be None."""
+    if old_team == new_team:
+        return
+    responses = list(LatestResponse.objects.filter(roundDetail_id=round_pk, user_id=user_id).only(
+        'roundDetail', 'user', 'question', 'label', 'subjectUser', 'answer'))
+    if not responses:
+        return
+    types = question_types(responses)
+    totals = {}
+    counts = {}
+    tally(responses, -1, types, lambda response: old_team, totals, counts)
+    tally(responses, 1, types, lambda response: new_team, totals, counts)
+    apply_changes(totals, counts)
+
+
+def key_fields(key):
+    round_pk, team_name, question_pk, label_pk, subject_pk = key
+    return {'roundDetail_id': round_pk, 'teamName': team_name, 'question_id': question_pk, 'label_id': label_pk,
+            'subjectUser_id': subject_pk, 'itemKey': item_key(label_pk, subject_pk)}
+
+
+def apply_changes(totals, counts):
+    aggregates = [(key_fields(key), {'count': count, 'total': total, 'totalSquares': squares})
+                  for key, (count, total, squares) in sorted(totals.items(), key=sort_key)
+                  if count or total or squares]
+    answer_counts = [(dict(key_fields(key[:5]), answer=key[5]), {'count': count})
+                     for key, count in sorted(counts.items(), key=sort_key) if count]
+    with transaction.atomic():
+        add_to_rows(ResponseAggregate, aggregates)
+        add_to_rows(AnswerCount, answer_counts)
+
+
+def sort_key(item):
+    # Keys in a fixed order, so that concurrent saves lock the rows they share in the same order
+    return tuple('' if part is None else part for part in item[0])
+
+
+def add_to_rows(model, changes):
+    """
+    Adds the amounts of every (fields, amounts) pair to the row with those fields. The
+    existing rows are read and updated in batches and the missing ones inserted in bulk.
+    """
+    if not changes:
+        return
+    identity = [name for name in IDENTITY_FIELDS if name in changes[0][0]]
+    existing = {}
+    # Each key adds a value to the IN list of every identity field
+    for batch in chunks([fields for fields, _ in changes], MAX_PARAMETERS // len(identity)):
+        rows = model.objects.filter(**{name + '__in': {fields[name] for fields in batch} for name in identity})
+        for row in rows.values_list('pk', *identity):
+            existing[tuple(str(value) for value in row[1:])] = row[0]
+
+    found = []
+    missing = []
+    for fields, amounts in changes:
+        pk = existing.get(tuple(str(fields[name]) for name in identity))
+        if pk is None:
+            missing.append((fields, amounts))
+        else:
+            found.append((pk, amounts))
+    update_rows(model, found)
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([model(**dict(fields, **amounts)) for fields, amounts in missing],
+                                          batch_size=rows_per_insert(model))
+        except IntegrityError:
+            # Another save created some of the rows first
+            for fields, amounts in missing:
+                add_to_row(model, fields, **amounts)
+
+
+def update_rows(model, changes):
+    # Adds the amounts to the rows with the given pks, one UPDATE per batch of rows. Each row takes its pk and a
+    # pk and amount for every field.
+    if not changes:
+        return
+    for batch in chunks(changes, MAX_PARAMETERS // (1 + 2 * len(changes[0][1]))):
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{
+            name: F(name) + Case(*[When(pk=pk, then=Value(amounts[name])) for pk, amounts in batch],
+                                 default=Value(0), output_field=model._meta.get_field(name))
+            for name in batch[0][1]})
+
+
+def add_to_row(model, fields, **amounts):
+    # Adds the amounts to the row with the given fields, creating it if there is none yet
+    changes = {name: F(name) + amount for name, amount in amounts.items()}
+    if model.objects.filter(**fields).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**dict(fields, **amounts))
+    except IntegrityError:
+        # Another save created the row first
+        model.objects.filter(**fields).update(**changes)
+
+
+def rebuild_aggregates(round_pk):
+    """Recomputes every total of a round from its latest answers, which an archived round keeps in its archive."""
+    archive = archive_of(round_pk)
+    if archive is not None:
+        responses = archived_latest(archive)
+        types = question_types(responses)
+    else:
+        responses = LatestResponse.objects.filter(roundDetail_id=round_pk).only(
+            'roundDetail', 'user', 'question', 'label', 'subjectUser', 'answer').iterator()
+        types = {str(pk): name for pk, name in Question.objects.filter(
+            questionType__name__in=COUNTED_TYPES, latestresponse__roundDetail_id=round_pk).distinct().values_list(
+            'pk', 'questionType__name')}
+    teams = {str(user_id): team_name for user_id, team_name in TeamDetail.objects.filter(
+        roundDetail_id=round_pk).values_list('user_id', 'teamName')}
+
+    totals = {}
+    counts = {}
+    tally(responses, 1, types, lambda response: teams.get(str(response.user_id)), totals, counts)
+    with transaction.atomic():
+        ResponseAggregate.objects.filter(roundDetail_id=round_pk).delete()
+        AnswerCount.objects.filter(roundDetail_id=round_pk).delete()
+        ResponseAggregate.objects.bulk_create([
+            ResponseAggregate(count=count, total=total, totalSquares=squares, **key_fields(key))
+            for key, (count, total, squares) in totals.items() if count], batch_size=rows_per_insert(ResponseAggregate))
+        AnswerCount.objects.bulk_create([
+            AnswerCount(answer=key[5], count=count, **key_fields(key[:5]))
+            for key, count in counts.items() if count], batch_size=rows_per_insert(AnswerCount))
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from peer_review.roundArchive import archive_round, rounds_to_archive
+
+
+class Command(BaseCommand):
+    help = "Moves the responses of rounds that ended more than ARCHIVE_AFTER_DAYS days ago into compressed " \
+           "archive files and removes them from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Archive rounds that ended more than this many days ago")
+        parser.add_argument('--dry-run', action='store_true', help="List the rounds without archiving them")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="Compact the database afterwards so it gives the freed space back")
+
+    def handle(self, *args, **options):
+        days = settings.ARCHIVE_AFTER_DAYS if options['days'] is None else options['days']
+        rounds = list(rounds_to_archive(days))
+        if options['dry_run']:
+            for round_detail in rounds:
+                self.stdout.write("%s (ended %s)" % (round_detail.name, round_detail.endingDate.date()))
+            self.stdout.write("%d rounds to archive" % len(rounds))
+            return
+
+        self.stdout.write("%-30s %10s %10s %12s" % ("Round", "Responses", "Current", "Bytes"))
+        for round_detail in rounds:
+            archive = archive_round(round_detail)
+            self.stdout.write("%-30s %10d %10d %12d" % (round_detail.name[:30], archive.responseCount,
+                                                        archive.latestCount, archive.size))
+        self.stdout.write("Archived %d rounds" % len(rounds))
+
+        if options['vacuum'] and rounds and connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
@@ -0,0 +1,123 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from peer_review.batches import chunks, rows_per_insert
+from peer_review.models import Question, QuestionType, QuestionGrouping, RoundDetail, User, TeamDetail, Response, \
+    LatestResponse, item_key
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seeds a round with answers inside a transaction that is rolled back afterwards, then prints the " \
+           "query plan and timing of the Response and TeamDetail hot-path queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--responses', type=int, default=100000, help="Number of Response rows to seed")
+        parser.add_argument('--students', type=int, default=200, help="Number of students in the round")
+        parser.add_argument('--team-size', type=int, default=5)
+        parser.add_argument('--questions', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per query; the best time is reported")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                sample = self.seed(options)
+                self.run(sample, options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        now = timezone.now()
+        round_detail = RoundDetail.objects.create(name='benchmark', startingDate=now, endingDate=now + timedelta(7),
+                                                  description='Benchmark round')
+        question_type = QuestionType.objects.create(name='Rate')
+        grouping = QuestionGrouping.objects.create(grouping='Rest')
+        questions = [Question.objects.create(questionText='Benchmark question ' + str(i),
+                                             questionLabel='benchmark-' + str(i), pubDate=now,
+                                             questionType=question_type, questionGrouping=grouping)
+                     for i in range(options['questions'])]
+
+        users = [User(user_id='bench' + str(i), email='bench' + str(i) + '@example.com', name='Bench',
+                      surname=str(i)) for i in range(options['students'])]
+        User.objects.bulk_create(users)
+        team_size = options['team_size']
+        TeamDetail.objects.bulk_create([TeamDetail(user=user, roundDetail=round_detail,
+                                                   teamName='team' + str(i // team_size))
+                                        for i, user in enumerate(users)])
+
+        # Every student repeatedly saves a rating of each teammate for each question
+        responses = []
+        batch_id = 0
+        while len(responses) < options['responses']:
+            for i, user in enumerate(users):
+                team_start = i - i % team_size
+                teammates = [other for other in users[team_start:team_start + team_size] if other is not user]
+                for question in questions:
+                    batch_id += 1
+                    for subject in teammates:
+                        responses.append(Response(batch_id=batch_id, question=question, roundDetail=round_detail,
+                                                  user=user, subjectUser=subject, answer=str(batch_id % 100)))
+        responses = responses[:options['responses']]
+        Response.objects.bulk_create(responses, batch_size=rows_per_insert(Response))
+
+        latest_ids = list(Response.objects.filter(roundDetail=round_detail).values(
+            'question_id', 'user_id', 'label_id', 'subjectUser_id').annotate(
+            max_id=Max('id')).values_list('max_id', flat=True))
+        for batch in chunks(latest_ids):
+            LatestResponse.objects.bulk_create([
+                LatestResponse(roundDetail_id=r.roundDetail_id, user_id=r.user_id, question_id=r.question_id,
+                               label_id=r.label_id, subjectUser_id=r.subjectUser_id, response_id=r.id,
+                               itemKey=item_key(r.label_id, r.subjectUser_id), batch_id=r.batch_id, answer=r.answer)
+                for r in Response.objects.filter(id__in=batch)])
+
+        self.stdout.write("Seeded %d responses (%d latest answers) for %d students" % (
+            len(responses), len(latest_ids), len(users)))
+        return {'round': round_detail, 'user': users[0], 'question': questions[0]}
+
+    def run(self, sample, repeat):
+        round_detail, user, question = sample['round'], sample['user'], sample['question']
+        team_name = TeamDetail.objects.get(user=user, roundDetail=round_detail).teamName
+        queries = [
+            ("History of one question for a user",
+             Response.objects.filter(user=user, roundDetail=round_detail, question=question).order_by('-batch_id')),
+            ("Newest answer ids for a round (GROUP BY)",
+             Response.objects.filter(roundDetail=round_detail).values(
+                 'question_id', 'user_id', 'label_id', 'subjectUser_id').annotate(max_id=Max('id'))),
+            ("Latest answers of a user for one question",
+             LatestResponse.objects.filter(user=user, roundDetail=round_detail, question=question)),
+            ("Latest answers for a round export",
+             LatestResponse.objects.filter(roundDetail=round_detail).order_by(
+                 'user_id', 'question_id', 'label_id', 'subjectUser_id')),
+            ("Team of a user for a round",
+             TeamDetail.objects.filter(user=user, roundDetail=round_detail)),
+            ("Members of a team",
+             TeamDetail.objects.filter(roundDetail=round_detail, teamName=team_name)),
+        ]
+        for title, queryset in queries:
+            self.stdout.write("\n" + title)
+            for line in self.explain(queryset):
+                self.stdout.write("    " + line)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = len(list(queryset.all()))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write("    %d rows in %.2f ms" % (rows, best * 1000))
+
+    @staticmethod
+    def explain(queryset):
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
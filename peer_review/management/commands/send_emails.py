@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from peer_review.emailOutbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Delivers the emails waiting in the outbox. With --loop it keeps polling the outbox instead of " \
+           "stopping once nothing is due."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep delivering emails as they are queued")
+        parser.add_argument('--interval', type=float, default=10, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            attempted = send_queued_emails()
+            total += attempted
+            if attempted:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write("Attempted %d emails" % total)
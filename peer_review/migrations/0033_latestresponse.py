@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:07
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def item_key(label_id, subject_user_id):
+    # Same as peer_review.models.item_key, which historical models do not carry
+    return '%s:%s' % ('' if label_id is None else label_id, '' if subject_user_id is None else subject_user_id)
+
+
+def fill_latest_responses(apps, schema_editor):
+    # The most recent Response to each round/user/question/label/subjectUser becomes its latest answer
+    Response = apps.get_model('peer_review', 'Response')
+    LatestResponse = apps.get_model('peer_review', 'LatestResponse')
+    latest_ids = Response.objects.values('roundDetail_id', 'user_id', 'question_id', 'label_id',
+                                         'subjectUser_id').annotate(max_id=Max('id')).values_list('max_id', flat=True)
+    latest_ids = list(latest_ids)
+    for start in range(0, len(latest_ids), 500):
+        responses = Response.objects.filter(id__in=latest_ids[start:start + 500])
+        LatestResponse.objects.bulk_create([
+            LatestResponse(roundDetail_id=response.roundDetail_id,
+                           user_id=response.user_id,
+                           question_id=response.question_id,
+                           label_id=response.label_id,
+                           subjectUser_id=response.subjectUser_id,
+                           response_id=response.id,
+                           itemKey=item_key(response.label_id, response.subjectUser_id),
+                           batch_id=response.batch_id,
+                           answer=response.answer)
+            for response in responses])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0032_auto_20170714_0818'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('itemKey', models.CharField(default=':', max_length=40)),
+                ('batch_id', models.IntegerField()),
+                ('answer', models.CharField(max_length=300)),
+                ('label', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='peer_review.Label')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.Question')),
+                ('response', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='peer_review.Response')),
+                ('roundDetail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.RoundDetail')),
+                ('subjectUser', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='latestSubjectResponses', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='latestResponses', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='latestresponse',
+            unique_together=set([('roundDetail', 'user', 'question', 'itemKey')]),
+        ),
+        migrations.RunPython(fill_latest_responses, migrations.RunPython.noop),
+    ]
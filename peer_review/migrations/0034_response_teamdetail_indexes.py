@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:08
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0033_latestresponse'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='response',
+            index_together=set([('user', 'roundDetail', 'question', 'batch_id'), ('roundDetail', 'question', 'user', 'label', 'subjectUser')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='teamdetail',
+            index_together=set([('user', 'roundDetail'), ('roundDetail', 'teamName')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0034_response_teamdetail_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exportFormat', models.CharField(default='csv', max_length=10)),
+                ('status', models.CharField(choices=[('Queued', 'Queued'), ('Running', 'Running'), ('Done', 'Done'), ('Failed', 'Failed')], default='Queued', max_length=20)),
+                ('progress', models.IntegerField(default=0)),
+                ('responseStamp', models.CharField(max_length=100)),
+                ('dumpFile', models.CharField(blank=True, max_length=300)),
+                ('error', models.CharField(blank=True, max_length=300)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('roundDetail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.RoundDetail')),
+            ],
+        ),
+    ]
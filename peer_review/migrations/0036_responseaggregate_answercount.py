@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:24
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+import django.db.models.deletion
+
+
+def item_key(label_id, subject_user_id):
+    # Same as peer_review.models.item_key, which historical models do not carry
+    return '%s:%s' % ('' if label_id is None else label_id, '' if subject_user_id is None else subject_user_id)
+
+
+def fill_aggregates(apps, schema_editor):
+    # Counts the latest answers per team and answer, then derives the numeric totals from those counts
+    LatestResponse = apps.get_model('peer_review', 'LatestResponse')
+    ResponseAggregate = apps.get_model('peer_review', 'ResponseAggregate')
+    AnswerCount = apps.get_model('peer_review', 'AnswerCount')
+    rows = LatestResponse.objects.filter(
+        question__questionType__name__in=('Rate', 'Rank', 'Choice'),
+        user__teamdetail__roundDetail=F('roundDetail')).values(
+        'roundDetail_id', 'user__teamdetail__teamName', 'question_id', 'question__questionType__name', 'label_id',
+        'subjectUser_id', 'answer').annotate(count=Count('id')).order_by()
+
+    counts = []
+    totals = {}
+    for row in rows:
+        fields = {'roundDetail_id': row['roundDetail_id'], 'teamName': row['user__teamdetail__teamName'],
+                  'question_id': row['question_id'], 'label_id': row['label_id'],
+                  'subjectUser_id': row['subjectUser_id'],
+                  'itemKey': item_key(row['label_id'], row['subjectUser_id'])}
+        counts.append(AnswerCount(answer=row['answer'], count=row['count'], **fields))
+        question_type = row['question__questionType__name']
+        try:
+            value = float(row['answer'])
+        except ValueError:
+            continue
+        if question_type == 'Rank':
+            value += 1
+        elif question_type != 'Rate' or value < 0:
+            continue
+        total = totals.setdefault(tuple(sorted(fields.items())), [0, 0.0, 0.0])
+        total[0] += row['count']
+        total[1] += row['count'] * value
+        total[2] += row['count'] * value * value
+
+    AnswerCount.objects.bulk_create(counts, batch_size=100)
+    ResponseAggregate.objects.bulk_create([
+        ResponseAggregate(count=count, total=total, totalSquares=squares, **dict(fields))
+        for fields, (count, total, squares) in totals.items()], batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0035_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('teamName', models.CharField(max_length=200)),
+                ('answer', models.CharField(max_length=300)),
+                ('count', models.IntegerField(default=0)),
+                ('label', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='peer_review.Label')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.Question')),
+                ('roundDetail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.RoundDetail')),
+                ('subjectUser', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subjectAnswerCounts', to=settings.AUTH_USER_MODEL)),
+                ('itemKey', models.CharField(default=':', max_length=40)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResponseAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('teamName', models.CharField(max_length=200)),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('totalSquares', models.FloatField(default=0)),
+                ('label', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='peer_review.Label')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.Question')),
+                ('roundDetail', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='peer_review.RoundDetail')),
+                ('subjectUser', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subjectAggregates', to=settings.AUTH_USER_MODEL)),
+                ('itemKey', models.CharField(default=':', max_length=40)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='responseaggregate',
+            unique_together=set([('roundDetail', 'teamName', 'question', 'itemKey')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='answercount',
+            unique_together=set([('roundDetail', 'teamName', 'question', 'itemKey', 'answer')]),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
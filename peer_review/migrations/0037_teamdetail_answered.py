@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_answers(apps, schema_editor):
+    # Counts the items of their round's questionnaire each member currently has an answer for, and sets the status
+    # that follows from it
+    RoundDetail = apps.get_model('peer_review', 'RoundDetail')
+    TeamDetail = apps.get_model('peer_review', 'TeamDetail')
+    QuestionOrder = apps.get_model('peer_review', 'QuestionOrder')
+    Label = apps.get_model('peer_review', 'Label')
+    LatestResponse = apps.get_model('peer_review', 'LatestResponse')
+    for round_pk, questionnaire_pk in RoundDetail.objects.exclude(questionnaire=None).values_list(
+            'pk', 'questionnaire_id'):
+        groupings = dict(QuestionOrder.objects.filter(questionnaire_id=questionnaire_pk).values_list(
+            'question_id', 'question__questionGrouping__grouping'))
+        labels = set(Label.objects.filter(question_id__in=list(groupings)).values_list('question_id', 'pk'))
+        members = list(TeamDetail.objects.filter(roundDetail_id=round_pk).values_list('pk', 'user_id', 'teamName'))
+        teams = {}
+        for _, user_id, team_name in members:
+            teams.setdefault(team_name, set()).add(str(user_id))
+        items = {}
+        for user_id, question_pk, label_pk, subject_pk in LatestResponse.objects.filter(
+                roundDetail_id=round_pk, question_id__in=list(groupings)).values_list(
+                'user_id', 'question_id', 'label_id', 'subjectUser_id'):
+            items.setdefault(str(user_id), set()).add((question_pk, groupings[question_pk], label_pk,
+                                                       None if subject_pk is None else str(subject_pk)))
+        # The answers a member of each team has to give: one per label, per teammate or per question
+        label_counts = {}
+        for question_pk, _ in labels:
+            label_counts[question_pk] = label_counts.get(question_pk, 0) + 1
+        required = {}
+        for team_name, user_ids in teams.items():
+            required[team_name] = 0
+            for question_pk, grouping in groupings.items():
+                if grouping == 'Label':
+                    required[team_name] += label_counts.get(question_pk, 0)
+                elif grouping == 'All':
+                    required[team_name] += len(user_ids)
+                elif grouping == 'Rest':
+                    required[team_name] += len(user_ids) - 1
+                else:
+                    required[team_name] += 1
+        for pk, user_id, team_name in members:
+            answered = set()
+            for question_pk, grouping, label_pk, subject_pk in items.get(str(user_id), ()):
+                if grouping == 'Label':
+                    if (question_pk, label_pk) in labels:
+                        answered.add((question_pk, label_pk))
+                elif grouping in ('All', 'Rest'):
+                    if subject_pk in teams[team_name] and (grouping == 'All' or subject_pk != str(user_id)):
+                        answered.add((question_pk, subject_pk))
+                else:
+                    answered.add((question_pk, None))
+            if not answered:
+                status = 'Not attempted'
+            elif len(answered) >= required[team_name]:
+                status = 'Completed'
+            else:
+                status = 'In progress'
+            TeamDetail.objects.filter(pk=pk).update(answered=len(answered), status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0036_responseaggregate_answercount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teamdetail',
+            name='answered',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_answers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0038_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRound',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archiveFile', models.CharField(max_length=300)),
+                ('responseCount', models.IntegerField()),
+                ('latestCount', models.IntegerField()),
+                ('lastResponse', models.IntegerField(default=0)),
+                ('size', models.IntegerField(default=0)),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+                ('roundDetail', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='peer_review.RoundDetail')),
+            ],
+        ),
+    ]
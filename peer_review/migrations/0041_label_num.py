@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_labels(apps, schema_editor):
+    # Existing labels were shown in the order they were added, which becomes their position
+    Label = apps.get_model('peer_review', 'Label')
+    positions = {}
+    for pk, question_pk in Label.objects.order_by('pk').values_list('pk', 'question_id'):
+        position = positions.get(question_pk, 0)
+        if position:
+            Label.objects.filter(pk=pk).update(num=position)
+        positions[question_pk] = position + 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peer_review', '0040_exportjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='choice',
+            options={'ordering': ('num', 'pk')},
+        ),
+        migrations.AlterModelOptions(
+            name='label',
+            options={'ordering': ('num', 'pk')},
+        ),
+        migrations.AddField(
+            model_name='label',
+            name='num',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(number_labels, migrations.RunPython.noop),
+    ]
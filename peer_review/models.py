@@ -5,6 +5,8 @@ from django.core.management import call_command
 from django.db import models
 from django.utils import timezone
 
+from peer_review.passwordHashing import hash_passwords
+
 
 class Document(models.Model):
     doc_file = models.FileField(upload_to='documents')
@@ -43,26 +45,38 @@ class Question(models.Model):
         call_command('dumpdata', 'Question', format='json', indent=4, stdout=output)
         output.close()
 
+    # These go through the related managers so that items prefetched with the question are used without a query
+
     def get_rank(self):
-        return Rank.objects.get(question=self)
+        return Question.get_item(self.rank_set, Rank)
 
     def get_labels(self):
-        return Label.objects.filter(question=self)
+        return self.label_set.all()
 
     def get_choices(self):
-        return Choice.objects.filter(question=self)
+        return self.choice_set.all()
 
     def get_rate(self):
-        return Rate.objects.get(question=self)
+        return Question.get_item(self.rate_set, Rate)
 
     def get_freeform_item(self):
-        return FreeformItem.objects.get(question=self)
+        return Question.get_item(self.freeformitem_set, FreeformItem)
+
+    @staticmethod
+    def get_item(related_manager, model):
+        items = list(related_manager.all())
+        if not items:
+            raise model.DoesNotExist(model.__name__ + " matching query does not exist.")
+        return items[0]
 
 
 class Choice(models.Model):
     question = models.ForeignKey(Question)
     choiceText = models.CharField(max_length=200)
-    num = models.IntegerField(default=1)
+    num = models.IntegerField(default=1)  # Position among the question's choices
+
+    class Meta:
+        ordering = ('num', 'pk')
 
     def __str__(self):
         return self.choiceText
@@ -106,6 +120,10 @@ class Rate(models.Model):
 class Label(models.Model):
     question = models.ForeignKey(Question)
     labelText = models.CharField(max_length=200)
+    num = models.IntegerField(default=0)  # Position among the question's labels
+
+    class Meta:
+        ordering = ('num', 'pk')
 
     def __str__(self):
         return self.labelText
@@ -124,6 +142,12 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def bulk_create_users(self, users, passwords, batch_size=None):
+        # Saves unsaved users with the given passwords, hashing the passwords in parallel
+        for user, password in zip(users, hash_passwords(passwords)):
+            user.password = password
+        return self.bulk_create(users, batch_size=batch_size)
+
     def create_superuser(self, email, password, **kwargs):
         user = self.model(
             email=email,
@@ -217,6 +241,14 @@ class TeamDetail(models.Model):
         (COMPLETED, "Completed")
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=NOT_ATTEMPTED)
+    # How many of the questionnaire's items the user currently has an answer for, recounted on every save
+    answered = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = [
+            ('user', 'roundDetail'),  # A user's team for a round
+            ('roundDetail', 'teamName'),  # The members of a team
+        ]
 
     def __str__(self):
         return self.roundDetail.description + " " + self.teamName + " (" + self.user.surname + ", " \
@@ -231,7 +263,7 @@ class TeamDetail(models.Model):
         return self.status == TeamDetail.IN_PROGRESS
 
     def is_completed(self):
-        return self.is_in_progress() and self.is_in_past();
+        return self.status == TeamDetail.COMPLETED
 
     def is_not_attempted(self):
         return self.status == TeamDetail.NOT_ATTEMPTED
@@ -255,6 +287,12 @@ class Response(models.Model):
     label = models.ForeignKey(Label, null=True)  # The label the question is about.
     answer = models.CharField(max_length=300)
 
+    class Meta:
+        index_together = [
+            ('user', 'roundDetail', 'question', 'batch_id'),  # A user's answer history for a question
+            ('roundDetail', 'question', 'user', 'label', 'subjectUser'),  # The newest answer to each item of a round
+        ]
+
     def __str__(self):
         if self.label is not None:
             return self.label.labelText
@@ -262,3 +300,158 @@ class Response(models.Model):
             return self.subjectUser.name + ' ' + self.subjectUser.surname
         else:
             return self.answer
+
+
+def item_key(label_id, subject_user_id):
+    # The label and subject user an answer is about as one non-null value. Unique constraints treat NULLs as
+    # distinct, so keys that leave the label or subject user empty are only kept unique through this column.
+    return '%s:%s' % ('' if label_id is None else label_id, '' if subject_user_id is None else subject_user_id)
+
+
+class LatestResponse(models.Model):
+    # The current answer for every round/user/question/label/subjectUser. Response keeps the full history, this
+    # table is updated in the same transaction as every save so the current answers are a direct lookup.
+    roundDetail = models.ForeignKey(RoundDetail)
+    user = models.ForeignKey(User, null=False, related_name="latestResponses")
+    question = models.ForeignKey(Question)
+    label = models.ForeignKey(Label, null=True)
+    subjectUser = models.ForeignKey(User, null=True, related_name="latestSubjectResponses")
+    response = models.OneToOneField(Response)  # The history row holding the answer
+    itemKey = models.CharField(max_length=40, default=':')  # item_key of the label and subject user
+    batch_id = models.IntegerField()
+    answer = models.CharField(max_length=300)
+
+    class Meta:
+        unique_together = ('roundDetail', 'user', 'question', 'itemKey')
+
+    def save(self, *args, **kwargs):
+        self.itemKey = item_key(self.label_id, self.subjectUser_id)
+        super(LatestResponse, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.answer
+
+
+class ResponseAggregate(models.Model):
+    # Running totals of the numeric (Rate and Rank) latest answers about one subject user or label of a question,
+    # given by the members of one team. Kept up to date as answers are saved, so the report never rescans them.
+    roundDetail = models.ForeignKey(RoundDetail)
+    teamName = models.CharField(max_length=200)  # The team of the users who answered
+    question = models.ForeignKey(Question)
+    label = models.ForeignKey(Label, null=True)
+    subjectUser = models.ForeignKey(User, null=True, related_name="subjectAggregates")
+    itemKey = models.CharField(max_length=40, default=':')  # item_key of the label and subject user
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)  # Sum of the answers; Rank positions count from 1
+    totalSquares = models.FloatField(default=0)  # Sum of the squared answers
+
+    class Meta:
+        unique_together = ('roundDetail', 'teamName', 'question', 'itemKey')
+
+    def save(self, *args, **kwargs):
+        self.itemKey = item_key(self.label_id, self.subjectUser_id)
+        super(ResponseAggregate, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.teamName + " " + str(self.question_id) + " (" + str(self.count) + ")"
+
+
+class AnswerCount(models.Model):
+    # How many members of a team currently give a particular answer to a Rate, Rank or Choice question
+    roundDetail = models.ForeignKey(RoundDetail)
+    teamName = models.CharField(max_length=200)
+    question = models.ForeignKey(Question)
+    label = models.ForeignKey(Label, null=True)
+    subjectUser = models.ForeignKey(User, null=True, related_name="subjectAnswerCounts")
+    itemKey = models.CharField(max_length=40, default=':')  # item_key of the label and subject user
+    answer = models.CharField(max_length=300)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('roundDetail', 'teamName', 'question', 'itemKey', 'answer')
+
+    def save(self, *args, **kwargs):
+        self.itemKey = item_key(self.label_id, self.subjectUser_id)
+        super(AnswerCount, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.answer + " (" + str(self.count) + ")"
+
+
+class ExportJob(models.Model):
+    # A round dump produced in the background. Finished dumps are reused for as long as the round's
+    # responses still match responseStamp.
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed")
+    )
+    roundDetail = models.ForeignKey(RoundDetail)
+    exportFormat = models.CharField(max_length=10, default='csv')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.IntegerField(default=0)  # Percentage of the round's answers written so far
+    responseStamp = models.CharField(max_length=100)  # The state of the round's responses when the job was queued
+    dumpFile = models.CharField(max_length=300, blank=True)  # Path of the finished dump
+    error = models.CharField(max_length=300, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    heartbeat = models.DateTimeField(default=timezone.now)  # Last time the job was queued or reported progress
+    finished = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.roundDetail.name + " " + self.exportFormat + " (" + self.status + ")"
+
+    def is_done(self):
+        return self.status == ExportJob.DONE
+
+
+class ArchivedRound(models.Model):
+    # A finished round whose responses were moved out of the Response and LatestResponse tables into a compressed
+    # file. The report totals and completion counts of the round stay in the database.
+    roundDetail = models.OneToOneField(RoundDetail)
+    archiveFile = models.CharField(max_length=300)  # Path of the archive
+    responseCount = models.IntegerField()  # Responses in the archive, including replaced answers
+    latestCount = models.IntegerField()  # Current answers in the archive
+    lastResponse = models.IntegerField(default=0)  # Highest archived Response id
+    size = models.IntegerField(default=0)  # Size of the archive in bytes
+    archived = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.roundDetail.name + " (" + str(self.responseCount) + " responses)"
+
+
+class OutgoingEmail(models.Model):
+    # An email waiting in the outbox. The background sender delivers queued emails once nextAttempt has passed,
+    # pushing nextAttempt further back after every failed attempt.
+    QUEUED = "Queued"
+    SENDING = "Sending"
+    SENT = "Sent"
+    FAILED = "Failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed")
+    )
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    fromAddress = models.EmailField(max_length=254)
+    toAddress = models.EmailField(max_length=254)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(default=timezone.now)
+    error = models.CharField(max_length=300, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True)
+
+    class Meta:
+        index_together = [
+            ['status', 'nextAttempt'],
+        ]
+
+    def __str__(self):
+        return self.toAddress + ": " + self.subject + " (" + self.status + ")"
@@ -0,0 +1,50 @@
+"""
+Hashes many passwords at once. Each hash is deliberately slow, so creating a
+whole class of users hashes their passwords in a pool of processes, one per
+core up to PASSWORD_HASH_WORKERS, rather than one after the other.
+
+The pool's processes are spawned, not forked: the web process runs threads
+(export jobs and the email outbox among them), and a forked copy of a
+threaded process can inherit a lock some other thread held and never
+released. Spawned processes start from a fresh interpreter and only import
+what hashing needs. Under WSGI servers such as uWSGI or mod_wsgi the
+interpreter is embedded and sys.executable is not Python, so spawned
+processes could never start; the pool is then not used at all. Where a pool
+cannot be started, or stops handing back hashes for PASSWORD_HASH_TIMEOUT
+seconds, the remaining passwords are hashed in the calling process instead.
+"""
+import multiprocessing
+import multiprocessing.spawn
+import os
+import pickle
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+# The most passwords handed to a worker at once, so that each hash comes back well within the timeout
+MAX_CHUNK = 10
+
+
+def can_spawn():
+    # Whether spawned processes would run a Python interpreter, which an embedding server's binary is not
+    name = os.path.basename(os.fsdecode(multiprocessing.spawn.get_executable() or '')).lower()
+    return name.startswith(('python', 'pypy'))
+
+
+def hash_passwords(passwords):
+    """Returns the hashes of the passwords, in the same order."""
+    passwords = list(passwords)
+    workers = min(settings.PASSWORD_HASH_WORKERS, os.cpu_count() or 1, len(passwords))
+    hashes = []
+    if workers > 1 and can_spawn():
+        try:
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                results = pool.imap(make_password, passwords,
+                                    chunksize=max(1, min(MAX_CHUNK, len(passwords) // (workers * 4))))
+                for _ in passwords:
+                    hashes.append(results.next(settings.PASSWORD_HASH_TIMEOUT))
+        except (OSError, RuntimeError, pickle.PicklingError, multiprocessing.ProcessError):
+            # Processes cannot be started or bootstrapped here, or stopped answering (a TimeoutError is a
+            # ProcessError); the rest are hashed in this process instead
+            pass
+    return hashes + [make_password(password) for password in passwords[len(hashes):]]
@@ -0,0 +1,166 @@
+"""
+WebPA-style peer assessment. Every student's Rate and Rank answers about their
+teammates (questions grouped "Rest" or "All") are turned into scores. Each
+assessor's scores on a question are first divided by their total on that
+question, so a 0-100 rating weighs no more than a ranking, and then by their
+total over all questions, so that every assessor hands out exactly one point.
+A student's WebPA score is the sum of the fractions they
+received, and their adjustment factor scales that score by the team size over
+the number of members who assessed:
+
+    factor = received * team size / assessors
+
+so the factors of a team add up to its size whoever did not take part. Rank
+positions score the number of ranked members less the position, which gives
+the top position the most points.
+
+The factors of a round are computed in one vectorised NumPy pass, with a pure
+Python fallback, and cached under a stamp of the round's responses, its teams
+and the questionnaire version.
+"""
+import csv
+import io
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LatestResponse, RoundDetail, TeamDetail
+from .questionnaireCache import current_version, get_questionnaire
+from .responseStore import response_stamp
+from .roundArchive import archive_of, archived_answers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SCORED_TYPES = ('Rate', 'Rank')
+SCORED_GROUPINGS = ('Rest', 'All')
+
+SCORES_HEADER = ['Team', 'UserID', 'Name', 'Surname', 'Score', 'Factor']
+
+
+def peer_scores(round_pk):
+    """
+    Returns the peer assessment of a round: {'questions': [...], 'teams': [...]} where each
+    team has its size, the number of members who assessed and every member's score and
+    factor. Factors are None for teams in which nobody assessed.
+    """
+    round_detail = RoundDetail.objects.get(pk=round_pk)
+    members = list(TeamDetail.objects.filter(roundDetail=round_detail).order_by(
+        'teamName', 'user__surname', 'user__name').values_list('user_id', 'teamName', 'user__name', 'user__surname'))
+    # Moving students between teams changes the factors without changing any response
+    teams_stamp = zlib.crc32(repr([member[:2] for member in members]).encode('utf-8'))
+    key = ':'.join(['peer-scores', str(round_pk), response_stamp(round_pk), str(teams_stamp), str(current_version())])
+    scores = cache.get(key)
+    if scores is None:
+        scores = compute_scores(round_detail, members)
+        cache.set(key, scores, settings.PEER_SCORE_CACHE_AGE)
+    return scores
+
+
+def compute_scores(round_detail, members):
+    compiled = get_questionnaire(round_detail.questionnaire_id)
+    questions = {pk: question.questionType.name for pk, question in compiled.questions.items()
+                 if question.questionType.name in SCORED_TYPES
+                 and question.questionGrouping.grouping in SCORED_GROUPINGS}
+    team_of = {user_id: team_name for user_id, team_name, _, _ in members}
+
+    archive = archive_of(round_detail.pk)
+    if archive is not None:
+        rows = [(user_id, question_id, subject_user_id, answer) for _, user_id, question_id, _, subject_user_id,
+                answer in archived_answers(archive) if question_id in questions]
+    else:
+        rows = LatestResponse.objects.filter(roundDetail=round_detail, question_id__in=list(questions)).values_list(
+            'user_id', 'question_id', 'subjectUser_id', 'answer')
+    assessors, subjects, points = answer_points(rows, questions, team_of)
+    received, assessed = webpa_scores(list(team_of), assessors, subjects, points)
+
+    teams = []
+    for user_id, team_name, name, surname in members:
+        if not teams or teams[-1]['teamName'] != team_name:
+            teams.append({'teamName': team_name, 'size': 0, 'assessors': 0, 'members': []})
+        team = teams[-1]
+        team['size'] += 1
+        team['assessors'] += 1 if user_id in assessed else 0
+        team['members'].append({'user_id': user_id, 'name': name, 'surname': surname,
+                                'score': received.get(user_id, 0.0)})
+    for team in teams:
+        for member in team['members']:
+            member['factor'] = member['score'] * team['size'] / team['assessors'] if team['assessors'] else None
+    return {'questions': sorted(questions), 'teams': teams}
+
+
+def answer_points(rows, questions, team_of):
+    """
+    Turns (assessor, question, subject, answer) rows into the points each assessor gave each
+    teammate, as the fraction of the points the assessor gave on that question. Skipped
+    ratings, unreadable answers and subjects outside the assessor's team give no points.
+    """
+    rows = [row for row in rows
+            if row[2] is not None and team_of.get(row[0]) is not None and team_of.get(row[0]) == team_of.get(row[2])]
+    ranked = {}
+    for user_id, question_pk, _, _ in rows:
+        if questions[question_pk] == 'Rank':
+            ranked[(user_id, question_pk)] = ranked.get((user_id, question_pk), 0) + 1
+
+    scored = []
+    totals = {}
+    for user_id, question_pk, subject_id, answer in rows:
+        try:
+            value = float(answer)
+        except (TypeError, ValueError):
+            continue
+        if questions[question_pk] == 'Rank':
+            value = ranked[(user_id, question_pk)] - value
+        if value <= 0:
+            continue
+        scored.append((user_id, question_pk, subject_id, value))
+        totals[(user_id, question_pk)] = totals.get((user_id, question_pk), 0.0) + value
+
+    assessors = [user_id for user_id, _, _, _ in scored]
+    subjects = [subject_id for _, _, subject_id, _ in scored]
+    points = [value / totals[(user_id, question_pk)] for user_id, question_pk, _, value in scored]
+    return assessors, subjects, points
+
+
+def webpa_scores(user_ids, assessors, subjects, points):
+    """
+    Returns the WebPA score each user received and the set of users who assessed, given
+    parallel lists of the assessor, subject and points of every scored answer.
+    """
+    if numpy is None:
+        return python_webpa_scores(assessors, subjects, points)
+    codes = {user_id: code for code, user_id in enumerate(user_ids)}
+    assessor_codes = numpy.array([codes[user_id] for user_id in assessors], dtype=numpy.int64)
+    subject_codes = numpy.array([codes[user_id] for user_id in subjects], dtype=numpy.int64)
+    points = numpy.array(points, dtype=numpy.float64)
+
+    given = numpy.bincount(assessor_codes, weights=points, minlength=len(codes))
+    fractions = points / given[assessor_codes] if len(points) else points
+    received = numpy.bincount(subject_codes, weights=fractions, minlength=len(codes))
+    return ({user_id: float(received[code]) for user_id, code in codes.items()},
+            {user_id for user_id, code in codes.items() if given[code] > 0})
+
+
+def python_webpa_scores(assessors, subjects, points):
+    given = {}
+    for user_id, value in zip(assessors, points):
+        given[user_id] = given.get(user_id, 0.0) + value
+    received = {}
+    for user_id, subject_id, value in zip(assessors, subjects, points):
+        received[subject_id] = received.get(subject_id, 0.0) + value / given[user_id]
+    return received, set(given)
+
+
+def scores_csv(round_pk):
+    """The peer assessment of a round as CSV text, one line per student."""
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=',', quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow(SCORES_HEADER)
+    for team in peer_scores(round_pk)['teams']:
+        for member in team['members']:
+            writer.writerow([team['teamName'], member['user_id'], member['name'], member['surname'],
+                             '%.4f' % member['score'], '' if member['factor'] is None else '%.4f' % member['factor']])
+    return output.getvalue()
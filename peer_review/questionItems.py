@@ -0,0 +1,138 @@
+"""
+Brings the items of a question (its labels, choices and Rank, Rate or
+Freeform settings) in line with the question form. Items that did not change
+keep their rows, so answers about a label survive edits to the question's
+other labels. Labels and choices are shown in the order of their num, so
+kept ones are renumbered to their new position. New items are inserted in
+bulk and removed ones deleted with one query per kind. Removing labels or changing the grouping of a question
+changes what the rounds that ask it have been answered, so their totals and
+progress are recomputed in the same transaction.
+
+The pks of QuestionType and QuestionGrouping rows are remembered by name, as
+saving a question only ever looks them up or adds new ones. Deleting one of
+these rows, such as on the admin site, forgets them again.
+"""
+from django.db import transaction
+
+from .liveAggregates import rebuild_aggregates
+from .models import Choice, FreeformItem, Label, QuestionGrouping, QuestionType, Rank, Rate, RoundDetail
+from .teamProgress import recount_round
+
+# The item model that holds the settings of each question type
+ITEM_MODELS = {
+    'Choice': Choice,
+    'Rank': Rank,
+    'Rate': Rate,
+    'Freeform': FreeformItem,
+}
+
+_pks = {}
+
+
+def named_pk(model, field, name):
+    """Returns the pk of the QuestionType or QuestionGrouping with the given name, adding it if there is none."""
+    key = (model, name)
+    if key not in _pks:
+        pk = model.objects.filter(**{field: name}).values_list('pk', flat=True).first()
+        if pk is None:
+            pk = model.objects.create(**{field: name}).pk
+            # The new row only exists for others, and can only be remembered, once it is committed
+            transaction.on_commit(lambda: _pks.setdefault(key, pk))
+            return pk
+        _pks[key] = pk
+    return _pks[key]
+
+
+def forget_named_pks():
+    """Forgets every remembered pk, so the next lookups read them again."""
+    _pks.clear()
+
+
+def type_pk(name):
+    return named_pk(QuestionType, 'name', name)
+
+
+def grouping_pk(grouping):
+    return named_pk(QuestionGrouping, 'grouping', grouping)
+
+
+def matched_texts(rows, texts, field):
+    """
+    Pairs the existing rows with the wanted texts. Returns the rows that have one of the
+    texts, each with its position in texts, the rows left over and the positions of the
+    texts no row has.
+    """
+    unmatched = {}
+    for row in rows:
+        unmatched.setdefault(getattr(row, field), []).append(row)
+    kept = []
+    new = []
+    for position, text in enumerate(texts):
+        if unmatched.get(text):
+            kept.append((unmatched[text].pop(0), position))
+        else:
+            new.append(position)
+    removed = [row for rows in unmatched.values() for row in rows]
+    return kept, removed, new
+
+
+def renumber(model, kept):
+    # Moves the kept rows to their new positions; the rows are ordered by num, so this is their display order
+    for row, position in kept:
+        if row.num != position:
+            model.objects.filter(pk=row.pk).update(num=position)
+
+
+def save_labels(question, texts):
+    """
+    Keeps the labels whose text is still wanted, renumbering them to their new position, and
+    replaces the rest. Returns whether any label was added or removed.
+    """
+    kept, removed, new = matched_texts(question.label_set.all(), texts, 'labelText')
+    if removed:
+        # Answers about a removed label go with it
+        Label.objects.filter(pk__in=[label.pk for label in removed]).delete()
+    renumber(Label, kept)
+    Label.objects.bulk_create([Label(question=question, labelText=texts[position], num=position)
+                               for position in new])
+    return bool(removed or new)
+
+
+def save_choices(question, texts):
+    """Keeps the choices whose text is still wanted, renumbering them to their new position, and replaces the rest."""
+    kept, removed, new = matched_texts(question.choice_set.all(), texts, 'choiceText')
+    if removed:
+        Choice.objects.filter(pk__in=[choice.pk for choice in removed]).delete()
+    renumber(Choice, kept)
+    Choice.objects.bulk_create([Choice(question=question, choiceText=texts[position], num=position)
+                                for position in new])
+
+
+def save_item(model, question, **values):
+    """Sets the values of the single Rank, Rate or FreeformItem of a question."""
+    items = list(model.objects.filter(question=question).order_by('pk'))
+    if not items:
+        model.objects.create(question=question, **values)
+        return
+    if any(getattr(items[0], field) != value for field, value in values.items()):
+        model.objects.filter(pk=items[0].pk).update(**values)
+    if len(items) > 1:
+        model.objects.filter(pk__in=[item.pk for item in items[1:]]).delete()
+
+
+def remove_other_items(question, question_type, question_grouping):
+    """Deletes the items left from a type or grouping the question no longer has. Returns whether labels went."""
+    for name, model in ITEM_MODELS.items():
+        if name != question_type:
+            model.objects.filter(question=question).delete()
+    if question_grouping != 'Label':
+        return Label.objects.filter(question=question).delete()[0] > 0
+    return False
+
+
+def refresh_rounds(question):
+    """Recomputes the totals and progress of every round that asks the question."""
+    for round_pk in RoundDetail.objects.filter(questionnaire__questionorder__question=question).values_list(
+            'pk', flat=True).distinct():
+        rebuild_aggregates(round_pk)
+        recount_round(round_pk)
@@ -0,0 +1,125 @@
+"""
+Caches the structure of questionnaires: the ordered questions of each one with
+their types, groupings, choices, labels, rates, ranks and freeform items. The
+structure rarely changes while a round is running, yet it is needed by every
+questionnaire page, every save and every export.
+
+A compiled questionnaire is kept both in this process and in the Django cache,
+keyed by the questionnaire's pk and a version stamp. Questions are shared
+between questionnaires, so any change to a question or questionnaire replaces
+the single version stamp and with it every cached questionnaire. Saving or
+deleting any of these rows, including through the admin site, replaces the
+stamp; bulk changes that send no signals call questionnaires_changed.
+
+The stamp never expires, so it only changes when questionnaires do. With a
+shared cache backend (such as memcached) a new stamp reaches every process at
+once; processes that each have a cache of their own only see their own edits.
+A cache that keeps nothing (DummyCache) has no stamp, and every questionnaire
+is then compiled when it is needed.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import QuestionOrder, Questionnaire
+
+VERSION_KEY = 'questionnaire-version'
+
+# The most questionnaires kept in this process
+LOCAL_LIMIT = 100
+
+# Questionnaire pk: (version, CompiledQuestionnaire) for the questionnaires this process used most recently, last.
+# Request threads and export workers share it, so it is only used while holding _lock.
+_compiled = OrderedDict()
+_lock = threading.Lock()
+
+
+class CompiledQuestionnaire:
+    """The structure of a questionnaire, loaded once and only read afterwards."""
+
+    def __init__(self, questionnaire, question_orders):
+        self.questionnaire = questionnaire
+        self.question_orders = question_orders
+        self.questions = {order.question.pk: order.question for order in question_orders}
+        self.labels = {label.pk: label for question in self.questions.values() for label in question.get_labels()}
+
+    def question_title(self, question_pk):
+        question = self.questions.get(question_pk)
+        return None if question is None else question.questionLabel
+
+    def label_text(self, label_pk):
+        label = self.labels.get(label_pk)
+        return None if label is None else label.labelText
+
+
+# The question orders of a questionnaire with everything the question templates use, loaded in a fixed
+# number of queries however many questions there are
+def question_orders_for(questionnaire):
+    return QuestionOrder.objects.filter(questionnaire=questionnaire).order_by('order', 'pk').select_related(
+        'question__questionType', 'question__questionGrouping').prefetch_related(
+        'question__choice_set', 'question__label_set', 'question__rate_set', 'question__rank_set',
+        'question__freeformitem_set')
+
+
+def compile_questionnaire(questionnaire_pk):
+    if questionnaire_pk is None:
+        return CompiledQuestionnaire(None, [])
+    questionnaire = Questionnaire.objects.get(pk=questionnaire_pk)
+    return CompiledQuestionnaire(questionnaire, list(question_orders_for(questionnaire)))
+
+
+def current_version():
+    """Returns the version stamp of the cached questionnaires, or None if the cache keeps nothing."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A lost stamp is replaced by a new one, so nothing cached under an older stamp can be picked up again
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_questionnaire(questionnaire_pk):
+    """
+    Returns the compiled questionnaire with the given pk, or an empty one for None.
+    Raises Questionnaire.DoesNotExist if there is no such questionnaire.
+    """
+    if questionnaire_pk is None:
+        return compile_questionnaire(None)
+    version = current_version()
+    if version is None:
+        return compile_questionnaire(questionnaire_pk)
+    with _lock:
+        local = _compiled.get(questionnaire_pk)
+        if local is not None and local[0] == version:
+            _compiled.move_to_end(questionnaire_pk)
+            return local[1]
+
+    key = 'questionnaire:' + str(questionnaire_pk) + ':' + version
+    compiled = cache.get(key)
+    if compiled is None:
+        compiled = compile_questionnaire(questionnaire_pk)
+        cache.set(key, compiled, settings.QUESTIONNAIRE_CACHE_AGE)
+    with _lock:
+        _compiled[questionnaire_pk] = (version, compiled)
+        _compiled.move_to_end(questionnaire_pk)
+        while len(_compiled) > LOCAL_LIMIT:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def questionnaires_changed():
+    """
+    Drops every cached questionnaire. Saving or deleting a single row does this by
+    itself; call it after changing questions, their items or questionnaires in bulk.
+    """
+    new_version()
+    # Inside a transaction another request may cache the old structure again before the commit
+    transaction.on_commit(new_version)
+
+
+def new_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
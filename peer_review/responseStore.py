@@ -0,0 +1,99 @@
+"""
+Writes questionnaire answers. Response is the append-only history of every
+answer ever saved; LatestResponse holds only the current answer for each
+round/user/question/label/subjectUser. Both are written in one transaction,
+together with the running totals of the live report, so readers never see a
+save half applied.
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .batches import chunks
+from .liveAggregates import record_answers
+from .models import Question, Response, LatestResponse, User, item_key
+from .roundArchive import archive_of
+
+def response_key(response):
+    # The round/user/question/label/subjectUser a Response or LatestResponse answers. Ids are compared as strings
+    # since unsaved objects may still hold the ints they were created with.
+    return tuple(None if value is None else str(value) for value in (
+        response.roundDetail_id, response.user_id, response.question_id, response.label_id,
+        response.subjectUser_id))
+
+
+def save_responses(responses):
+    """
+    Saves a list of unsaved Responses and makes them the current answers for their
+    keys. When the list answers the same key twice the later answer wins.
+    """
+    if not responses:
+        return responses
+    with transaction.atomic():
+        # Saves by the same users wait for each other, so neither takes the other's new rows or current answers
+        list(User.objects.select_for_update().filter(
+            user_id__in={str(response.user_id) for response in responses}).values_list('pk', flat=True))
+        insert_responses(responses)
+        replace_latest(responses)
+    return responses
+
+
+def insert_responses(responses):
+    Response.objects.bulk_create(responses)
+    if responses[0].pk is not None:
+        return
+
+    # Only some databases report the ids of bulk inserted rows, so read them back and match them up. The users
+    # are locked (and SQLite lets one transaction write at a time), so their newest rows are the ones just inserted.
+    pending = {}
+    for response in responses:
+        pending.setdefault(response_key(response) + (str(response.batch_id),), []).append(response)
+    users = {str(response.user_id) for response in responses}
+    new_rows = Response.objects.filter(user_id__in=users).order_by('-pk').only(
+        'pk', 'roundDetail', 'user', 'question', 'label', 'subjectUser', 'batch_id')[:len(responses)]
+    for row in reversed(list(new_rows)):
+        waiting = pending.get(response_key(row) + (str(row.batch_id),))
+        if waiting:
+            waiting.pop(0).pk = row.pk
+
+
+def replace_latest(responses):
+    latest = {}
+    for response in responses:
+        latest[response_key(response)] = response
+
+    current = LatestResponse.objects.filter(roundDetail_id__in={key[0] for key in latest},
+                                            user_id__in={key[1] for key in latest},
+                                            question_id__in={key[2] for key in latest})
+    stale = [row for row in current.only('pk', 'roundDetail', 'user', 'question', 'label', 'subjectUser', 'answer')
+             if response_key(row) in latest]
+    for rows in chunks(stale):
+        LatestResponse.objects.filter(pk__in=[row.pk for row in rows]).delete()
+
+    new_rows = [LatestResponse(roundDetail_id=response.roundDetail_id,
+                               user_id=response.user_id,
+                               question_id=response.question_id,
+                               label_id=response.label_id,
+                               subjectUser_id=response.subjectUser_id,
+                               itemKey=item_key(response.label_id, response.subjectUser_id),
+                               response_id=response.pk,
+                               batch_id=response.batch_id,
+                               answer=response.answer)
+                for response in latest.values()]
+    LatestResponse.objects.bulk_create(new_rows)
+    record_answers(new_rows, stale)
+
+
+def response_stamp(round_pk):
+    """
+    Summarises the state of a round's responses. Responses are only ever added or
+    deleted, so their count and highest id change whenever the answers do. Editing a
+    question updates its pubDate, which covers renamed question and label titles.
+    Archived responses are counted from the archive summary.
+    """
+    responses = Response.objects.filter(roundDetail_id=round_pk).aggregate(count=Count('id'), last=Max('id'))
+    archive = archive_of(round_pk)
+    if archive is not None:
+        responses = {'count': archive.responseCount + responses['count'],
+                     'last': max(archive.lastResponse, responses['last'] or 0)}
+    edited = Question.objects.aggregate(last=Max('pubDate'))['last']
+    return "%d:%d:%s" % (responses['count'], responses['last'] or 0, edited.isoformat() if edited else '')
@@ -0,0 +1,113 @@
+"""
+Summarises the answers of a round per team. For every Rate question the mean,
+median and standard deviation of the ratings each subject user (or label)
+received; for every Rank question the mean and median position of each item
+and how often it was ranked first; and for every Choice question how often
+each choice was picked.
+
+The figures are read from the running totals kept by liveAggregates, which
+needs no pass over the answers at all.
+"""
+import math
+
+from .liveAggregates import NUMERIC_TYPES, answer_value
+from .models import AnswerCount, ResponseAggregate, RoundDetail, TeamDetail
+from .questionnaireCache import get_questionnaire
+
+
+def live_statistics(round_pk):
+    """
+    Returns {'teams': [...]} with, for each team of the round in name order, its 'rate',
+    'rank' and 'choice' statistics, read from the running totals that liveAggregates keeps
+    as answers are saved. Raises RoundDetail.DoesNotExist for an unknown round.
+    """
+    round_detail = RoundDetail.objects.get(pk=round_pk)
+    result = TeamStatistics(round_detail)
+    types = {pk: question.questionType.name for pk, question in result.compiled.questions.items()}
+
+    histograms = {}
+    numeric_counts = {}
+    for team_name, question_pk, label_pk, subject_pk, answer, count in AnswerCount.objects.filter(
+            roundDetail=round_detail, count__gt=0).values_list(
+            'teamName', 'question_id', 'label_id', 'subjectUser_id', 'answer', 'count'):
+        question_type = types.get(question_pk)
+        key = (team_name, question_pk, label_pk or subject_pk)
+        if question_type == 'Choice':
+            histograms.setdefault(key, {})[answer] = count
+        elif question_type in NUMERIC_TYPES:
+            value = answer_value(question_type, answer)
+            if value is not None:
+                numeric_counts.setdefault(key, []).append((value, count))
+
+    for team_name, question_pk, label_pk, subject_pk, count, total, squares in ResponseAggregate.objects.filter(
+            roundDetail=round_detail, count__gt=0).values_list(
+            'teamName', 'question_id', 'label_id', 'subjectUser_id', 'count', 'total', 'totalSquares'):
+        question_type = types.get(question_pk)
+        if question_type not in NUMERIC_TYPES:
+            continue
+        key = (team_name, question_pk, label_pk or subject_pk)
+        value_counts = numeric_counts.get(key, [])
+        mean = total / count
+        summary = {'count': count, 'mean': mean, 'median': counted_median(value_counts),
+                   'stddev': math.sqrt(max(0.0, squares / count - mean * mean)),
+                   'firsts': sum(times for value, times in value_counts if value == 1)}
+        result.add_summary(team_name, question_type, question_pk, key[2], summary)
+
+    for (team_name, question_pk, target), histogram in histograms.items():
+        result.add(team_name, 'choice', question_pk, target, {'histogram': histogram})
+    return result.result()
+
+
+class TeamStatistics:
+    # Collects the statistics records of a round's teams, naming their questions and targets
+    def __init__(self, round_detail):
+        self.compiled = get_questionnaire(round_detail.questionnaire_id)
+        self.names = {user_id: name + ' ' + surname for user_id, name, surname in TeamDetail.objects.filter(
+            roundDetail=round_detail).values_list('user_id', 'user__name', 'user__surname')}
+        self.teams = {}
+
+    def add(self, team_name, kind, question_pk, target, record):
+        team = self.teams.setdefault(team_name, {'teamName': team_name, 'rate': [], 'rank': [], 'choice': []})
+        record.update({'question': question_pk, 'questionLabel': self.compiled.question_title(question_pk),
+                       'target': target, 'targetName': target_name(self.compiled, self.names, target)})
+        team[kind].append(record)
+
+    def add_summary(self, team_name, question_type, question_pk, target, summary):
+        # summary holds the count, mean, median, stddev and firsts of a Rate or Rank question's answers
+        if question_type == 'Rank':
+            record = {'count': summary['count'], 'meanRank': summary['mean'], 'medianRank': summary['median'],
+                      'firstPlaces': summary['firsts']}
+        else:
+            record = {name: summary[name] for name in ('count', 'mean', 'median', 'stddev')}
+        self.add(team_name, question_type.lower(), question_pk, target, record)
+
+    def result(self):
+        for team in self.teams.values():
+            for kind in ('rate', 'rank', 'choice'):
+                team[kind].sort(key=lambda record: (record['question'], str(record['target'])))
+        return {'teams': [self.teams[name] for name in sorted(self.teams)]}
+
+
+def counted_median(value_counts):
+    # The median of values given as (value, number of times it occurs) pairs
+    value_counts = sorted(value_counts)
+    size = sum(count for _, count in value_counts)
+    if not size:
+        return None
+    middle = []
+    seen = 0
+    for value, count in value_counts:
+        for position in ((size - 1) // 2, size // 2):
+            if seen <= position < seen + count:
+                middle.append(value)
+        seen += count
+    return sum(middle) / len(middle)
+
+
+def target_name(compiled, names, target):
+    # What an answer was about: a label, a team member, or for ungrouped questions nothing
+    if target is None:
+        return ''
+    if isinstance(target, int):
+        return compiled.label_text(target) or ''
+    return names.get(target, target)
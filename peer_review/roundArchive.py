@@ -0,0 +1,132 @@
+"""
+Moves the responses of long finished rounds out of the Response and
+LatestResponse tables into cold storage. Each round becomes one
+gzip-compressed JSON Lines file in media/archive holding its full answer
+history, in the order an export lists them, and an ArchivedRound row that
+summarises it. Exports and peer scores of an archived round read its file
+instead of the tables, and totals and completion counts that have to be
+recomputed after users, questions or teams change are counted from it too.
+An archived round no longer accepts answers or team changes.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .batches import chunks
+from .models import ArchivedRound, Label, LatestResponse, Question, Response, RoundDetail, User
+
+ARCHIVE_DIR = os.path.join(settings.MEDIA_ROOT, 'archive')
+
+# The Response fields stored for every archived answer, followed by whether it is the round's current answer
+FIELDS = ['id', 'batch_id', 'user_id', 'question_id', 'label_id', 'subjectUser_id', 'answer']
+
+
+def rounds_to_archive(days):
+    """The rounds not yet archived that ended more than the given number of days ago."""
+    return RoundDetail.objects.filter(endingDate__lt=timezone.now() - timedelta(days=days),
+                                      archivedround__isnull=True).order_by('endingDate')
+
+
+def archive_of(round_pk):
+    """Returns the ArchivedRound of a round, or None while its responses are in the database."""
+    return ArchivedRound.objects.filter(roundDetail_id=round_pk).first()
+
+
+def archive_round(round_detail):
+    """
+    Writes every response of a round to its archive file and deletes them from the
+    database in one transaction. Returns the ArchivedRound.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, 'round_' + str(round_detail.pk) + '.jsonl.gz')
+    with transaction.atomic():
+        latest = set(LatestResponse.objects.filter(roundDetail=round_detail).values_list('response_id', flat=True))
+        rows = Response.objects.filter(roundDetail=round_detail).order_by(
+            'user_id', 'question_id', 'label_id', 'subjectUser_id', 'id').values_list(*FIELDS)
+        count = 0
+        last = 0
+        # Write under a temporary name so a half-written archive never replaces a complete one
+        with gzip.open(path + '.part', 'wt', compresslevel=6, encoding='utf-8') as archive:
+            archive.write(json.dumps({'round': round_detail.pk, 'name': round_detail.name,
+                                      'fields': FIELDS + ['latest']}) + '\n')
+            for row in rows.iterator():
+                archive.write(json.dumps(list(row) + [row[0] in latest]) + '\n')
+                count += 1
+                last = max(last, row[0])
+        os.replace(path + '.part', path)
+
+        summary = ArchivedRound.objects.create(roundDetail=round_detail, archiveFile=path, responseCount=count,
+                                               latestCount=len(latest), lastResponse=last,
+                                               size=os.path.getsize(path))
+        LatestResponse.objects.filter(roundDetail=round_detail).delete()
+        # With the LatestResponse rows gone nothing refers to these rows any more. QuerySet.delete would still
+        # load every one of them to look for dependents, so they are removed with a single DELETE instead.
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE %s = %%s' % (
+                connection.ops.quote_name(Response._meta.db_table),
+                connection.ops.quote_name(Response._meta.get_field('roundDetail').column)), [round_detail.pk])
+    return summary
+
+
+def remove_archive_file(path):
+    """Removes the archive file of a deleted round, if it is still there."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def archived_responses(archive):
+    """Yields every response in an archive as a dict of FIELDS and 'latest'."""
+    with gzip.open(archive.archiveFile, 'rt', encoding='utf-8') as lines:
+        fields = json.loads(next(lines))['fields']
+        for line in lines:
+            yield dict(zip(fields, json.loads(line)))
+
+
+def archived_answers(archive):
+    """
+    Yields the current answers in an archive as (response id, user id, question id, label id,
+    subject user id, answer), ordered by user, question, label and subject user like an export.
+    Answers by or about a user, question or label that has since been deleted are left out, as
+    their rows would have been deleted with it.
+    """
+    # A first pass finds the rows the answers refer to, so the second can drop those that are gone
+    referred = {User: set(), Question: set(), Label: set()}
+    for response in archived_responses(archive):
+        if response['latest']:
+            referred[User].update({response['user_id'], response['subjectUser_id']})
+            referred[Question].add(response['question_id'])
+            referred[Label].add(response['label_id'])
+    found = {model: existing(model, pks - {None}) for model, pks in referred.items()}
+
+    for response in archived_responses(archive):
+        if response['latest'] and response['user_id'] in found[User] and \
+                response['question_id'] in found[Question] and \
+                (response['label_id'] is None or response['label_id'] in found[Label]) and \
+                (response['subjectUser_id'] is None or response['subjectUser_id'] in found[User]):
+            yield (response['id'], response['user_id'], response['question_id'], response['label_id'],
+                   response['subjectUser_id'], response['answer'])
+
+
+def existing(model, pks):
+    # The pks among the given ones that still have a row
+    found = set()
+    for batch in chunks(pks):
+        found.update(model.objects.filter(pk__in=batch).values_list('pk', flat=True))
+    return found
+
+
+def archived_latest(archive):
+    """
+    Returns the current answers in an archive as unsaved LatestResponse objects, so totals and
+    completion counts can be recomputed from them.
+    """
+    return [LatestResponse(roundDetail_id=archive.roundDetail_id, user_id=user_id, question_id=question_id,
+                           label_id=label_id, subjectUser_id=subject_id, answer=answer)
+            for _, user_id, question_id, label_id, subject_id, answer in archived_answers(archive)]
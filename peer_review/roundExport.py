@@ -0,0 +1,176 @@
+"""
+Exports the current answers of a round. Rows come straight from one joined
+query over LatestResponse, so an export never loads the whole round into
+memory and never queries per answer. The answers of an archived round are
+streamed from its archive file instead.
+
+Besides plain CSV a round can be exported as gzip-compressed CSV, JSON Lines,
+or a NumPy .npz archive in which users, questions, labels and answers are
+dictionary-encoded into integer columns. The archive loads with numpy.load
+and needs NumPy, which is only imported when it is installed.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .models import LatestResponse, Question, Label, RoundDetail
+from .questionnaireCache import get_questionnaire
+from .roundArchive import archive_of, archived_answers
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DUMP_HEADER = ['ResponseID', 'Respondent', 'QuestionTitle', 'LabelTitle', 'SubjectUser', 'Answer']
+
+# Format name: (file extension, content type)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+    'npz': ('npz', 'application/octet-stream'),
+}
+
+
+# How many rows are exported between calls to a progress callback
+PROGRESS_INTERVAL = 1000
+
+
+def dump_rows(round_pk, progress=None):
+    """
+    Yields the most recent answer to each question of a round as a dump row. If given,
+    progress is called with the number of rows yielded so far every PROGRESS_INTERVAL rows.
+    """
+    questionnaire_pk = RoundDetail.objects.filter(pk=round_pk).values_list('questionnaire', flat=True).first()
+    compiled = get_questionnaire(questionnaire_pk)
+    # Titles come from the cached questionnaire; answers to questions since removed from it are looked up once
+    question_titles = TitleLookup(compiled.question_title, Question, 'questionLabel')
+    label_texts = TitleLookup(compiled.label_text, Label, 'labelText')
+
+    archive = archive_of(round_pk)
+    if archive is not None:
+        rows = archived_answers(archive)
+    else:
+        rows = LatestResponse.objects.filter(roundDetail=round_pk).order_by(
+            'user_id', 'question_id', 'label_id', 'subjectUser_id').values_list(
+            'response_id', 'user_id', 'question_id', 'label_id', 'subjectUser_id', 'answer').iterator()
+    for count, (response_id, user_id, question_id, label_id, subject_user_id, answer) in enumerate(rows, 1):
+        row = [response_id, user_id, question_titles.get(question_id), label_texts.get(label_id), subject_user_id,
+               answer]
+        yield ['' if value is None else value for value in row]
+        if progress is not None and count % PROGRESS_INTERVAL == 0:
+            progress(count)
+
+
+class TitleLookup:
+    # Maps pks to a text field, asking the compiled questionnaire first and the database for anything it lacks
+    def __init__(self, compiled_lookup, model, field):
+        self.compiled_lookup = compiled_lookup
+        self.model = model
+        self.field = field
+        self.missing = {}
+
+    def get(self, pk):
+        if pk is None:
+            return None
+        title = self.compiled_lookup(pk)
+        if title is None:
+            if pk not in self.missing:
+                self.missing[pk] = self.model.objects.filter(pk=pk).values_list(self.field, flat=True).first()
+            title = self.missing[pk]
+        return title
+
+
+class Echo:
+    # A file-like object whose write hands back what was written, so csv.writer can format single rows
+    def write(self, value):
+        return value
+
+
+def csv_lines(round_pk, progress=None):
+    """Yields the round dump as CSV text, one line at a time."""
+    writer = csv.writer(Echo(), delimiter=',', quoting=csv.QUOTE_ALL, lineterminator='\n')
+    yield writer.writerow(DUMP_HEADER)
+    empty = True
+    for row in dump_rows(round_pk, progress):
+        empty = False
+        yield writer.writerow(row)
+    if empty:
+        yield writer.writerow(['NO DATA'])
+
+
+def jsonl_lines(round_pk, progress=None):
+    """Yields the round dump as JSON Lines, one object per answer."""
+    for row in dump_rows(round_pk, progress):
+        yield json.dumps(dict(zip(DUMP_HEADER, row))) + '\n'
+
+
+def gzip_chunks(lines):
+    """Compresses a stream of text lines into gzip chunks as they arrive."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def npz_bytes(round_pk, progress=None):
+    """
+    Returns the round as a compressed .npz archive. Each answer is a row across the
+    integer columns response_id, respondent, question, label and subject_user; the
+    text columns are codes into the users, questions, labels and answers arrays, with
+    -1 for no label or subject user. answer_value holds the numeric answers and NaN
+    for the rest.
+    """
+    vocabularies = {'users': {}, 'questions': {}, 'labels': {}, 'answers': {}}
+
+    def encode(vocabulary, value):
+        if value == '':
+            return -1
+        codes = vocabularies[vocabulary]
+        return codes.setdefault(value, len(codes))
+
+    columns = {'response_id': [], 'respondent': [], 'question': [], 'label': [], 'subject_user': [], 'answer': [],
+               'answer_value': []}
+    for response_id, respondent, question, label, subject_user, answer in dump_rows(round_pk, progress):
+        columns['response_id'].append(response_id)
+        columns['respondent'].append(encode('users', respondent))
+        columns['question'].append(encode('questions', question))
+        columns['label'].append(encode('labels', label))
+        columns['subject_user'].append(encode('users', subject_user))
+        columns['answer'].append(encode('answers', answer))
+        try:
+            columns['answer_value'].append(float(answer))
+        except ValueError:
+            columns['answer_value'].append(float('nan'))
+
+    arrays = {name: numpy.array(values, dtype=numpy.float64 if name == 'answer_value' else numpy.int64)
+              for name, values in columns.items()}
+    for name, codes in vocabularies.items():
+        # Python dicts keep insertion order from 3.6 only, so order the values by their codes explicitly
+        arrays[name] = numpy.array(sorted(codes, key=codes.get), dtype=str)
+
+    output = io.BytesIO()
+    numpy.savez_compressed(output, **arrays)
+    return output.getvalue()
+
+
+def available_formats():
+    """The export formats that can be produced with the installed packages."""
+    return sorted(name for name in EXPORT_FORMATS if name != 'npz' or numpy is not None)
+
+
+def export_chunks(round_pk, export_format, progress=None):
+    """Yields the round dump in the given format as byte chunks."""
+    if export_format not in available_formats():
+        raise ValueError("Unsupported export format: " + str(export_format))
+    if export_format == 'csv':
+        return (line.encode('utf-8') for line in csv_lines(round_pk, progress))
+    if export_format == 'csv.gz':
+        return gzip_chunks(csv_lines(round_pk, progress))
+    if export_format == 'jsonl':
+        return (line.encode('utf-8') for line in jsonl_lines(round_pk, progress))
+    return iter([npz_bytes(round_pk, progress)])
@@ -0,0 +1,40 @@
+"""
+Signal receivers that keep files and caches in step with rows changed outside
+the views that normally handle them, such as cascades and the admin site.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ArchivedRound, Choice, FreeformItem, Label, Question, QuestionGrouping, Questionnaire, \
+    QuestionOrder, QuestionType, Rank, Rate
+from .questionItems import forget_named_pks
+from .questionnaireCache import questionnaires_changed
+from .roundArchive import remove_archive_file
+
+# The rows a compiled questionnaire is built from
+QUESTIONNAIRE_MODELS = (Questionnaire, QuestionOrder, Question, QuestionType, QuestionGrouping, Choice, Label, Rate,
+                        Rank, FreeformItem)
+
+
+@receiver(post_delete, sender=ArchivedRound)
+def archive_deleted(sender, instance, **kwargs):
+    # A deleted round takes its archive file with it, once the deletion is committed
+    transaction.on_commit(lambda: remove_archive_file(instance.archiveFile))
+
+
+@receiver(post_delete, sender=QuestionType)
+@receiver(post_delete, sender=QuestionGrouping)
+def named_row_deleted(sender, instance, **kwargs):
+    # Questions saved later must not be given the pk of the deleted type or grouping
+    forget_named_pks()
+
+
+def questionnaire_changed(sender, **kwargs):
+    # A questionnaire's structure changed, so none of the cached copies can be used
+    questionnaires_changed()
+
+
+for model in QUESTIONNAIRE_MODELS:
+    post_save.connect(questionnaire_changed, sender=model, dispatch_uid='questionnaire_saved_' + model.__name__)
+    post_delete.connect(questionnaire_changed, sender=model, dispatch_uid='questionnaire_deleted_' + model.__name__)
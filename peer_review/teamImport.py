@@ -0,0 +1,160 @@
+"""
+Imports team assignments from a CSV file with the columns user_id, roundDetail
+(or round_name) and teamName (or team_name). The file is read row by row and
+its users and rounds are resolved with one IN query each (per 500 rows), so
+every bad row is reported at once. A file without errors is applied in one transaction: new
+members are inserted in bulk, members who change team are moved with one
+UPDATE per team and members placed in EMPTY_TEAM are taken out of the round,
+as on the team maintenance page. The running report totals and completion counts of every
+round that changed are then recomputed.
+"""
+import csv
+
+from django.db import transaction
+
+from .batches import chunks, rows_per_insert
+from .liveAggregates import rebuild_aggregates
+from .models import RoundDetail, TeamDetail, User
+from .teamProgress import recount_round
+
+# The accepted names of each column
+COLUMNS = {
+    'user_id': ('user_id',),
+    'round': ('roundDetail', 'round_name'),
+    'team': ('teamName', 'team_name'),
+}
+
+MISSING_VALUES = 2
+BAD_FORMAT = 3
+UNKNOWN_USER = 4
+UNKNOWN_ROUND = 5
+DUPLICATE_USER = 6
+ARCHIVED_ROUND = 7
+
+ERROR_MESSAGES = {
+    MISSING_VALUES: "Not all fields contain values.",
+    BAD_FORMAT: "The row has too many fields or the team name is too long.",
+    UNKNOWN_USER: "The user does not exist.",
+    UNKNOWN_ROUND: "The round does not exist.",
+    DUPLICATE_USER: "The user is placed in this round more than once.",
+    ARCHIVED_ROUND: "The round is archived and its teams can no longer change.",
+}
+
+# The team name that takes a user out of a round instead of placing them in a team
+EMPTY_TEAM = 'emptyTeam'
+
+
+class CsvError:
+    # A row of the file that cannot be imported
+    def __init__(self, line, code, row):
+        self.line = line
+        self.code = code
+        self.message = ERROR_MESSAGES[code]
+        self.row = [row.get(column) or '' for column in ('user_id', 'round', 'team')]
+
+
+def read_teams(lines):
+    """
+    Reads and validates the team assignments in the lines of a CSV file. Returns a list of
+    (round pk, user id, team name) and a CsvError for every invalid row, or None instead of
+    the list if the header lacks a column.
+    """
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return None, []
+    header = {name.strip(): name for name in reader.fieldnames}
+    names = {}
+    for column, accepted in COLUMNS.items():
+        found = [header[name] for name in accepted if name in header]
+        if not found:
+            return None, []
+        names[column] = found[0]
+
+    rows = []
+    for row in reader:
+        values = {column: (row.get(name) or '').strip() for column, name in names.items()}
+        values['extra'] = None in row
+        rows.append(values)
+    return validate_rows(rows)
+
+
+def validate_rows(rows):
+    users = set()
+    for batch in chunks(rows):
+        users.update(User.objects.filter(user_id__in={row['user_id'] for row in batch}).values_list(
+            'user_id', flat=True))
+    rounds = {}
+    archived = set()
+    for name, pk, archive_pk in RoundDetail.objects.filter(name__in={row['round'] for row in rows}).values_list(
+            'name', 'pk', 'archivedround'):
+        rounds[name] = pk
+        if archive_pk is not None:
+            archived.add(pk)
+    team_length = TeamDetail._meta.get_field('teamName').max_length
+
+    assignments = []
+    errors = []
+    seen = set()
+    for line, row in enumerate(rows, start=2):
+        if row['extra'] or len(row['team']) > team_length:
+            code = BAD_FORMAT
+        elif not (row['user_id'] and row['round'] and row['team']):
+            code = MISSING_VALUES
+        elif row['user_id'] not in users:
+            code = UNKNOWN_USER
+        elif row['round'] not in rounds:
+            code = UNKNOWN_ROUND
+        elif rounds[row['round']] in archived:
+            code = ARCHIVED_ROUND
+        elif (row['round'], row['user_id']) in seen:
+            code = DUPLICATE_USER
+        else:
+            seen.add((row['round'], row['user_id']))
+            assignments.append((rounds[row['round']], row['user_id'], row['team']))
+            continue
+        errors.append(CsvError(line, code, row))
+    return assignments, errors
+
+
+def import_teams(assignments):
+    """
+    Places every user in their team for the round, adding them to the round if they are not in
+    it yet, or takes them out of the round if the team is EMPTY_TEAM. Returns the number of
+    members added, the number moved to another team and the number removed.
+    """
+    round_pks = {round_pk for round_pk, _, _ in assignments}
+    wanted = {(round_pk, user_id): team_name for round_pk, user_id, team_name in assignments}
+
+    with transaction.atomic():
+        current = {}
+        for batch in chunks(assignments):
+            for pk, round_pk, user_id, team_name in TeamDetail.objects.filter(
+                    roundDetail_id__in=round_pks, user_id__in={user_id for _, user_id, _ in batch}).values_list(
+                    'pk', 'roundDetail_id', 'user_id', 'teamName'):
+                current[(round_pk, str(user_id))] = (pk, team_name)
+
+        created = [TeamDetail(roundDetail_id=round_pk, user_id=user_id, teamName=team_name)
+                   for (round_pk, user_id), team_name in wanted.items()
+                   if (round_pk, user_id) not in current and team_name != EMPTY_TEAM]
+        TeamDetail.objects.bulk_create(created, batch_size=rows_per_insert(TeamDetail))
+
+        moved = {}
+        removed = []
+        changed_rounds = {member.roundDetail_id for member in created}
+        for key, (pk, team_name) in current.items():
+            if key in wanted and wanted[key] != team_name:
+                if wanted[key] == EMPTY_TEAM:
+                    removed.append(pk)
+                else:
+                    moved.setdefault(wanted[key], []).append(pk)
+                changed_rounds.add(key[0])
+        for batch in chunks(removed):
+            TeamDetail.objects.filter(pk__in=batch).delete()
+        for team_name, pks in moved.items():
+            for batch in chunks(pks):
+                TeamDetail.objects.filter(pk__in=batch).update(teamName=team_name)
+
+        for round_pk in changed_rounds:
+            rebuild_aggregates(round_pk)
+            recount_round(round_pk)
+    return len(created), sum(len(pks) for pks in moved.values()), len(removed)
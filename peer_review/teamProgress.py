@@ -0,0 +1,120 @@
+"""
+Tracks how far each member of a round is with the questionnaire. A member has
+to answer every item: one per ungrouped question, one per label of a "Label"
+question and one per teammate of a "Rest" or "All" question. After every save
+the member's current answers are matched against those items and the count is
+written to their TeamDetail, together with the status that follows from it,
+in a single UPDATE.
+"""
+from .batches import chunks
+from .models import LatestResponse, RoundDetail, TeamDetail
+from .questionnaireCache import get_questionnaire
+from .roundArchive import archive_of, archived_latest
+
+def required_answers(compiled, team_size):
+    """How many answers a member of a team of the given size gives to complete the questionnaire."""
+    required = 0
+    labels = [label.question_id for label in compiled.labels.values()]
+    for question in compiled.questions.values():
+        grouping = question.questionGrouping.grouping
+        if grouping == "Label":
+            required += labels.count(question.pk)
+        elif grouping == "All":
+            required += team_size
+        elif grouping == "Rest":
+            required += team_size - 1
+        else:
+            required += 1
+    return required
+
+
+def answered_items(compiled, rows, user_id, team_member_ids):
+    """
+    Counts the items of the questionnaire answered by (question, label, subject user) rows. Answers
+    about a label of another question or about someone outside the team do not fill an item.
+    """
+    items = set()
+    for question_pk, label_pk, subject_pk in rows:
+        question = compiled.questions.get(question_pk)
+        if question is None:
+            continue
+        grouping = question.questionGrouping.grouping
+        if grouping == "Label":
+            label = compiled.labels.get(label_pk)
+            if label is not None and label.question_id == question_pk:
+                items.add((question_pk, label_pk))
+        elif grouping == "All" or grouping == "Rest":
+            if subject_pk in team_member_ids and (grouping == "All" or subject_pk != user_id):
+                items.add((question_pk, subject_pk))
+        else:
+            items.add((question_pk, None))
+    return len(items)
+
+
+def progress_status(answered, required):
+    if answered == 0:
+        return TeamDetail.NOT_ATTEMPTED
+    if answered >= required:
+        return TeamDetail.COMPLETED
+    return TeamDetail.IN_PROGRESS
+
+
+def record_progress(team_detail, compiled, team_member_ids):
+    """Recounts a member's answers after a save and stores the count and status on their TeamDetail."""
+    team_member_ids = {str(user_id) for user_id in team_member_ids}
+    rows = LatestResponse.objects.filter(user_id=team_detail.user_id, roundDetail_id=team_detail.roundDetail_id,
+                                         question_id__in=list(compiled.questions)).values_list(
+        'question_id', 'label_id', 'subjectUser_id')
+    answered = answered_items(compiled, rows, str(team_detail.user_id), team_member_ids)
+    status = progress_status(answered, required_answers(compiled, len(team_member_ids)))
+    TeamDetail.objects.filter(pk=team_detail.pk).update(answered=answered, status=status)
+    team_detail.answered = answered
+    team_detail.status = status
+    return team_detail
+
+
+def required_by_team(compiled, team_sizes):
+    """Team name -> the number of answers each of its members has to give, given team name -> size."""
+    return {team_name: required_answers(compiled, size) for team_name, size in team_sizes.items()}
+
+
+def recount_round(round_pk, team_names=None):
+    """
+    Recounts the answers of every member of a round, as needed after members change teams, or only of the
+    members of the given teams. Reads the members and their answers in two queries and writes one UPDATE per
+    distinct count and status. The answers of an archived round are read from its archive.
+    """
+    round_detail = RoundDetail.objects.get(pk=round_pk)
+    compiled = get_questionnaire(round_detail.questionnaire_id)
+    members = TeamDetail.objects.filter(roundDetail=round_detail)
+    if team_names is not None:
+        members = members.filter(teamName__in=list(team_names))
+    members = list(members.values_list('pk', 'user_id', 'teamName', 'answered', 'status'))
+    teams = {}
+    for _, user_id, team_name, _, _ in members:
+        teams.setdefault(team_name, set()).add(str(user_id))
+    archive = archive_of(round_pk)
+    if archive is not None:
+        answers = [(answer.user_id, answer.question_id, answer.label_id, answer.subjectUser_id)
+                   for answer in archived_latest(archive)]
+    else:
+        answers = LatestResponse.objects.filter(
+            roundDetail=round_detail, question_id__in=list(compiled.questions))
+        if team_names is not None:
+            answers = answers.filter(user_id__in=[user_id for _, user_id, _, _, _ in members])
+        answers = answers.values_list('user_id', 'question_id', 'label_id', 'subjectUser_id')
+    rows = {}
+    for user_id, question_pk, label_pk, subject_pk in answers:
+        rows.setdefault(str(user_id), []).append((question_pk, label_pk,
+                                                  None if subject_pk is None else str(subject_pk)))
+
+    required = required_by_team(compiled, {team_name: len(ids) for team_name, ids in teams.items()})
+    changes = {}
+    for pk, user_id, team_name, answered, status in members:
+        count = answered_items(compiled, rows.get(str(user_id), []), str(user_id), teams[team_name])
+        new_status = progress_status(count, required[team_name])
+        if (count, new_status) != (answered, status):
+            changes.setdefault((count, new_status), []).append(pk)
+    for (count, status), pks in changes.items():
+        for batch in chunks(pks):
+            TeamDetail.objects.filter(pk__in=batch).update(answered=count, status=status)
@@ -1,11 +1,15 @@
 from datetime import datetime, timezone, timedelta
+from django.core.cache import cache
 from peer_review.models import Questionnaire, RoundDetail, User, Question, FreeformItem, Choice, QuestionOrder, Response, \
     QuestionType, QuestionGrouping
+from peer_review.responseStore import save_responses
 import time
 
 
 class TestSetup:
     def __init__(self):
+        # Compiled questionnaires of earlier tests may share pks with the ones created here
+        cache.clear()
         self.questionnaire = Questionnaire.objects.create(intro='Hello, this is a question',
                                                           label='This is a very unique label')
 
@@ -60,53 +64,53 @@ class TestSetup:
                                      question=self.question3,
                                      order=2)
         batch_num = 0
-        Response.objects.create(question=self.question1,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="We have an answer",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question1,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="We have an answer",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
-        Response.objects.create(question=self.question1,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="We have a different answer",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question1,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="We have a different answer",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
-        Response.objects.create(question=self.question2,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="choice 1",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question2,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="choice 1",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
-        Response.objects.create(question=self.question2,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="choice 2",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question2,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="choice 2",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
-        Response.objects.create(question=self.question3,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="Apples",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question3,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="Apples",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
-        Response.objects.create(question=self.question3,
-                                roundDetail=self.round,
-                                user=self.user,
-                                subjectUser=self.user2,
-                                label=None,
-                                answer="Bananas",
-                                batch_id=str(int(time.time()*1000)) + str(batch_num))
+        save_responses([Response(question=self.question3,
+                                 roundDetail=self.round,
+                                 user=self.user,
+                                 subjectUser=self.user2,
+                                 label=None,
+                                 answer="Bananas",
+                                 batch_id=str(int(time.time()*1000)) + str(batch_num))])
         batch_num += 1
 
         User.objects.create_superuser('admin', 'admin', user_id=str(1111))
\ No newline at end of file
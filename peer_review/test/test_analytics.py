@@ -0,0 +1,312 @@
+import json
+import shutil
+import tempfile
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+
+from peer_review import peerScoring, roundArchive
+from peer_review.bulkDelete import delete_questions, delete_users
+from peer_review.models import Question, QuestionType, QuestionGrouping, QuestionOrder, Questionnaire, Label, \
+    RoundDetail, TeamDetail, Response, User, AnswerCount, ResponseAggregate
+from peer_review.responseStore import save_responses
+from peer_review.liveAggregates import rebuild_aggregates
+from peer_review.peerScoring import answer_points, peer_scores
+from peer_review.roundAnalytics import live_statistics
+from peer_review.roundExport import dump_rows
+from peer_review.teamImport import import_teams
+
+
+class AnsweredRoundTestCase(TestCase):
+    # A round with two teams whose members have answered Rate, Rank and Choice questions
+    def setUp(self):
+        cache.clear()
+        now = datetime.now(timezone(timedelta(hours=2)))
+        questionnaire = Questionnaire.objects.create(intro='Peer review', label='Peer review')
+        self.round = RoundDetail.objects.create(name='Analytics', questionnaire=questionnaire, startingDate=now,
+                                                endingDate=now, description='Analytics round')
+        self.users = [User.objects.create_user(name + '@team.com', 'pw', name, 'Test', user_id=name)
+                      for name in ('alice', 'bob', 'carol', 'dave')]
+        for user in self.users[:3]:
+            TeamDetail.objects.create(user=user, roundDetail=self.round, teamName='Red')
+        TeamDetail.objects.create(user=self.users[3], roundDetail=self.round, teamName='Blue')
+
+        def add_question(label, question_type, grouping, order):
+            question = Question.objects.create(questionText=label, questionLabel=label, pubDate=now,
+                                               questionType=QuestionType.objects.get_or_create(name=question_type)[0],
+                                               questionGrouping=QuestionGrouping.objects.get_or_create(
+                                                   grouping=grouping)[0])
+            QuestionOrder.objects.create(questionnaire=questionnaire, question=question, order=order)
+            return question
+
+        self.rate = add_question('Contribution', 'Rate', 'All', 0)
+        self.rank = add_question('Parts', 'Rank', 'Label', 1)
+        self.design = Label.objects.create(question=self.rank, labelText='Design')
+        self.testing = Label.objects.create(question=self.rank, labelText='Testing')
+        self.choice = add_question('Again?', 'Choice', 'None', 2)
+
+        alice, bob, carol, dave = self.users
+        answers = [
+            # Ratings of bob by the Red team, one of which is later replaced and one skipped
+            (alice, self.rate, None, bob, '20'), (alice, self.rate, None, bob, '40'),
+            (bob, self.rate, None, bob, '60'), (carol, self.rate, None, bob, '90'),
+            (carol, self.rate, None, alice, '-1'), (dave, self.rate, None, dave, '10'),
+            (alice, self.rank, self.design, None, '0'), (alice, self.rank, self.testing, None, '1'),
+            (bob, self.rank, self.design, None, '1'), (bob, self.rank, self.testing, None, '0'),
+            (carol, self.rank, self.design, None, '0'), (carol, self.rank, self.testing, None, '1'),
+            (alice, self.choice, None, None, 'Yes'), (bob, self.choice, None, None, 'Yes'),
+            (carol, self.choice, None, None, 'No'), (dave, self.choice, None, None, 'Yes'),
+        ]
+        for batch_id, (user, question, label, subject, answer) in enumerate(answers):
+            save_responses([Response(question=question, roundDetail=self.round, user=user, label=label,
+                                     subjectUser=subject, answer=answer, batch_id=batch_id)])
+
+    def team(self, statistics, name):
+        return [team for team in statistics['teams'] if team['teamName'] == name][0]
+
+    def rebuilt_statistics(self):
+        # The statistics of totals recomputed from the answers, which the running totals have to match
+        rebuild_aggregates(self.round.pk)
+        return self.rounded(live_statistics(self.round.pk))
+
+    def rounded(self, statistics):
+        # Running totals may differ from a fresh computation in the last bits of a float
+        for team in statistics['teams']:
+            for record in team['rate'] + team['rank']:
+                for name, value in record.items():
+                    if isinstance(value, float):
+                        record[name] = round(value, 6)
+        return statistics
+
+
+class RoundAnalyticsTests(AnsweredRoundTestCase):
+    def check_statistics(self, statistics):
+        self.assertEqual([team['teamName'] for team in statistics['teams']], ['Blue', 'Red'])
+        red = self.team(statistics, 'Red')
+
+        self.assertEqual(len(red['rate']), 1)
+        rating = red['rate'][0]
+        self.assertEqual((rating['question'], rating['target'], rating['targetName']),
+                         (self.rate.pk, 'bob', 'bob Test'))
+        self.assertEqual(rating['count'], 3)
+        self.assertAlmostEqual(rating['mean'], 190 / 3)
+        self.assertAlmostEqual(rating['median'], 60)
+        self.assertAlmostEqual(rating['stddev'], 20.548046676563256)
+
+        ranks = {record['targetName']: record for record in red['rank']}
+        self.assertEqual(ranks['Design']['count'], 3)
+        self.assertAlmostEqual(ranks['Design']['meanRank'], 4 / 3)
+        self.assertAlmostEqual(ranks['Design']['medianRank'], 1)
+        self.assertEqual(ranks['Design']['firstPlaces'], 2)
+        self.assertEqual(ranks['Testing']['firstPlaces'], 1)
+
+        self.assertEqual(red['choice'][0]['histogram'], {'Yes': 2, 'No': 1})
+        self.assertEqual(self.team(statistics, 'Blue')['choice'][0]['histogram'], {'Yes': 1})
+
+    def test_round_statistics_view(self):
+        User.objects.create_superuser('admin', 'admin', user_id='1111')
+        self.client = Client()
+        self.client.login(username='1111', password='admin')
+        response = self.client.get(reverse('roundStatistics', kwargs={'round_pk': self.round.pk}))
+        self.check_statistics(json.loads(response.content.decode()))
+
+        response = self.client.get(reverse('roundStatistics', kwargs={'round_pk': self.round.pk + 1}))
+        self.assertTemplateUsed(response, 'peer_review/user404.html')
+
+    def test_live_statistics(self):
+        self.check_statistics(live_statistics(self.round.pk))
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)),
+                         self.rebuilt_statistics())
+
+    def test_live_statistics_follow_team_changes(self):
+        User.objects.create_superuser('admin', 'admin', user_id='1111')
+        self.client = Client()
+        self.client.login(username='1111', password='admin')
+        self.client.get(reverse('changeUserTeamForRound', kwargs={'round_pk': self.round.pk, 'user_id': 'carol',
+                                                                  'team_name': 'Blue'}))
+        self.client.get(reverse('changeUserTeamForRound', kwargs={'round_pk': self.round.pk, 'user_id': 'alice',
+                                                                  'team_name': 'emptyTeam'}))
+        live = self.rounded(live_statistics(self.round.pk))
+        self.assertEqual(live, self.rebuilt_statistics())
+        red = self.team(live, 'Red')
+        self.assertEqual(red['rate'][0]['count'], 1)
+        self.assertEqual(red['choice'][0]['histogram'], {'Yes': 1})
+        # Progress is recounted with the new teammates, as after an import
+        carol = TeamDetail.objects.get(user_id='carol')
+        self.assertEqual((carol.answered, carol.status), (3, TeamDetail.IN_PROGRESS))
+
+    def test_team_import_updates_totals_and_progress(self):
+        import_teams([(self.round.pk, 'carol', 'Blue'), (self.round.pk, 'alice', 'Red')])
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)), self.rebuilt_statistics())
+        # carol's ratings of alice and bob stop counting once they are no longer her teammates; her two rankings
+        # and her choice still do
+        carol = TeamDetail.objects.get(user_id='carol')
+        self.assertEqual((carol.teamName, carol.answered, carol.status), ('Blue', 3, TeamDetail.IN_PROGRESS))
+
+    def test_team_import_removes_members_of_empty_team(self):
+        self.assertEqual(import_teams([(self.round.pk, 'alice', 'emptyTeam'), (self.round.pk, 'carol', 'Red')]),
+                         (0, 0, 1))
+        self.assertFalse(TeamDetail.objects.filter(user_id='alice').exists())
+        self.assertFalse(TeamDetail.objects.filter(teamName='emptyTeam').exists())
+        # The same totals and progress as after removing alice on the team maintenance page
+        live = self.rounded(live_statistics(self.round.pk))
+        self.assertEqual(live, self.rebuilt_statistics())
+        self.assertEqual(self.team(live, 'Red')['choice'][0]['histogram'], {'Yes': 1, 'No': 1})
+        carol = TeamDetail.objects.get(user_id='carol')
+        self.assertEqual(carol.teamName, 'Red')
+        self.assertNotEqual(carol.status, TeamDetail.NOT_ATTEMPTED)
+
+    def test_bulk_deletes_update_totals_and_progress(self):
+        delete_users([User.objects.get(user_id='carol')])
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)), self.rebuilt_statistics())
+        self.assertEqual(self.team(live_statistics(self.round.pk), 'Red')['choice'][0]['histogram'], {'Yes': 2})
+        # alice's team of two now needs five answers: two ratings, two rankings and the choice
+        alice = TeamDetail.objects.get(user_id='alice')
+        self.assertEqual((alice.answered, alice.status), (4, TeamDetail.IN_PROGRESS))
+
+        delete_questions([self.rank])
+        self.assertFalse(Response.objects.filter(question_id=self.rank.pk).exists())
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)), self.rebuilt_statistics())
+        self.assertEqual(TeamDetail.objects.get(user_id='alice').answered, 2)
+
+    def test_full_save_updates_totals_in_batches(self):
+        now = datetime.now(timezone(timedelta(hours=2)))
+        grouping = QuestionGrouping.objects.get(grouping='All')
+        questions = [Question.objects.create(questionText='Rating', questionLabel='Rating ' + str(number), pubDate=now,
+                                             questionType=self.rate.questionType, questionGrouping=grouping)
+                     for number in range(30)]
+        red = self.users[:3]
+        for batch_id, user in enumerate(red, 100):
+            responses = [Response(question=question, roundDetail=self.round, user=user, subjectUser=subject,
+                                  answer=str(number), batch_id=batch_id)
+                         for number, question in enumerate(questions) for subject in red]
+            with CaptureQueriesContext(connection) as queries:
+                save_responses(responses)
+            # A read and an INSERT or UPDATE for each of the two tables, however many answers there are
+            self.assertEqual(len([query for query in queries.captured_queries
+                                  if 'responseaggregate' in query['sql'] or 'answercount' in query['sql']]), 4)
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)), self.rebuilt_statistics())
+        self.assertEqual(ResponseAggregate.objects.get(question=questions[29], subjectUser=red[0]).count, 3)
+
+    def test_aggregate_keys_without_label_are_unique(self):
+        # Neither key has a label, and one has no subject user either; NULLs alone would never clash
+        for fields in ({'subjectUser': self.users[1]}, {}):
+            fields.update(roundDetail=self.round, teamName='Green', question=self.rate)
+            ResponseAggregate.objects.create(count=1, **fields)
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                ResponseAggregate.objects.create(count=1, **fields)
+            AnswerCount.objects.create(answer='50', count=1, **fields)
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                AnswerCount.objects.create(answer='50', count=1, **fields)
+
+    def test_rebuild_aggregates(self):
+        def totals():
+            return (sorted(ResponseAggregate.objects.filter(count__gt=0).values_list(
+                        'teamName', 'question', 'label', 'subjectUser', 'count', 'total', 'totalSquares')),
+                    sorted(AnswerCount.objects.filter(count__gt=0).values_list(
+                        'teamName', 'question', 'label', 'subjectUser', 'answer', 'count')))
+        saved = totals()
+        rebuild_aggregates(self.round.pk)
+        self.assertEqual(totals(), saved)
+
+
+class PeerScoringTests(AnsweredRoundTestCase):
+    def save(self, user, subject, answer, batch_id=100):
+        save_responses([Response(question=self.rate, roundDetail=self.round, user=user, subjectUser=subject,
+                                 answer=answer, batch_id=batch_id)])
+
+    def factors(self, scores):
+        return {member['user_id']: member['factor'] for team in scores['teams'] for member in team['members']}
+
+    def check_scores(self):
+        alice, bob, carol, dave = self.users
+        self.save(alice, alice, '60')
+        self.save(alice, carol, '0')
+        scores = peer_scores(self.round.pk)
+        self.assertEqual(scores['questions'], [self.rate.pk])
+
+        red = self.team(scores, 'Red')
+        self.assertEqual((red['size'], red['assessors']), (3, 3))
+        # alice shares her points 60:40 between herself and bob, bob and carol give all theirs to bob
+        factors = self.factors(scores)
+        self.assertAlmostEqual(factors['alice'], 0.6)
+        self.assertAlmostEqual(factors['bob'], 2.4)
+        self.assertAlmostEqual(factors['carol'], 0)
+        self.assertAlmostEqual(factors['dave'], 1)
+
+    def test_peer_scores(self):
+        self.check_scores()
+
+    def test_peer_scores_without_numpy(self):
+        with mock.patch.object(peerScoring, 'numpy', None):
+            self.check_scores()
+
+    def test_peer_scores_follow_changes(self):
+        alice, bob, carol, dave = self.users
+        before = self.factors(peer_scores(self.round.pk))
+        self.assertEqual(self.factors(peer_scores(self.round.pk)), before)
+
+        # A new answer and a team change both replace the cached scores
+        self.save(carol, carol, '90')
+        self.assertAlmostEqual(self.factors(peer_scores(self.round.pk))['carol'], 0.5 * 3 / 3)
+        TeamDetail.objects.filter(user=dave).update(teamName='Red')
+        scores = peer_scores(self.round.pk)
+        self.assertEqual([team['teamName'] for team in scores['teams']], ['Red'])
+        self.assertAlmostEqual(sum(self.factors(scores).values()), 4)
+
+    def test_peer_scores_of_archived_round(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        live = live_statistics(self.round.pk)
+        before = self.factors(peer_scores(self.round.pk))
+        with mock.patch.object(roundArchive, 'ARCHIVE_DIR', directory):
+            roundArchive.archive_round(self.round)
+        cache.clear()
+        self.assertFalse(Response.objects.filter(roundDetail=self.round).exists())
+        self.assertEqual(self.factors(peer_scores(self.round.pk)), before)
+        # The report totals are rebuilt from the archive rather than the now empty tables
+        rebuild_aggregates(self.round.pk)
+        self.assertEqual(self.rounded(live_statistics(self.round.pk)), self.rounded(live))
+
+        # Deleting a member recounts the archived round as it would a live one
+        delete_users([User.objects.get(user_id='carol')])
+        self.assertEqual(self.team(live_statistics(self.round.pk), 'Red')['choice'][0]['histogram'], {'Yes': 2})
+        alice = TeamDetail.objects.get(user_id='alice')
+        self.assertEqual((alice.answered, alice.status), (4, TeamDetail.IN_PROGRESS))
+        # Nor are the archived answers of deleted users and questions exported or counted
+        delete_questions([self.choice])
+        rows = list(dump_rows(self.round.pk))
+        self.assertEqual({row[1] for row in rows}, {'alice', 'bob', 'dave'})
+        self.assertNotIn('carol', {row[4] for row in rows})
+        self.assertNotIn(self.choice.questionLabel, {row[2] for row in rows})
+        rebuild_aggregates(self.round.pk)
+        self.assertFalse(AnswerCount.objects.filter(roundDetail=self.round, question_id=self.choice.pk).exists())
+
+    def test_rank_points(self):
+        team_of = {'alice': 'Red', 'bob': 'Red', 'carol': 'Red', 'dave': 'Blue'}
+        rows = [('alice', 1, 'bob', '0'), ('alice', 1, 'carol', '1'), ('alice', 1, 'dave', '2')]
+        # dave is not in alice's team, so only bob and carol are ranked
+        self.assertEqual(answer_points(rows, {1: 'Rank'}, team_of),
+                         (['alice', 'alice'], ['bob', 'carol'], [2 / 3, 1 / 3]))
+
+        # A rating out of 100 counts as much as a ranking of the same teammates
+        rows += [('alice', 2, 'bob', '10'), ('alice', 2, 'carol', '90')]
+        assessors, subjects, points = answer_points(rows, {1: 'Rank', 2: 'Rate'}, team_of)
+        self.assertEqual(subjects, ['bob', 'carol', 'bob', 'carol'])
+        for point, expected in zip(points, [2 / 3, 1 / 3, 0.1, 0.9]):
+            self.assertAlmostEqual(point, expected)
+
+    def test_peer_scores_csv(self):
+        User.objects.create_superuser('admin', 'admin', user_id='1111')
+        self.client = Client()
+        self.client.login(username='1111', password='admin')
+        response = self.client.get(reverse('downloadPeerScores', kwargs={'round_pk': self.round.pk}))
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[0], '"Team","UserID","Name","Surname","Score","Factor"')
+        self.assertIn('"Blue","dave","dave","Test","1.0000","1.0000"', lines)
+        self.assertEqual(len(lines), 5)
@@ -32,19 +32,21 @@ class AuthenticationTests(TestCase):
         # pages = ['resetPassword'] # these are pages that need to be included once those pages are finished
         admin_pages = ['maintainRound', 'createRound', 'maintainTeam', 'submitUserForm', 'submitCSV',
                        'userDelete', 'userUpdate|user_id='+str(self.user.user_id),
-                       'updateEmail', 'userAdmin', 'saveQuestion', 'deleteQuestion',
+                       'updateEmail', 'userAdmin', 'getUsers', 'saveQuestion', 'deleteQuestion',
                        'editQuestion|question_pk='+str(self.question.pk),
                        'questionAdmin', 'saveQuestionnaire',
                        'editQuestionnaire|questionnaire_pk='+str(self.questionnaire.pk),
                        'previewQuestionnaire|questionnaire_pk='+str(self.questionnaire.pk),
-                       'deleteQuestionnaire', 'questionnaireAdmin', 'dumpRound',
+                       'deleteQuestionnaire', 'questionnaireAdmin', 'dumpRound', 'startRoundExport',
+                       'roundExportStatus|job_pk=1', 'downloadRoundExport|job_pk=1',
                        'getTeamsForRound|round_pk='+str(self.round.pk),
                        'getQuestionnaireRound|round_pk='+str(self.round.pk),
                        'changeUserTeamForRound|round_pk='+str(self.round.pk) +
                        '|user_id='+str(self.user.user_id) +
                        '|team_name='+str(self.team.teamName), 'getTeams',
-                       'changeTeamStatus|team_pk='+str(self.team.pk)+'|status=C',
                        'submitTeamCSV', 'report', 'getUserReport|user_id='+str(self.user.user_id),
+                       'reportRoster|round_pk='+str(self.round.pk), 'roundStatistics|round_pk='+str(self.round.pk),
+                       'peerScores|round_pk='+str(self.round.pk), 'downloadPeerScores|round_pk='+str(self.round.pk),
                        'maintainRoundWithError|error=2',
                        'deleteRound', 'updateRound|round_pk='+str(self.round.pk)]
         # print("not logged in")
@@ -63,7 +65,7 @@ class AuthenticationTests(TestCase):
         self.client.logout()
         user_pages = ['userProfile|user_id='+str(self.user.user_id),
                       'getQuestionnaireForTeam', 'questionnaire|round_pk='+str(self.round.pk),
-                      'saveQuestionnaireProgress', 'getResponses',
+                      'saveQuestionnaireProgress', 'saveQuestionnaireBatch', 'getResponses', 'getRoundResponses',
                       'activeRounds', 'teamMembers', 'accountDetails']
         # NOT LOGGED IN
         # This should allow visitor pages and not allow user pages or admin pages
@@ -0,0 +1,104 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from peer_review import email
+from peer_review.email import email_template, save_email_template
+from peer_review.emailOutbox import queue_email, send_queued_emails
+from peer_review.models import OutgoingEmail
+
+
+class CountingBackend(EmailBackend):
+    # Stands in for the mail server, counting the connections opened to it
+    connections = 0
+
+    def open(self):
+        CountingBackend.connections += 1
+        return True
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise socket.error("Connection refused")
+
+
+@override_settings(OUTBOX_SENDER=False, OUTBOX_RATE_LIMIT=0)
+class EmailOutboxTests(TestCase):
+    def queue(self, count):
+        for number in range(count):
+            queue_email("Subject " + str(number), "Body", "user" + str(number) + "@example.com")
+
+    @override_settings(EMAIL_BACKEND='peer_review.test.test_email.CountingBackend')
+    def test_batch_shares_one_connection(self):
+        CountingBackend.connections = 0
+        self.queue(3)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(send_queued_emails(), 3)
+        self.assertEqual(send_queued_emails(), 0)
+        self.assertEqual(CountingBackend.connections, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 3)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=60,
+                       EMAIL_BACKEND='peer_review.test.test_email.FailingBackend')
+    def test_failed_email_is_retried_then_given_up(self):
+        self.queue(1)
+        self.assertEqual(send_queued_emails(), 1)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.error), (OutgoingEmail.QUEUED, 1, "Connection refused"))
+        self.assertGreater(email.nextAttempt, timezone.now() + timedelta(seconds=50))
+        # Not due again until the back-off has passed
+        self.assertEqual(send_queued_emails(), 0)
+
+        OutgoingEmail.objects.update(nextAttempt=timezone.now())
+        self.assertEqual(send_queued_emails(), 1)
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.FAILED)
+
+    def test_send_emails_command(self):
+        self.queue(2)
+        call_command('send_emails', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].subject, "Subject 0")
+
+
+class EmailTemplateTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(email, 'TEXT_DIR', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(email._templates.clear)
+
+    def write(self, text, modified):
+        path = os.path.join(self.directory, 'greeting.txt')
+        with open(path, 'w') as file:
+            file.write(text)
+        os.utime(path, (modified, modified))
+
+    def test_render(self):
+        self.write("Good day {first_name} {last_name}, {unknown} {user_id}", 1000)
+        self.assertEqual(email_template('greeting.txt').render(first_name='Ann', last_name='Lee', user_id=12),
+                         "Good day Ann Lee, {unknown} 12")
+
+    def test_template_is_read_again_once_changed(self):
+        self.write("Hello {first_name}", 1000)
+        template = email_template('greeting.txt')
+        with mock.patch('builtins.open', side_effect=AssertionError("read again")):
+            self.assertIs(email_template('greeting.txt'), template)
+
+        self.write("Goodbye {first_name}", 2000)
+        self.assertEqual(email_template('greeting.txt').render(first_name='Ann'), "Goodbye Ann")
+        save_email_template('greeting.txt', "Welcome {first_name}")
+        self.assertEqual(email_template('greeting.txt').render(first_name='Ann'), "Welcome Ann")
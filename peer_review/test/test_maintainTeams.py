@@ -1,6 +1,13 @@
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.test import TestCase, Client
 from django.utils import timezone
+from peer_review.models import Document
+from peer_review.teamImport import read_teams, MISSING_VALUES, BAD_FORMAT, UNKNOWN_USER, UNKNOWN_ROUND, \
+    DUPLICATE_USER
 from peer_review.views import *
 import json
 import datetime
@@ -51,16 +58,32 @@ class MaintainTeamTests(TestCase):
         # Test that the teamName is 'Green'
         self.assertEqual(team.teamName, 'Green')
 
-    def test_change_team_status(self):
+    def test_change_user_team_recounts_only_both_teams(self):
         self.client.login(username='2', password='admin')
-        team = TeamDetail.objects.create(roundDetail=self.round1, user=self.user2)
-        reverse('changeTeamStatus', kwargs={'team_pk': team.pk, 'status': 'U'})
+        # Stale counts show which members were recounted
+        TeamDetail.objects.filter(roundDetail=self.round1).update(answered=7)
+
+        url = reverse('changeUserTeamForRound', kwargs={'round_pk': self.round1.pk,
+                                                        'user_id': self.user2.user_id, 'team_name': 'Team1'})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(TeamDetail.objects.get(pk=self.team1.pk).answered, 0)
+        self.assertEqual(TeamDetail.objects.get(pk=453).answered, 0)
+
+        url = reverse('changeUserTeamForRound', kwargs={'round_pk': self.round1.pk,
+                                                        'user_id': self.user1.user_id, 'team_name': 'Red'})
+        TeamDetail.objects.filter(pk=453).update(answered=7)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(TeamDetail.objects.get(pk=self.team1.pk).answered, 0)
+        self.assertEqual(TeamDetail.objects.get(pk=self.team2.pk).answered, 0)
+        self.assertEqual(TeamDetail.objects.get(pk=453).answered, 7)
 
     def test_get_teams_for_round(self):
         self.client.login(username='2', password='admin')
 
         url = reverse("getTeamsForRound", kwargs={'round_pk': self.round1.pk})
-        json_response = json.loads(self.client.get(url).content.decode())
+        # Session, user, team sizes, the round's questionnaire and the members
+        with self.assertNumQueries(5):
+            json_response = json.loads(self.client.get(url).content.decode())
 
         # Both teams should be in the JSON file as root keys
         self.assertIsNotNone(json_response[str(self.team1.pk)])
@@ -78,3 +101,114 @@ class MaintainTeamTests(TestCase):
         self.assertEqual(json_response_team2['user_id'], str(self.user2.pk))
         self.assertEqual(json_response_team2['status'], self.team2.status)
         self.assertEqual(json_response_team2['teamSize'], 2)
+
+    def test_get_teams(self):
+        self.client.login(username='2', password='admin')
+        TeamDetail.objects.create(user=self.user1, roundDetail=self.round2, teamName='Team3', pk=500)
+
+        # Session, user, the count and the page, however many memberships there are
+        with self.assertNumQueries(4):
+            json_response = json.loads(self.client.get(reverse('getTeams'), {'pageSize': 3}).content.decode())
+        self.assertEqual((json_response['page'], json_response['pageCount'], json_response['total']), (1, 2, 4))
+        self.assertEqual([team['teamId'] for team in json_response['teams']], [123, 321, 453])
+        self.assertEqual(json_response['teams'][0], {'user_id': '1', 'initials': '', 'surname': 'simons',
+                                                     'round': 'Round 1', 'team': 'Team1',
+                                                     'status': TeamDetail.NOT_ATTEMPTED, 'teamId': 123})
+
+        json_response = json.loads(self.client.get(reverse('getTeams'), {'round': self.round2.pk}).content.decode())
+        self.assertEqual([team['teamId'] for team in json_response['teams']], [500])
+        response = self.client.get(reverse('getTeams'), {'page': 3, 'pageSize': 3})
+        self.assertTemplateUsed(response, 'peer_review/user404.html')
+        response = self.client.get(reverse('getTeams'), {'round': 'first'})
+        self.assertTemplateUsed(response, 'peer_review/user404.html')
+
+    def test_report_roster(self):
+        self.client.login(username='2', password='admin')
+        TeamDetail.objects.filter(pk=453).update(status=TeamDetail.COMPLETED)
+
+        url = reverse("reportRoster", kwargs={'round_pk': self.round1.pk})
+        # Session, user, round and one query for every team member, however many there are
+        with self.assertNumQueries(4):
+            json_response = json.loads(self.client.get(url).content.decode())
+
+        self.assertEqual(json_response['questionnaire'], '')
+        self.assertEqual([team['teamName'] for team in json_response['teams']], ['Team1', 'Team2'])
+        team2 = json_response['teams'][1]
+        self.assertEqual(team2['size'], 2)
+        self.assertEqual(team2['completion'], {TeamDetail.NOT_ATTEMPTED: 1, TeamDetail.IN_PROGRESS: 0,
+                                               TeamDetail.COMPLETED: 1})
+        self.assertEqual({member['user_id']: member['status'] for member in team2['members']},
+                         {str(self.user2.pk): TeamDetail.NOT_ATTEMPTED, str(self.user3.pk): TeamDetail.COMPLETED})
+        # The round has no questionnaire, so there is nothing to answer
+        self.assertEqual((team2['required'], team2['members'][0]['answered']), (0, 0))
+
+
+class TeamImportTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.users = [User.objects.create_user(name + '@team.com', 'pw', name, 'Test', user_id=name)
+                      for name in ('alice', 'bob', 'carol')]
+        User.objects.create_superuser('admin', 'admin', user_id='1111')
+        now = datetime.datetime.now(tz=timezone.get_current_timezone())
+        self.round1 = RoundDetail.objects.create(name='Round 1', startingDate=now, endingDate=now, description='R1')
+        self.round2 = RoundDetail.objects.create(name='Round 2', startingDate=now, endingDate=now, description='R2')
+        TeamDetail.objects.create(user=self.users[0], roundDetail=self.round1, teamName='Red')
+        TeamDetail.objects.create(user=self.users[1], roundDetail=self.round1, teamName='Red')
+        self.client.login(username='1111', password='admin')
+
+    def upload(self, text):
+        return self.client.post(reverse('submitTeamCSV'), {'doc_file': SimpleUploadedFile('teams.csv', text.encode())})
+
+    def teams(self):
+        return sorted(TeamDetail.objects.values_list('roundDetail__name', 'user_id', 'teamName'))
+
+    def test_read_teams(self):
+        lines = ['"user_id","round_name","team_name"', '"alice","Round 1","Blue"', '"bob","Round 1",""',
+                 '"dave","Round 1","Blue"', '"carol","Round 3","Blue"', '"alice","Round 1","Green"',
+                 '"carol","Round 2","Blue","extra"']
+        with self.assertNumQueries(2):
+            assignments, errors = read_teams(lines)
+        self.assertEqual(assignments, [(self.round1.pk, 'alice', 'Blue')])
+        self.assertEqual([(error.line, error.code) for error in errors],
+                         [(3, MISSING_VALUES), (4, UNKNOWN_USER), (5, UNKNOWN_ROUND), (6, DUPLICATE_USER),
+                          (7, BAD_FORMAT)])
+        self.assertEqual(read_teams(['"user_id","team"']), (None, []))
+
+    def test_submit_team_csv(self):
+        self.upload('"user_id","roundDetail","teamName"\n"alice","Round 1","Blue"\n"bob","Round 1","Red"\n'
+                    '"carol","Round 1","Blue"\n"alice","Round 2","Green"\n')
+        self.assertEqual(self.teams(), [('Round 1', 'alice', 'Blue'), ('Round 1', 'bob', 'Red'),
+                                        ('Round 1', 'carol', 'Blue'), ('Round 2', 'alice', 'Green')])
+        # The upload is read in memory and not archived
+        self.assertFalse(Document.objects.exists())
+
+    def test_submit_team_csv_size_limit(self):
+        before = self.teams()
+        with self.settings(CSV_UPLOAD_MAX_BYTES=40):
+            response = self.upload('"user_id","roundDetail","teamName"\n"alice","Round 1","Blue"\n')
+        self.assertTemplateUsed(response, 'peer_review/csvTeamError.html')
+        self.assertEqual(self.teams(), before)
+
+    def test_submit_team_csv_archive(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with self.settings(CSV_UPLOAD_ARCHIVE=True, MEDIA_ROOT=media):
+            self.upload('"user_id","roundDetail","teamName"\n"alice","Round 1","Blue"\n')
+            document = Document.objects.get()
+            with document.doc_file as archived:
+                self.assertIn(b'"alice","Round 1","Blue"', archived.read())
+        self.assertEqual(TeamDetail.objects.get(user_id='alice').teamName, 'Blue')
+
+        # Rejected uploads are not kept
+        with self.settings(CSV_UPLOAD_ARCHIVE=True, MEDIA_ROOT=media):
+            self.upload('"user_id","roundDetail","teamName"\n"dave","Round 1","Blue"\n')
+            with self.settings(CSV_UPLOAD_MAX_BYTES=40):
+                self.upload('"user_id","roundDetail","teamName"\n"alice","Round 1","Blue"\n')
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_submit_invalid_team_csv(self):
+        before = self.teams()
+        response = self.upload('"user_id","roundDetail","teamName"\n"alice","Round 1","Blue"\n'
+                               '"dave","Round 1","Blue"\n"carol","Round 9","Blue"\n')
+        self.assertEqual([error.code for error in response.context['csv_errors']], [UNKNOWN_USER, UNKNOWN_ROUND])
+        self.assertEqual(self.teams(), before)
@@ -1,5 +1,421 @@
+import json
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+
+from peer_review.models import Question, QuestionType, QuestionGrouping, QuestionOrder, Label, Rate, Rank, Choice, \
+    FreeformItem, TeamDetail, Response, User, LatestResponse, ArchivedRound, ResponseAggregate
+from peer_review import questionItems, questionnaireCache
+from peer_review.questionnaireCache import get_questionnaire, questionnaires_changed
+from peer_review.responseStore import save_responses
+from peer_review.test.TestSetup import TestSetup
+
+
+class QuestionnaireTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.ts = TestSetup()
+        # Type and grouping pks remembered by another test may belong to rows that were rolled back
+        self.addCleanup(questionItems._pks.clear)
+        self.ts.round.questionnaire = self.ts.questionnaire
+        # Answers are only accepted while the round is open
+        self.ts.round.startingDate = datetime.now(timezone.utc) - timedelta(days=1)
+        self.ts.round.endingDate = datetime.now(timezone.utc) + timedelta(days=1)
+        self.ts.round.save()
+        TeamDetail.objects.create(user=self.ts.user, roundDetail=self.ts.round, teamName='Red')
+        TeamDetail.objects.create(user=self.ts.user2, roundDetail=self.ts.round, teamName='Red')
+
+        self.rate_question = Question.objects.create(questionText="How well did they work?",
+                                                     questionLabel="Rate the team",
+                                                     pubDate=datetime.now(timezone(timedelta(hours=2))),
+                                                     questionType=QuestionType.objects.create(name="Rate"),
+                                                     questionGrouping=QuestionGrouping.objects.create(grouping="All"))
+        Rate.objects.create(question=self.rate_question, topWord="Good", bottomWord="Bad")
+        QuestionOrder.objects.create(questionnaire=self.ts.questionnaire, question=self.rate_question, order=3)
+
+        self.label_question = Question.objects.create(questionText="Rate the parts of the project",
+                                                      questionLabel="Project parts",
+                                                      pubDate=datetime.now(timezone(timedelta(hours=2))),
+                                                      questionType=QuestionType.objects.get(name="Rate"),
+                                                      questionGrouping=QuestionGrouping.objects.create(
+                                                          grouping="Label"))
+        Rate.objects.create(question=self.label_question, topWord="Good", bottomWord="Bad")
+        self.label = Label.objects.create(question=self.label_question, labelText="Design")
+        QuestionOrder.objects.create(questionnaire=self.ts.questionnaire, question=self.label_question, order=4)
+
+        self.client.login(username='12345', password='bob')
+
+    def post_batch(self, answers):
+        url = reverse('saveQuestionnaireBatch')
+        response = self.client.post(url, json.dumps({'roundPk': self.ts.round.pk, 'answers': answers}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())
+
+    def test_save_batch(self):
+        existing = Response.objects.count()
+        result = self.post_batch([
+            {'questionPk': self.ts.question1.pk, 'answer': 'Batch answer', 'batch_id': 10},
+            {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk, 'answer': 40, 'batch_id': 11},
+            {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user2.pk, 'answer': 60, 'batch_id': 11},
+            {'questionPk': self.label_question.pk, 'label': self.label.pk, 'answer': 80, 'batch_id': 12},
+        ])
+        self.assertEqual(result, {'result': 0, 'saved': 4, 'status': TeamDetail.COMPLETED})
+        self.assertEqual(Response.objects.count(), existing + 4)
+
+        rate_answers = Response.objects.filter(question=self.rate_question).order_by('subjectUser_id')
+        self.assertEqual([r.answer for r in rate_answers], ['40', '60'])
+        self.assertEqual(Response.objects.get(question=self.label_question).label, self.label)
+        team = TeamDetail.objects.get(user=self.ts.user, roundDetail=self.ts.round)
+        self.assertEqual((team.status, team.answered), (TeamDetail.COMPLETED, 6))
+
+    def test_progress_counts_answered_items(self):
+        # The three ungrouped questions the fixture has answered, one rating per team member and one per label
+        # make six items
+        self.assertEqual(self.post_batch([
+            {'questionPk': self.ts.question1.pk, 'answer': 'First', 'batch_id': 10},
+            {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk, 'answer': 40, 'batch_id': 11},
+        ])['status'], TeamDetail.IN_PROGRESS)
+        # Answering an item again does not count it twice
+        self.assertEqual(self.post_batch([
+            {'questionPk': self.ts.question1.pk, 'answer': 'Second', 'batch_id': 12},
+        ])['status'], TeamDetail.IN_PROGRESS)
+        team = TeamDetail.objects.get(user=self.ts.user, roundDetail=self.ts.round)
+        self.assertEqual(team.answered, 4)
+
+        self.client.post(reverse('saveQuestionnaireProgress'), {
+            'roundPk': self.ts.round.pk, 'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user2.pk,
+            'answer': 60, 'batch_id': 13})
+        self.client.post(reverse('saveQuestionnaireProgress'), {
+            'roundPk': self.ts.round.pk, 'questionPk': self.label_question.pk, 'label': self.label.pk,
+            'answer': 80, 'batch_id': 14})
+        team.refresh_from_db()
+        self.assertEqual((team.status, team.answered), (TeamDetail.COMPLETED, 6))
+        self.assertTrue(team.is_completed())
+
+    def test_save_batch_rejects_invalid_answers(self):
+        existing = Response.objects.count()
+        other_label = Label.objects.create(question=self.rate_question, labelText="Not this question's label")
+        result = self.post_batch([
+            {'questionPk': self.ts.question1.pk, 'answer': 'Fine', 'batch_id': 10},
+            {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk, 'answer': 50, 'batch_id': 11},
+            {'questionPk': self.rate_question.pk, 'subjectUser': '1111', 'answer': 50, 'batch_id': 11},
+            {'questionPk': self.label_question.pk, 'label': other_label.pk, 'answer': 80, 'batch_id': 12},
+            {'questionPk': 9999, 'answer': 'No such question', 'batch_id': 13},
+        ])
+        self.assertEqual(result, {'result': 1, 'errors': [2, 3, 4]})
+        # Nothing from a rejected batch is saved
+        self.assertEqual(Response.objects.count(), existing)
+
+    def test_save_refused_once_round_closes(self):
+        answer = {'questionPk': self.ts.question1.pk, 'answer': 'Late', 'batch_id': 10}
+        existing = Response.objects.count()
+        self.ts.round.endingDate = datetime.now(timezone.utc) - timedelta(minutes=1)
+        self.ts.round.save()
+        self.assertEqual(self.post_batch([answer]), {'result': 1})
+        response = self.client.post(reverse('saveQuestionnaireProgress'), dict(answer, roundPk=self.ts.round.pk))
+        self.assertEqual(json.loads(response.content.decode()), {'result': 1})
+
+        # Nor does an archived round take answers, whatever its dates say
+        self.ts.round.endingDate = datetime.now(timezone.utc) + timedelta(days=1)
+        self.ts.round.save()
+        ArchivedRound.objects.create(roundDetail=self.ts.round, archiveFile='round.jsonl.gz', responseCount=0,
+                                     latestCount=0)
+        self.assertEqual(self.post_batch([answer]), {'result': 1})
+        self.assertEqual(Response.objects.count(), existing)
+
+    def test_save_batch_requires_team(self):
+        self.client.login(username='6789', password='joe')
+        TeamDetail.objects.filter(user=self.ts.user2).delete()
+        result = self.post_batch([{'questionPk': self.ts.question1.pk, 'answer': 'Hi', 'batch_id': 1}])
+        self.assertEqual(result, {'result': 1})
+
+    def add_question(self, question_type, grouping, order):
+        question = Question.objects.create(questionText="Question " + str(order),
+                                           questionLabel="Question label " + str(order),
+                                           pubDate=datetime.now(timezone(timedelta(hours=2))),
+                                           questionType=QuestionType.objects.create(name=question_type),
+                                           questionGrouping=QuestionGrouping.objects.create(grouping=grouping))
+        QuestionOrder.objects.create(questionnaire=self.ts.questionnaire, question=question, order=order)
+        return question
+
+    def render_questionnaire(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('questionnaire', kwargs={'round_pk': self.ts.round.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'peer_review/questionnaire.html')
+        return len(queries)
+
+    def test_questionnaire_query_count(self):
+        # Session, user, round, team, team members, the questionnaire, question orders, the five prefetched
+        # item types, the user's saved answers and the user's permissions for the base template
+        with self.assertNumQueries(15):
+            self.render_questionnaire()
+        # The questionnaire is then served from the cache
+        with self.assertNumQueries(8):
+            self.render_questionnaire()
+        questionnaires_changed()
+        before = self.render_questionnaire()
+
+        # More questions of every type, over more team members, need no further queries
+        for number in range(3):
+            User.objects.create_user('member' + str(number) + '@team.com', 'pw', 'Member', str(number),
+                                     user_id='member' + str(number))
+            TeamDetail.objects.create(user_id='member' + str(number), roundDetail=self.ts.round, teamName='Red')
+        for order, grouping in enumerate(["None", "Label", "All", "Rest"], 10):
+            choice = self.add_question("Choice", grouping, order)
+            Choice.objects.create(question=choice, choiceText="Yes", num=0)
+            Choice.objects.create(question=choice, choiceText="No", num=1)
+            Label.objects.create(question=choice, labelText="Label")
+            rank = self.add_question("Rank", grouping, order + 10)
+            Rank.objects.create(question=rank, firstWord="Most", secondWord="Least")
+            rate = self.add_question("Rate", grouping, order + 20)
+            Rate.objects.create(question=rate, topWord="Good", bottomWord="Bad", optional=True)
+            freeform = self.add_question("Freeform", grouping, order + 30)
+            FreeformItem.objects.create(question=freeform, freeformType=FreeformItem.WORD)
+        questionnaires_changed()
+        self.assertEqual(self.render_questionnaire(), before)
+
+    def test_round_responses(self):
+        self.post_batch([
+            {'questionPk': self.ts.question1.pk, 'answer': 'First', 'batch_id': 1},
+            {'questionPk': self.ts.question1.pk, 'answer': 'Second', 'batch_id': 2},
+            {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user2.pk, 'answer': 60, 'batch_id': 3},
+            {'questionPk': self.label_question.pk, 'label': self.label.pk, 'answer': 80, 'batch_id': 4},
+        ])
+        # Session, user, round and one query for all the answers; the batch save left the questionnaire cached
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('getRoundResponses'), {'roundPk': self.ts.round.pk})
+        responses = json.loads(response.content.decode())['responses']
+
+        # Only the latest answer is returned
+        self.assertIn('Second', responses[str(self.ts.question1.pk)]['answers'])
+        self.assertNotIn('First', responses[str(self.ts.question1.pk)]['answers'])
+        self.assertEqual(responses[str(self.rate_question.pk)], {'answers': ['60'],
+                                                                 'labelOrUserIds': [str(self.ts.user2.pk)],
+                                                                 'labelOrUserNames': ['Smith 12345']})
+        self.assertEqual(responses[str(self.label_question.pk)], {'answers': ['80'],
+                                                                  'labelOrUserIds': [self.label.pk],
+                                                                  'labelOrUserNames': ['Design']})
+        # The per question endpoint gives the same answers
+        single = self.client.get(reverse('getResponses'), {'roundPk': self.ts.round.pk,
+                                                           'questionPk': self.rate_question.pk})
+        self.assertEqual(json.loads(single.content.decode()), responses[str(self.rate_question.pk)])
+
+    def test_saved_responses_embedded_in_page(self):
+        self.post_batch([{'questionPk': self.ts.question1.pk, 'answer': '</script><b>', 'batch_id': 1}])
+
+        response = self.client.get(reverse('questionnaire', kwargs={'round_pk': self.ts.round.pk}))
+        saved = json.loads(response.context['savedResponses'])
+        self.assertIn('</script><b>', saved[str(self.ts.question1.pk)]['answers'])
+        self.assertNotIn('</script><b>', response.content.decode())
+
+    def test_questionnaire_cache_invalidation(self):
+        compiled = get_questionnaire(self.ts.questionnaire.pk)
+        self.assertIs(get_questionnaire(self.ts.questionnaire.pk), compiled)
+        self.assertIn(self.rate_question.pk, compiled.questions)
+        self.assertEqual(compiled.label_text(self.label.pk), "Design")
+
+        # Editing a question through the admin pages replaces the cached questionnaire
+        self.client.login(username='1111', password='admin')
+        self.client.post(reverse('saveQuestion'), {'question-pk': self.label_question.pk,
+                                                   'question-content': "Rate the parts of the project",
+                                                   'question-title': "Project parts",
+                                                   'question-type': "Rate",
+                                                   'question-grouping': "Label",
+                                                   'question-labels': "Design;#Testing",
+                                                   'rate-first': "Good", 'rate-second': "Bad"})
+        compiled = get_questionnaire(self.ts.questionnaire.pk)
+        self.assertEqual(sorted(label.labelText for label in compiled.labels.values()), ["Design", "Testing"])
+
+        # As does removing a question from the questionnaire
+        self.client.post(reverse('saveQuestionnaire'), {'pk': self.ts.questionnaire.pk,
+                                                        'intro': self.ts.questionnaire.intro,
+                                                        'title': self.ts.questionnaire.label,
+                                                        'questions': str(self.ts.question1.pk)})
+        compiled = get_questionnaire(self.ts.questionnaire.pk)
+        self.assertEqual(list(compiled.questions), [self.ts.question1.pk])
+
+    def test_questionnaire_cache_follows_any_change(self):
+        compiled = get_questionnaire(self.ts.questionnaire.pk)
+        # Rows changed outside the question pages, such as through the admin site, also replace cached copies
+        label = Label.objects.create(question=self.ts.question1, labelText="Added elsewhere")
+        self.assertIsNot(get_questionnaire(self.ts.questionnaire.pk), compiled)
+        self.assertEqual(get_questionnaire(self.ts.questionnaire.pk).label_text(label.pk), "Added elsewhere")
+        label.delete()
+        self.assertIsNone(get_questionnaire(self.ts.questionnaire.pk).label_text(label.pk))
+
+    def test_local_questionnaires_are_limited(self):
+        with mock.patch.object(questionnaireCache, 'LOCAL_LIMIT', 1):
+            get_questionnaire(self.ts.questionnaire.pk)
+            get_questionnaire(self.ts.round.questionnaire_id)
+            self.assertEqual(list(questionnaireCache._compiled), [self.ts.round.questionnaire_id])
+
+    def test_questionnaire_without_cache(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertIsNone(questionnaireCache.current_version())
+            compiled = get_questionnaire(self.ts.questionnaire.pk)
+            self.assertEqual(list(compiled.questions)[:3],
+                             [self.ts.question1.pk, self.ts.question2.pk, self.ts.question3.pk])
+
+    def test_save_progress_rejects_label_of_other_question(self):
+        other_label = Label.objects.create(question=self.rate_question, labelText="Not this question's label")
+        response = self.client.post(reverse('saveQuestionnaireProgress'), {
+            'roundPk': self.ts.round.pk, 'questionPk': self.label_question.pk, 'label': other_label.pk,
+            'answer': 80, 'batch_id': 1})
+        self.assertEqual(json.loads(response.content.decode()), {'result': 1})
+        self.assertFalse(Response.objects.filter(label=other_label).exists())
+
+    def test_save_batch_rejects_questions_removed_from_questionnaire(self):
+        self.assertEqual(self.post_batch([{'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk,
+                                           'answer': 40, 'batch_id': 1}])['result'], 0)
+        QuestionOrder.objects.filter(question=self.rate_question).delete()
+        questionnaires_changed()
+        self.assertEqual(self.post_batch([{'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk,
+                                           'answer': 40, 'batch_id': 2}]), {'result': 1, 'errors': [0]})
+
+    def test_delete_questions(self):
+        self.client.login(username='1111', password='admin')
+        pks = str(self.rate_question.pk) + ';#' + str(self.label_question.pk)
+        response = self.client.post(reverse('deleteQuestion'), {'question-pk': pks, 'preview': 1})
+        counts = json.loads(response.content.decode())['counts']
+        self.assertEqual((counts['questions'], counts['labels'], counts['rates'], counts['question orders']),
+                         (2, 1, 2, 2))
+
+        self.client.post(reverse('deleteQuestion'), {'question-pk': pks})
+        self.assertFalse(Question.objects.filter(pk__in=[self.rate_question.pk, self.label_question.pk]).exists())
+        self.assertEqual(list(get_questionnaire(self.ts.questionnaire.pk).questions),
+                         [self.ts.question1.pk, self.ts.question2.pk, self.ts.question3.pk])
+        # The three remaining questions are answered
+        self.assertEqual(TeamDetail.objects.get(user=self.ts.user).status, TeamDetail.COMPLETED)
+
+    def test_delete_questionnaires(self):
+        self.client.login(username='1111', password='admin')
+        response = self.client.post(reverse('deleteQuestionnaire'), {'pk': str(self.ts.questionnaire.pk),
+                                                                     'preview': 1})
+        counts = json.loads(response.content.decode())['counts']
+        self.assertEqual((counts['questionnaires'], counts['round details'], counts['team details']), (1, 1, 2))
+
+        self.client.post(reverse('deleteQuestionnaire'), {'pk': str(self.ts.questionnaire.pk)})
+        self.assertFalse(TeamDetail.objects.exists())
+        self.assertTrue(Question.objects.filter(pk=self.rate_question.pk).exists())
+
+    def test_save_question_keeps_unchanged_items(self):
+        self.post_batch([{'questionPk': self.label_question.pk, 'label': self.label.pk, 'answer': 80, 'batch_id': 1}])
+        self.client.login(username='1111', password='admin')
+        form = {'question-pk': self.label_question.pk, 'question-content': "Rate the parts of the project",
+                'question-title': "Project parts", 'question-type': "Rate", 'question-grouping': "Label",
+                'question-labels': "Testing;#Design", 'rate-first': "Good", 'rate-second': "Bad"}
+        self.client.post(reverse('saveQuestion'), form)
+
+        labels = Label.objects.filter(question=self.label_question)
+        self.assertEqual(sorted(label.labelText for label in labels), ["Design", "Testing"])
+        self.assertEqual(labels.get(labelText="Design").pk, self.label.pk)
+        self.assertTrue(Response.objects.filter(label=self.label).exists())
+        rate = Rate.objects.get(question=self.label_question)
+
+        # Removing a label removes the answers about it
+        form.update({'question-labels': "Testing", 'rate-first': "Great"})
+        self.client.post(reverse('saveQuestion'), form)
+        self.assertEqual([label.labelText for label in Label.objects.filter(question=self.label_question)],
+                         ["Testing"])
+        self.assertFalse(Response.objects.filter(label=self.label).exists())
+        self.assertEqual(Rate.objects.get(question=self.label_question).pk, rate.pk)
+        self.assertEqual(Rate.objects.get(question=self.label_question).topWord, "Great")
+
+    def test_save_question_recounts_rounds(self):
+        self.post_batch([{'questionPk': self.label_question.pk, 'label': self.label.pk, 'answer': 80, 'batch_id': 1},
+                         {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user.pk, 'answer': 40,
+                          'batch_id': 2},
+                         {'questionPk': self.rate_question.pk, 'subjectUser': self.ts.user2.pk, 'answer': 60,
+                          'batch_id': 2}])
+        team = TeamDetail.objects.get(user=self.ts.user, roundDetail=self.ts.round)
+        self.assertEqual((team.answered, team.status), (6, TeamDetail.COMPLETED))
+        self.assertTrue(ResponseAggregate.objects.filter(label=self.label).exists())
+
+        self.client.login(username='1111', password='admin')
+        form = {'question-pk': self.label_question.pk, 'question-content': "Rate the parts of the project",
+                'question-title': "Project parts", 'question-type': "Rate", 'question-grouping': "Label",
+                'question-labels': "Testing", 'rate-first': "Good", 'rate-second': "Bad"}
+        self.client.post(reverse('saveQuestion'), form)
+        team.refresh_from_db()
+        self.assertEqual((team.answered, team.status), (5, TeamDetail.IN_PROGRESS))
+
+        # Rating the rest of the team leaves out the rating the member gave themselves
+        form.update({'question-pk': self.rate_question.pk, 'question-title': "Rate the team",
+                     'question-grouping': "Rest"})
+        self.client.post(reverse('saveQuestion'), form)
+        team.refresh_from_db()
+        self.assertEqual(team.answered, 4)
+
+    def test_deleted_grouping_is_not_reused(self):
+        self.client.login(username='1111', password='admin')
+        form = {'question-content': "Which language?", 'question-title': "Language", 'question-type': "Choice",
+                'question-grouping': "None", 'question-choices': "Python;#Java"}
+        self.client.post(reverse('saveQuestion'), form)
+        grouping = Question.objects.get(questionLabel="Language").questionGrouping
+        grouping.delete()
+
+        form['question-title'] = "Language again"
+        self.client.post(reverse('saveQuestion'), form)
+        self.assertEqual(Question.objects.get(questionLabel="Language again").questionGrouping.grouping, "None")
+
+    def test_save_question_choices(self):
+        self.client.login(username='1111', password='admin')
+        groupings = QuestionGrouping.objects.count()
+        form = {'question-content': "Which language?", 'question-title': "Language", 'question-type': "Choice",
+                'question-grouping': "None", 'question-choices': "Python;#Java;#C"}
+        self.client.post(reverse('saveQuestion'), form)
+        question = Question.objects.get(questionLabel="Language")
+        python = Choice.objects.get(question=question, choiceText="Python")
+
+        form.update({'question-pk': question.pk, 'question-choices': "Go;#Python;#C"})
+        self.client.post(reverse('saveQuestion'), form)
+        choices = Choice.objects.filter(question=question).order_by('num')
+        self.assertEqual([(choice.choiceText, choice.num) for choice in choices], [("Go", 0), ("Python", 1), ("C", 2)])
+        self.assertEqual(choices[1].pk, python.pk)
+        self.assertEqual(QuestionGrouping.objects.count(), groupings)
+
+    def test_save_question_reorders_items(self):
+        self.client.login(username='1111', password='admin')
+        self.client.post(reverse('saveQuestion'), {
+            'question-pk': self.ts.question2.pk, 'question-content': "Different question here",
+            'question-title': "I'm the label for the question", 'question-type': "Choice", 'question-grouping': "None",
+            'question-choices': "choice 4;#choice 1;#choice 5;#choice 2"})
+        self.client.post(reverse('saveQuestion'), {
+            'question-pk': self.label_question.pk, 'question-content': "Rate the parts of the project",
+            'question-title': "Project parts", 'question-type': "Rate", 'question-grouping': "Label",
+            'question-labels': "Testing;#Design", 'rate-first': "Good", 'rate-second': "Bad"})
+
+        compiled = get_questionnaire(self.ts.questionnaire.pk)
+        self.assertEqual([choice.choiceText for choice in compiled.questions[self.ts.question2.pk].get_choices()],
+                         ["choice 4", "choice 1", "choice 5", "choice 2"])
+        self.assertEqual([label.labelText for label in compiled.questions[self.label_question.pk].get_labels()],
+                         ["Testing", "Design"])
+        response = self.client.get(reverse('editQuestion', kwargs={'question_pk': self.label_question.pk}))
+        self.assertEqual([label.labelText for label in response.context['labels']], ["Testing", "Design"])
+
+    def test_latest_response_keys_are_unique(self):
+        # The fixture's current answer to question1 has no label, so only the item key can reject a second one
+        current = LatestResponse.objects.get(user=self.ts.user, question=self.ts.question1)
+        self.assertIsNone(current.label_id)
+        response = Response.objects.create(question=self.ts.question1, roundDetail=self.ts.round, user=self.ts.user,
+                                           subjectUser=self.ts.user2, answer="Twice", batch_id=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LatestResponse.objects.create(roundDetail=self.ts.round, user=self.ts.user, question=self.ts.question1,
+                                          subjectUser=self.ts.user2, response=response, batch_id=1, answer="Twice")
 
-class QuestionnaireTests():
-    pass
\ No newline at end of file
+    def test_save_responses_links_new_rows(self):
+        responses = [Response(question=self.rate_question, roundDetail=self.ts.round, user=user,
+                              subjectUser=subject, answer=str(user.pk) + '-' + str(subject.pk), batch_id=7)
+                     for user in (self.ts.user, self.ts.user2) for subject in (self.ts.user, self.ts.user2)]
+        save_responses(responses)
+        for response in responses:
+            self.assertEqual(Response.objects.get(pk=response.pk).answer, response.answer)
+            latest = LatestResponse.objects.get(user=response.user, subjectUser=response.subjectUser,
+                                                question=self.rate_question)
+            self.assertEqual((latest.response_id, latest.itemKey), (response.pk, ':' + str(response.subjectUser_id)))
@@ -1,6 +1,25 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test import TestCase, Client
-from peer_review.models import RoundDetail
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
+
+from peer_review import exportJobs, roundArchive
+from peer_review.bulkDelete import delete_questionnaires
+from peer_review.models import RoundDetail, ExportJob, Response, LatestResponse, ArchivedRound, TeamDetail
+from peer_review.responseStore import response_stamp, save_responses
+from peer_review.roundExport import numpy
+from peer_review.teamImport import ARCHIVED_ROUND, read_teams
 from peer_review.test.TestSetup import TestSetup
 
 
@@ -50,14 +69,212 @@ class RoundTests(TestCase):
 
     def test_round_dump(self):
         self.client.login(username='1111', password='admin')
+        dumps = os.listdir('media/dumps')
 
         url = reverse('dumpRound')
         response = self.client.post(url, {'roundPk': self.ts.round.id})
 
         self.assertEqual(response.status_code, 200)
         # data = json.loads(response.content.decode())
-        content = response.content
+        content = b''.join(response.streaming_content)
+        # The dump is streamed without being written to disk
+        self.assertEqual(os.listdir('media/dumps'), dumps)
         self.assertEquals(content, b'"ResponseID","Respondent","QuestionTitle","LabelTitle","SubjectUser","Answer"' +
                                    b'\n"2","12345","I\'m the label","","6789","We have a different answer"' +
                                    b'\n"4","12345","I\'m the label for the question","","6789","choice 2"' +
-                                   b'\n"6","12345","I\'m a label for this question","","6789","Bananas"\n')
\ No newline at end of file
+                                   b'\n"6","12345","I\'m a label for this question","","6789","Bananas"\n')
+
+    def dump(self, export_format):
+        self.client.login(username='1111', password='admin')
+        response = self.client.post(reverse('dumpRound'), {'roundPk': self.ts.round.id, 'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_round_dump_gzip(self):
+        self.assertEqual(gzip.decompress(self.dump('csv.gz')), self.dump('csv'))
+
+    def test_round_dump_jsonl(self):
+        lines = self.dump('jsonl').decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'ResponseID': 2, 'Respondent': '12345', 'QuestionTitle': "I'm the label", 'LabelTitle': '',
+             'SubjectUser': '6789', 'Answer': 'We have a different answer'},
+            {'ResponseID': 4, 'Respondent': '12345', 'QuestionTitle': "I'm the label for the question",
+             'LabelTitle': '', 'SubjectUser': '6789', 'Answer': 'choice 2'},
+            {'ResponseID': 6, 'Respondent': '12345', 'QuestionTitle': "I'm a label for this question",
+             'LabelTitle': '', 'SubjectUser': '6789', 'Answer': 'Bananas'}])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_round_dump_npz(self):
+        archive = numpy.load(io.BytesIO(self.dump('npz')))
+        self.assertEqual(list(archive['response_id']), [2, 4, 6])
+        self.assertEqual(list(archive['users'][archive['respondent']]), ['12345'] * 3)
+        self.assertEqual(list(archive['users'][archive['subject_user']]), ['6789'] * 3)
+        self.assertEqual(list(archive['label']), [-1] * 3)
+        self.assertEqual(list(archive['answers'][archive['answer']]),
+                         ['We have a different answer', 'choice 2', 'Bananas'])
+
+    def test_round_dump_unknown_format(self):
+        self.client.login(username='1111', password='admin')
+        response = self.client.post(reverse('dumpRound'), {'roundPk': self.ts.round.id, 'format': 'xls'})
+        self.assertRedirects(response, reverse('maintainRoundWithError', kwargs={'error': 2}))
+
+
+@override_settings(EXPORT_WORKERS=0)
+class RoundExportJobTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.ts = TestSetup()
+        self.client.login(username='1111', password='admin')
+        self.dump_dir = tempfile.mkdtemp()
+        self.original_dump_dir = exportJobs.DUMP_DIR
+        exportJobs.DUMP_DIR = self.dump_dir
+
+    def tearDown(self):
+        exportJobs.DUMP_DIR = self.original_dump_dir
+        shutil.rmtree(self.dump_dir)
+
+    def start_export(self, export_format='csv'):
+        response = self.client.post(reverse('startRoundExport'), {'roundPk': self.ts.round.pk,
+                                                                   'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())
+
+    def test_export_job(self):
+        job = self.start_export()
+        self.assertEqual(job['status'], ExportJob.DONE)
+        self.assertEqual(job['progress'], 100)
+
+        status = self.client.get(reverse('roundExportStatus', kwargs={'job_pk': job['jobId']}))
+        self.assertEqual(json.loads(status.content.decode())['status'], ExportJob.DONE)
+
+        download = self.client.get(reverse('downloadRoundExport', kwargs={'job_pk': job['jobId']}))
+        self.assertEqual(download.status_code, 200)
+        streamed = self.client.post(reverse('dumpRound'), {'roundPk': self.ts.round.pk})
+        self.assertEqual(b''.join(download.streaming_content), b''.join(streamed.streaming_content))
+
+    def test_export_reuses_current_dump(self):
+        first = self.start_export()
+        self.assertEqual(self.start_export()['jobId'], first['jobId'])
+        self.assertNotEqual(self.start_export('jsonl')['jobId'], first['jobId'])
+
+        save_responses([Response(question=self.ts.question1, roundDetail=self.ts.round, user=self.ts.user,
+                                 subjectUser=self.ts.user2, answer="A newer answer", batch_id=99)])
+        self.assertNotEqual(self.start_export()['jobId'], first['jobId'])
+        self.assertEqual(len(os.listdir(self.dump_dir)), 3)
+
+    def test_stale_job_fails(self):
+        job = ExportJob.objects.create(roundDetail=self.ts.round, exportFormat='csv', status=ExportJob.RUNNING,
+                                       responseStamp=response_stamp(self.ts.round.pk))
+        # A long export is not failed while it keeps reporting progress
+        ExportJob.objects.filter(pk=job.pk).update(created=timezone.now() - timedelta(hours=2))
+        status = self.client.get(reverse('roundExportStatus', kwargs={'job_pk': job.pk}))
+        self.assertEqual(json.loads(status.content.decode())['status'], ExportJob.RUNNING)
+
+        ExportJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - timedelta(minutes=20))
+        status = self.client.get(reverse('roundExportStatus', kwargs={'job_pk': job.pk}))
+        self.assertEqual(json.loads(status.content.decode())['status'], ExportJob.FAILED)
+        self.assertEqual(ExportJob.objects.get(pk=job.pk).error, exportJobs.STALE_JOB_ERROR)
+        # A new export does not wait for the dead job
+        self.assertNotEqual(self.start_export()['jobId'], job.pk)
+
+    def test_failed_job_is_logged(self):
+        with mock.patch.object(exportJobs, 'export_chunks', side_effect=ValueError("Broken round")), \
+                self.assertLogs('peer_review.exportJobs', 'ERROR'):
+            job = self.start_export()
+        self.assertEqual(job['status'], ExportJob.FAILED)
+        self.assertEqual(ExportJob.objects.get(pk=job['jobId']).error, "Broken round")
+
+    def test_collect_old_dumps(self):
+        old = ExportJob.objects.get(pk=self.start_export()['jobId'])
+        new = ExportJob.objects.get(pk=self.start_export('jsonl')['jobId'])
+        yesterday = time.time() - 24 * 60 * 60
+        os.utime(old.dumpFile, (yesterday, yesterday))
+
+        self.assertEqual(exportJobs.collect_old_dumps(max_age=60 * 60), [old.dumpFile])
+        self.assertFalse(ExportJob.objects.filter(pk=old.pk).exists())
+        self.assertTrue(os.path.isfile(new.dumpFile))
+
+        self.assertEqual(exportJobs.collect_old_dumps(max_bytes=0), [new.dumpFile])
+        self.assertEqual(os.listdir(self.dump_dir), [])
+
+    def test_collect_abandoned_part_files(self):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        abandoned = os.path.join(self.dump_dir, 'round_1_job_1.csv.part')
+        writing = os.path.join(self.dump_dir, 'round_1_job_2.csv.part')
+        for path in (abandoned, writing):
+            with open(path, 'wb') as part:
+                part.write(b'half')
+        an_hour_ago = time.time() - 60 * 60
+        os.utime(abandoned, (an_hour_ago, an_hour_ago))
+
+        self.assertEqual(exportJobs.collect_old_dumps(), [])
+        self.assertEqual(os.listdir(self.dump_dir), [os.path.basename(writing)])
+
+
+class RoundArchiveTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.ts = TestSetup()
+        self.client.login(username='1111', password='admin')
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(roundArchive, 'ARCHIVE_DIR', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+        RoundDetail.objects.filter(pk=self.ts.round.pk).update(endingDate=timezone.now() - timedelta(days=40))
+
+    def dump(self, export_format):
+        response = self.client.post(reverse('dumpRound'), {'roundPk': self.ts.round.id, 'format': export_format})
+        return b''.join(response.streaming_content)
+
+    def test_archive_rounds(self):
+        responses = Response.objects.filter(roundDetail=self.ts.round).count()
+        dumps = {export_format: self.dump(export_format) for export_format in ('csv', 'jsonl')}
+        stamp = response_stamp(self.ts.round.pk)
+
+        call_command('archive_rounds', days=60, stdout=io.StringIO())
+        self.assertFalse(ArchivedRound.objects.exists())
+        output = io.StringIO()
+        call_command('archive_rounds', days=30, stdout=output)
+        self.assertIn("Archived 1 rounds", output.getvalue())
+
+        archive = ArchivedRound.objects.get(roundDetail=self.ts.round)
+        self.assertEqual((archive.responseCount, archive.latestCount), (responses, 3))
+        self.assertFalse(Response.objects.filter(roundDetail=self.ts.round).exists())
+        self.assertFalse(LatestResponse.objects.filter(roundDetail=self.ts.round).exists())
+        with gzip.open(archive.archiveFile, 'rt') as lines:
+            self.assertEqual(len(lines.readlines()), responses + 1)
+
+        # Exports read the archive and match the ones taken before
+        for export_format, content in dumps.items():
+            self.assertEqual(self.dump(export_format), content)
+        self.assertEqual(response_stamp(self.ts.round.pk), stamp)
+
+        # Archived rounds are not archived again
+        output = io.StringIO()
+        call_command('archive_rounds', days=30, stdout=output)
+        self.assertIn("Archived 0 rounds", output.getvalue())
+
+    def test_archive_rounds_dry_run(self):
+        output = io.StringIO()
+        call_command('archive_rounds', days=30, dry_run=True, stdout=output)
+        self.assertIn("1 rounds to archive", output.getvalue())
+        self.assertFalse(ArchivedRound.objects.exists())
+        self.assertTrue(LatestResponse.objects.filter(roundDetail=self.ts.round).exists())
+
+    def test_archived_round_is_closed(self):
+        archive = roundArchive.archive_round(RoundDetail.objects.get(pk=self.ts.round.pk))
+        team = TeamDetail.objects.create(user=self.ts.user, roundDetail=self.ts.round, teamName='Red')
+        response = self.client.get(reverse('changeUserTeamForRound', kwargs={
+            'round_pk': self.ts.round.pk, 'user_id': self.ts.user.pk, 'team_name': 'Blue'}))
+        self.assertEqual(json.loads(response.content.decode()), {'success': False})
+        self.assertEqual(TeamDetail.objects.get(pk=team.pk).teamName, 'Red')
+
+        assignments, errors = read_teams(['user_id,round_name,team_name',
+                                          '%s,%s,Blue' % (self.ts.user.pk, self.ts.round.name)])
+        self.assertEqual((assignments, [error.code for error in errors]), ([], [ARCHIVED_ROUND]))
+
+        # Deleting the round's questionnaire deletes the round and, once committed, its archive file
+        with mock.patch('peer_review.signals.transaction.on_commit', lambda callback: callback()):
+            delete_questionnaires([self.ts.round.questionnaire])
+        self.assertFalse(os.path.exists(archive.archiveFile))
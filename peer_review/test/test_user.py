@@ -1,8 +1,18 @@
+import multiprocessing
+from unittest import mock
+
+from django.contrib.auth.hashers import check_password
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.test import TestCase, Client
 
 # from peer_review.models import User
 
+from peer_review.emailOutbox import send_queued_emails
+from peer_review.passwordHashing import hash_passwords
+from peer_review.userImport import read_users, import_users, USER_EXISTS, MISSING_VALUES, DUPLICATE_USER, \
+    BAD_FORMAT
 from peer_review.views import *
 import json
 
@@ -42,7 +52,62 @@ class UserTests(TestCase):
         self.client.login(username='1111', password='admin')
         url = reverse('userAdmin')
         response = self.client.get(url, follow=True)
-        self.assertIn(self.user, response.context['users']())
+        self.assertTemplateUsed(response, 'peer_review/userAdmin.html')
+
+        response = self.client.get(reverse('getUsers'))
+        users = json.loads(response.content.decode())
+        self.assertEqual([user['user_id'] for user in users['users']], ['1111', '1234', '5678'])
+        self.assertEqual(users['users'][2]['surname'], 'Joe')
+        self.assertIsNone(users['next'])
+
+    def test_user_list_pages(self):
+        for number in range(5):
+            User.objects.create_user('p' + str(number) + '@page.com', 'pass', 'Page', user_id='9' + str(number),
+                                     surname='Page' + str(number))
+        self.client.login(username='1111', password='admin')
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('getUsers'), {'pageSize': 3})
+        users = json.loads(response.content.decode())
+        self.assertEqual([user['user_id'] for user in users['users']], ['1111', '1234', '5678'])
+        self.assertEqual(users['next'], '5678')
+
+        response = self.client.get(reverse('getUsers'), {'pageSize': 3, 'after': users['next']})
+        users = json.loads(response.content.decode())
+        self.assertEqual([user['user_id'] for user in users['users']], ['90', '91', '92'])
+        response = self.client.get(reverse('getUsers'), {'pageSize': 3, 'after': users['next']})
+        users = json.loads(response.content.decode())
+        self.assertEqual([user['user_id'] for user in users['users']], ['93', '94'])
+        self.assertIsNone(users['next'])
+
+        response = self.client.get(reverse('getUsers'), {'pageSize': 2, 'order': 'desc', 'after': '93'})
+        users = json.loads(response.content.decode())
+        self.assertEqual([user['user_id'] for user in users['users']], ['92', '91'])
+
+    def test_user_list_search(self):
+        self.client.login(username='1111', password='admin')
+        for search, expected in [('jo', ['5678']), ('b@', ['1234']), ('12', ['1234']), ('ob', [])]:
+            response = self.client.get(reverse('getUsers'), {'search': search})
+            users = json.loads(response.content.decode())
+            self.assertEqual([user['user_id'] for user in users['users']], expected)
+
+    def test_user_delete(self):
+        for number in range(3):
+            User.objects.create_user('d' + str(number) + '@delete.com', 'pass', 'Gone', 'User', user_id='8' + str(number))
+        self.client.login(username='1111', password='admin')
+        url = reverse('userDelete')
+
+        response = self.client.post(url, {'toDelete[]': ['80', '81', '1234'], 'preview': 1})
+        self.assertEqual(json.loads(response.content.decode())['counts'], {'users': 3})
+        self.assertEqual(User.objects.filter(user_id__in=['80', '81', '1234']).count(), 3)
+
+        self.client.post(url, {'toDelete[]': ['80', '81', '1234']})
+        self.assertEqual(sorted(User.objects.values_list('user_id', flat=True)), ['1111', '5678', '82'])
+
+        # Nothing is deleted when one of the users does not exist
+        response = self.client.post(url, {'toDelete[]': ['82', '80']})
+        self.assertTemplateUsed(response, 'peer_review/user404.html')
+        self.assertTrue(User.objects.filter(user_id='82').exists())
 
     # Unit Test
     def test_get_user(self):
@@ -74,4 +139,93 @@ class UserTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, '/login/')
         # self.assertTemplateUsed(response, 'peer_review/userError.html')
-        # print("\n--- END ---\n")
\ No newline at end of file
+        # print("\n--- END ---\n")
+
+
+class UserImportTests(TestCase):
+    header = '"title","initials","name","surname","email","cell","user_id"\n'
+
+    def setUp(self):
+        User.objects.create_user('b@bob.com', 'bob', 'bob', user_id='1234', surname="bob", initials="B")
+
+    def test_read_users_reports_every_bad_row(self):
+        lines = (self.header +
+                 '"Mr","D","Dillon","Heins","dh@gmail.com","0798016454","14035548"\n'
+                 '"Mr","B","Bob","Bob","b@bob.com","0798016454","1234"\n'
+                 '"Ms","N","Nikki","","nk@gmail.com","0831234567","15123123"\n'
+                 '"Mr","D","Dillon","Heins","dh@gmail.com","0798016454","14035548"\n'
+                 '"Mr","M","Matthew","Botha","mb@gmail.com","0781245487","1467114800000"\n').splitlines()
+        with self.assertNumQueries(1):
+            users, errors = read_users(lines)
+        self.assertEqual([row['user_id'] for row in users], ['14035548'])
+        self.assertEqual([(error.line, error.code) for error in errors],
+                         [(3, USER_EXISTS), (4, MISSING_VALUES), (5, DUPLICATE_USER), (6, BAD_FORMAT)])
+        self.assertEqual(errors[0].row, ['Mr', 'B', 'Bob', 'Bob', 'b@bob.com', '0798016454', '1234'])
+
+        self.assertEqual(read_users(['"title","name","user_id"']), (None, []))
+
+    def test_read_users_in_batches(self):
+        lines = [self.header] + ['"Mr","T","Test","User","t%d@test.com","0798016454","%d"' % (i, 20000000 + i)
+                                 for i in range(1200)]
+        lines.append('"Mr","B","Bob","Bob","b@bob.com","0798016454","1234"')
+        with self.assertNumQueries(3):
+            users, errors = read_users(lines)
+        self.assertEqual(len(users), 1200)
+        self.assertEqual([(error.line, error.code) for error in errors], [(1202, USER_EXISTS)])
+
+    def test_import_users(self):
+        users, errors = read_users((self.header +
+                                    '"Mr","D","Dillon","Heins","dh@gmail.com","0798016454","14035548"\n'
+                                    '"Ms","N","Nikki","Constancon","nk@gmail.com","0831234567","15123123"\n'
+                                    ).splitlines())
+        import_users(users)
+        self.assertEqual(send_queued_emails(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        user = User.objects.get(user_id='15123123')
+        self.assertEqual((user.surname, user.status, user.is_active), ('Constancon', 'U', True))
+        self.assertTrue(user.has_usable_password())
+
+    def test_submit_invalid_csv(self):
+        User.objects.create_superuser('admin@admin.com', 'admin', user_id='1111')
+        self.client.login(username='1111', password='admin')
+        upload = SimpleUploadedFile('users.csv', (self.header +
+                                                  '"Mr","B","Bob","Bob","b@bob.com","0798016454","1234"\n'
+                                                  '"Mr","J","Joe","","j@joe.com","0798016454","5678"\n').encode())
+        response = self.client.post(reverse('submitCSV'), {'doc_file': upload, 'test-submit-flag': '0'})
+        self.assertEqual([error.code for error in response.context['csv_errors']], [USER_EXISTS, MISSING_VALUES])
+        self.assertFalse(User.objects.filter(user_id='5678').exists())
+
+    def test_hash_passwords(self):
+        for workers in (0, 2):
+            # Two cores, so that the pool is used even where there is only one
+            with self.settings(PASSWORD_HASH_WORKERS=workers), mock.patch('os.cpu_count', return_value=2):
+                hashes = hash_passwords(['first', 'second', 'third'])
+            self.assertEqual([check_password(password, hashed) for password, hashed in
+                              zip(['first', 'second', 'third'], hashes)], [True, True, True])
+            self.assertEqual(len(set(hashes)), 3)
+
+    def test_hash_passwords_without_pool(self):
+        for error in (OSError("No processes"), RuntimeError("Bootstrapping failed"), multiprocessing.TimeoutError()):
+            with self.settings(PASSWORD_HASH_WORKERS=2), mock.patch('os.cpu_count', return_value=2), \
+                    mock.patch('multiprocessing.spawn.get_executable', return_value='/usr/bin/python3'), \
+                    mock.patch('multiprocessing.get_context') as get_context:
+                if isinstance(error, multiprocessing.TimeoutError):
+                    # The pool starts but its workers never answer
+                    pool = get_context.return_value.Pool.return_value.__enter__.return_value
+                    pool.imap.return_value.next.side_effect = error
+                else:
+                    get_context.return_value.Pool.side_effect = error
+                hashes = hash_passwords(['first', 'second'])
+            self.assertTrue(get_context.return_value.Pool.called)
+            self.assertEqual([check_password(password, hashed) for password, hashed in
+                              zip(['first', 'second'], hashes)], [True, True])
+
+    def test_hash_passwords_in_embedded_interpreter(self):
+        # Under uWSGI sys.executable is the server itself, which cannot run the pool's processes
+        with self.settings(PASSWORD_HASH_WORKERS=2), mock.patch('os.cpu_count', return_value=2), \
+                mock.patch('multiprocessing.spawn.get_executable', return_value='/usr/local/bin/uwsgi'), \
+                mock.patch('multiprocessing.get_context') as get_context:
+            hashes = hash_passwords(['first', 'second'])
+        self.assertFalse(get_context.called)
+        self.assertEqual([check_password(password, hashed) for password, hashed in
+                          zip(['first', 'second'], hashes)], [True, True])
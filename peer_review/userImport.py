@@ -0,0 +1,108 @@
+"""
+Imports users from a CSV file with the columns title, initials, name, surname,
+email, cell and user_id. The file is read row by row and every row is checked
+in memory against one query (per 500 rows) for the user ids that already
+exist, so a file with many bad rows reports all of them at once. A file without errors is
+inserted with a single bulk INSERT inside one transaction, which also queues
+each new user's one-time password email.
+"""
+import csv
+
+from django.db import transaction
+
+from .batches import chunks, rows_per_insert
+from .email import email_template, generate_otp_email
+from .models import User
+from .view.userManagement import generate_otp
+
+FIELDS = ('title', 'initials', 'name', 'surname', 'email', 'cell', 'user_id')
+
+# Validation results, shared with the userAdmin template
+BAD_HEADER = 0
+VALID = 1
+MISSING_VALUES = 2
+BAD_FORMAT = 3
+USER_EXISTS = 4
+DUPLICATE_USER = 5
+
+ERROR_MESSAGES = {
+    MISSING_VALUES: "Not all fields contain values.",
+    BAD_FORMAT: "A value is too long or the row has too many fields.",
+    USER_EXISTS: "The user already exists.",
+    DUPLICATE_USER: "The user appears more than once in the file.",
+}
+
+
+class CsvError:
+    # A row of the file that cannot be imported
+    def __init__(self, line, code, row):
+        self.line = line
+        self.code = code
+        self.message = ERROR_MESSAGES[code]
+        self.row = [row.get(field) or '' for field in FIELDS]
+
+
+def read_users(lines):
+    """
+    Reads and validates the users in the lines of a CSV file. Returns the valid rows and a
+    CsvError for every invalid one, or None instead of the rows if the header is wrong.
+    """
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None or not set(FIELDS) <= {name.strip() for name in reader.fieldnames}:
+        return None, []
+    rows = []
+    for row in reader:
+        rows.append({(key.strip() if key is not None else None): value for key, value in row.items()})
+    return validate_rows(rows)
+
+
+def validate_rows(rows):
+    existing = set()
+    for batch in chunks(rows):
+        existing.update(User.objects.filter(user_id__in={row.get('user_id') for row in batch}).values_list(
+            'user_id', flat=True))
+    lengths = {field: User._meta.get_field(field).max_length for field in FIELDS}
+    seen = set()
+    valid = []
+    errors = []
+    for line, row in enumerate(rows, start=2):
+        code = validate(row, existing, seen, lengths)
+        if code == VALID:
+            valid.append(row)
+        else:
+            errors.append(CsvError(line, code, row))
+        seen.add(row.get('user_id'))
+    return valid, errors
+
+
+def validate(row, existing, seen, lengths):
+    if None in row:
+        return BAD_FORMAT
+    if any(not (row.get(field) or '').strip() for field in FIELDS):
+        return MISSING_VALUES
+    if any(len(row[field]) > lengths[field] for field in FIELDS):
+        return BAD_FORMAT
+    if row['user_id'] in existing:
+        return USER_EXISTS
+    if row['user_id'] in seen:
+        return DUPLICATE_USER
+    return VALID
+
+
+def import_users(rows):
+    """Creates a user for every validated row and emails each their one-time password."""
+    template = email_template('otp_email.txt')
+    users = []
+    otps = []
+    for row in rows:
+        otp = generate_otp()
+        user = User(title=row['title'], initials=row['initials'], name=row['name'], surname=row['surname'],
+                    cell=row['cell'], email=User.objects.normalize_email(row['email']), user_id=row['user_id'],
+                    status='U', is_active=True)
+        users.append(user)
+        otps.append(otp)
+    with transaction.atomic():
+        User.objects.bulk_create_users(users, otps, batch_size=rows_per_insert(User))
+        for user, otp in zip(users, otps):
+            generate_otp_email(otp, user.name, user.surname, user.email, user.user_id, template)
+    return users
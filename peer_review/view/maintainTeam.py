@@ -1,199 +1,171 @@
-import csv
-import os
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.core.paginator import InvalidPage, Paginator
+from django.db import transaction
+from django.db.models import Count, Q
+from django.http import Http404, HttpResponseRedirect
 from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
 
-from ..models import User, RoundDetail, TeamDetail, Document
+from ..models import User, RoundDetail, TeamDetail
+from peer_review.csvUpload import UploadTooLarge, archive_upload, csv_lines, too_large_message
 from peer_review.decorators.adminRequired import admin_required
 from peer_review.forms import DocumentForm
+from peer_review.liveAggregates import move_answers
+from peer_review.questionnaireCache import get_questionnaire
+from peer_review.roundArchive import archive_of
+from peer_review.teamImport import import_teams, read_teams
+from peer_review.teamProgress import recount_round, required_by_team
 from peer_review.view.userFunctions import user_error
 
+# Team memberships per page of getTeams, by default and at most
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
 
 @admin_required
 def maintain_team(request):
     if request.method == "POST":
         round_pk = request.POST.get("roundPk")
-
-        context = {'users': User.objects.filter(Q(is_active=1) & (Q(status='S') | Q(status='U'))),
-                   'rounds': RoundDetail.objects.all(),
-                   'teams': TeamDetail.objects.all(),
-                   'roundPk': round_pk}
-
     else:
-        context = {'users': User.objects.filter(Q(is_active=1) & (Q(status='S') | Q(status='U'))),
-                   'rounds': RoundDetail.objects.all(),
-                   'teams': TeamDetail.objects.all(),
-                   'roundPk': "none"}
+        round_pk = "none"
+    # The teams themselves are loaded by the page through getTeamsForRound and getTeams
+    context = {'users': User.objects.filter(Q(is_active=1) & (Q(status='S') | Q(status='U'))),
+               'rounds': RoundDetail.objects.all(),
+               'roundPk': round_pk}
     return render(request, 'peer_review/maintainTeam.html', context)
 
 
-@admin_required
-def change_team_status(request, team_pk, status):
-    team = get_object_or_404(TeamDetail, pk=team_pk)
-    team.status = status
-    team.save()
-    return JsonResponse({'success': True})
-
-
 @admin_required
 def change_user_team_for_round(request, round_pk, user_id, team_name):
+    # The teams of an archived round no longer change
+    if archive_of(round_pk) is not None:
+        return JsonResponse({'success': False})
     try:
         team = TeamDetail.objects.filter(user_id=user_id).get(roundDetail_id=round_pk)
+        old_team_name = team.teamName
     except TeamDetail.DoesNotExist:
         team = TeamDetail(
             user=get_object_or_404(User, user_id=user_id),
             roundDetail=get_object_or_404(RoundDetail, pk=round_pk)
         )
+        old_team_name = None
 
     team.teamName = team_name
-    if team_name == 'emptyTeam':
-        team.delete()
-    else:
-        team.save()
+    with transaction.atomic():
+        if team_name == 'emptyTeam':
+            if team.pk is not None:
+                team.delete()
+            team_name = None
+        else:
+            team.save()
+        # The user's answers now count towards the report of their new team, and the progress of both teams'
+        # members follows from their new teammates
+        move_answers(round_pk, user_id, old_team_name, team_name)
+        recount_round(round_pk, [name for name in (old_team_name, team_name) if name is not None])
     return JsonResponse({'success': True})
 
 
 @admin_required
 def get_teams_for_round(request, round_pk):
-    teams = TeamDetail.objects.filter(roundDetail_id=round_pk)
+    members = TeamDetail.objects.filter(roundDetail_id=round_pk)
+    team_sizes = dict(members.values_list('teamName').annotate(size=Count('id')).order_by())
+    questionnaire_pk = RoundDetail.objects.filter(pk=round_pk).values_list('questionnaire_id', flat=True).first()
+    required = required_by_team(get_questionnaire(questionnaire_pk), team_sizes)
+
     response = {}
-    team_sizes = {}
-
-    for team in teams:
-        if team.teamName not in team_sizes:
-            team_sizes[team.teamName] = 0
-        team_sizes[team.teamName] += 1
-
-    for team in teams:
-        response[team.pk] = {
-            'user_id': team.user.user_id,
-            'teamName': team.teamName,
-            'status': team.status,
-            'teamSize': team_sizes[team.teamName]
+    for pk, user_id, team_name, status, answered in members.values_list(
+            'pk', 'user_id', 'teamName', 'status', 'answered'):
+        response[pk] = {
+            'user_id': user_id,
+            'teamName': team_name,
+            'status': status,
+            'teamSize': team_sizes[team_name],
+            'answered': answered,
+            'required': required[team_name]
         }
-    # print(response)
     return JsonResponse(response)
 
 
+# GET returns one page of the team memberships of every round, or of one round when 'round' is given, as
+# {'teams': [...], 'page', 'pageCount', 'total'}. 'page' counts from 1 and 'pageSize' is at most MAX_PAGE_SIZE.
+# POST returns the memberships of the user whose pk is posted, keyed by TeamDetail pk.
 @admin_required
 def get_teams(request):
     response = {}
     if request.method == "GET":
-        teams = TeamDetail.objects.all()
-        for team in teams:
-            try:
-                user = User.objects.get(pk=team.user.pk)
-            except User.DoesNotExist:
-                return JsonResponse("Team has a user which doesn't exist")
-            response[team.pk] = {
-                'user_id': user.user_id,
-                'initials': team.user.initials,
-                'surname': team.user.surname,
-                'round': team.roundDetail.name,
-                'team': team.teamName,
-                'status': team.status,
-                'teamId': team.pk,
-            }
+        teams = TeamDetail.objects.order_by('pk')
+        try:
+            if request.GET.get('round'):
+                teams = teams.filter(roundDetail_id=int(request.GET.get('round')))
+            page_size = min(MAX_PAGE_SIZE, max(1, int(request.GET.get('pageSize', PAGE_SIZE))))
+            page = Paginator(teams.values('pk', 'user_id', 'user__initials', 'user__surname', 'roundDetail__name',
+                                          'teamName', 'status'), page_size).page(request.GET.get('page', 1))
+        except (ValueError, InvalidPage):
+            raise Http404("No such round or page.")
+        response = {
+            'teams': [{
+                'user_id': team['user_id'],
+                'initials': team['user__initials'],
+                'surname': team['user__surname'],
+                'round': team['roundDetail__name'],
+                'team': team['teamName'],
+                'status': team['status'],
+                'teamId': team['pk'],
+            } for team in page],
+            'page': page.number,
+            'pageCount': page.paginator.num_pages,
+            'total': page.paginator.count,
+        }
     elif request.method == "POST":
         user_pk = request.POST.get("pk")
         user = get_object_or_404(User, pk=user_pk)
 
-        teams = TeamDetail.objects.filter(user=user)
+        teams = TeamDetail.objects.filter(user=user).values('pk', 'roundDetail_id', 'roundDetail__name', 'teamName',
+                                                            'status')
         for team in teams:
-            response[team.pk] = {
-                'round': team.roundDetail.name,
-                'team': team.teamName,
-                'status': team.status,
-                'teamId': team.pk,
-                'roundPk': team.roundDetail.pk
+            response[team['pk']] = {
+                'round': team['roundDetail__name'],
+                'team': team['teamName'],
+                'status': team['status'],
+                'teamId': team['pk'],
+                'roundPk': team['roundDetail_id']
             }
     return JsonResponse(response)
 
 
-@admin_required
-def add_team_csv_info(team_list):
-    try:
-        for row in team_list:
-            user_det_id = User.objects.get(user_id=row['user_id']).pk
-            round_det_id = RoundDetail.objects.get(name=row['roundDetail']).pk
-            change_user_team_for_round("", round_det_id, user_det_id, row['teamName'])
-        return 1
-    except User.DoesNotExist:
-        return "One of the Users does not exist"
-    except RoundDetail.DoesNotExist:
-        return "One of the Rounds does not exist"
-
-
+# Imports team assignments from an uploaded CSV. Every row is validated before anything changes; if any row is
+# invalid, all the invalid rows are listed and no team is changed.
 @admin_required
 def submit_team_csv(request):
     if not request.user.is_authenticated():
         return user_error(request)
 
-    global error_type
     if request.method == 'POST':
         form = DocumentForm(request.POST, request.FILES)
 
         if form.is_valid():
-            new_doc = Document(doc_file=request.FILES['doc_file'])
-            new_doc.save()
-
-            file_path = new_doc.doc_file.url
-            file_path = file_path[1:]
-
-            team_list = list()
-            error = False
-
-            count = 0
-            with open(file_path) as csv_file:
-                reader = csv.DictReader(csv_file)
-                for row in reader:
-                    count += 1
-                    valid = validate_team_csv(row)
-                    if valid == 0:
-                        print(row['user_id'])
-                        team_list.append(row)
-                    else:
-                        message = "Oops! Something seems to be wrong with the CSV file at row " + str(count) + "."
-
-                        row_list = list()
-                        try:
-                            row_list.append(row['user_id'])
-                            row_list.append(row['round_name'])
-                            row_list.append(row['team_name'])
-                        except KeyError:
-                            valid = 4
-
-                        if valid == 1:
-                            error_type = "Incorrect number of fields."
-                        elif valid == 2:
-                            error_type = "Not all fields contain values."
-                        elif valid == 4:
-                            error_type = "One of these headers does not exist, 'user_id', 'round_name', or 'team_name'."
-
-                        os.remove(file_path)
-                        return render(request, 'peer_review/csvError.html',
-                                      {'message': message, 'row': row_list, 'error': error_type})
+            upload = request.FILES['doc_file']
+            try:
+                assignments, csv_errors = read_teams(csv_lines(upload))
+            except UploadTooLarge:
+                return render(request, 'peer_review/csvTeamError.html',
+                              {'message': "Oops! Something seems to be wrong with the CSV file.",
+                               'error': too_large_message()})
+            except UnicodeDecodeError:
+                assignments, csv_errors = None, []
+
+            if assignments is None:
+                message = "Oops! Something seems to be wrong with the CSV file."
+                error_type = "One of these headers does not exist, 'user_id', 'round_name', or 'team_name'."
+                return render(request, 'peer_review/csvTeamError.html', {'message': message, 'error': error_type})
+            if csv_errors:
+                message = "Oops! Something seems to be wrong with the CSV file at " + str(len(csv_errors)) + \
+                          (" rows." if len(csv_errors) > 1 else " row.")
+                return render(request, 'peer_review/csvTeamError.html',
+                              {'message': message, 'error': "No teams were changed.", 'csv_errors': csv_errors})
+            import_teams(assignments)
+            archive_upload(upload)
         else:
             message = "Oops! Something seems to be wrong with the CSV file."
             error_type = "No file selected."
             return render(request, 'peer_review/csvTeamError.html', {'message': message, 'error': error_type})
-
-        if not error:
-            add_team_csv_info(team_list)
     return HttpResponseRedirect('../')
-
-
-def validate_team_csv(row):
-    # 0 = correct
-    # 1 = incorrect number of fields
-    # 2 = missing value/s
-    # 3 = incorrect format
-
-    if len(row) != 3:
-        return 1
-    for key, value in row.items():
-        if value is None:
-            return 2
-    return 0
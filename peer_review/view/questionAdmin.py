@@ -1,11 +1,16 @@
 from django.contrib import messages
 from django.http import HttpResponseRedirect
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.db import transaction
 from django.utils import timezone
 
-from ..models import Question, QuestionOrder, QuestionType, QuestionGrouping, Choice, Rank, Rate, FreeformItem, Label
+from ..models import Question, QuestionOrder, Choice, Rank, Rate, FreeformItem, Label
+from peer_review.bulkDelete import delete_questions, find, preview_deletion
 from peer_review.decorators.adminRequired import admin_required
+from peer_review.questionItems import grouping_pk, refresh_rounds, remove_other_items, save_item, save_choices, \
+    save_labels, type_pk
+from peer_review.questionnaireCache import questionnaires_changed
 
 
 def user_error(request):
@@ -47,20 +52,26 @@ def edit_question(request, question_pk):
     return render(request, 'peer_review/questionAdmin.html', context)
 
 
-# Delete a question
+# Delete the questions, with their items and answers, in one transaction. With the preview flag set nothing is
+# deleted; the number of rows of each kind the deletion would remove is returned instead.
 @admin_required
 def delete_question(request):
     if request.method == "POST":
         pks = request.POST['question-pk'].split(';#')
-        for pk in pks:
-            get_object_or_404(Question, pk=pk).delete()
-        messages.add_message(request, messages.SUCCESS, str(len(pks)) + " question(s) deleted successfully")
+        questions = find(Question, pks) if all(pk.isdigit() for pk in pks) else None
+        if questions is None:
+            raise Http404("Question does not exist")
+        if request.POST.get('preview'):
+            return JsonResponse({'counts': preview_deletion(questions)})
+        delete_questions(questions)
+        messages.add_message(request, messages.SUCCESS, str(len(questions)) + " question(s) deleted successfully")
         return HttpResponseRedirect('/questionAdmin')
     else:
         return HttpResponseRedirect('/questionAdmin')
 
 
-# Save question
+# Save question. Edits keep the labels and choices that did not change, so answers about them are kept too.
+# Changing the labels or grouping recomputes the totals and progress of the rounds that ask the question.
 @admin_required
 def save_question(request):
     if request.method == "POST":
@@ -68,54 +79,49 @@ def save_question(request):
         question_title = str(request.POST['question-title'])
         question_type = str(request.POST['question-type'])
         question_grouping = str(request.POST['question-grouping'])
-        if not QuestionType.objects.filter(name=question_type).exists():
-            QuestionType.objects.create(name=question_type)
-        if not QuestionGrouping.objects.filter(grouping=question_grouping).exists():
-            QuestionGrouping.objects.create(grouping=question_grouping)
-
-        if 'question-pk' in request.POST:
-            q = get_object_or_404(Question, pk=request.POST['question-pk'])
-            Choice.objects.filter(question=q).delete()
-            Rank.objects.filter(question=q).delete()
-            Rate.objects.filter(question=q).delete()
-            FreeformItem.objects.filter(question=q).delete()
-            Label.objects.filter(question=q).delete()
-            q.questionText = question_text
-            q.questionLabel = question_title
-            q.questionGrouping = QuestionGrouping.objects.get(grouping=question_grouping)
-            q.pubDate = timezone.now()
-            q.save()
-        elif Question.objects.filter(questionLabel=question_title).exists():
-            messages.add_message(request, messages.WARNING, "Error: A question with that title already exists.")
-            return HttpResponseRedirect('/questionAdmin')
-        else:
-            q = Question.objects.create(questionText=question_text,
-                                        pubDate=timezone.now(),
-                                        questionType=QuestionType.objects.get(name=question_type),
-                                        questionGrouping=QuestionGrouping.objects.get(grouping=question_grouping),
-                                        questionLabel=question_title
-                                        )
-
-        if question_grouping == 'Label':
-            labels = str(request.POST['question-labels']).split(";#")
-            for label in labels:
-                Label.objects.create(question=q, labelText=label)
-
-        if question_type == 'Choice':
-            choices = str(request.POST['question-choices']).split(";#")
-            for index, choice in enumerate(choices):
-                Choice.objects.create(question=q, choiceText=choice, num=index)
-        elif question_type == 'Rank':
-            Rank.objects.create(question=q,
-                                firstWord=str(request.POST["rank-first"]),
-                                secondWord=str(request.POST["rank-second"]))
-        elif question_type == 'Rate':
-            Rate.objects.create(question=q,
-                                topWord=request.POST['rate-first'],
-                                bottomWord=request.POST['rate-second'],
-                                optional=('rate-optional' in request.POST))
-        elif question_type == 'Freeform':
-            FreeformItem.objects.create(question=q, freeformType=request.POST['freeform-type'])
+
+        with transaction.atomic():
+            items_changed = False
+            if 'question-pk' in request.POST:
+                q = get_object_or_404(Question, pk=request.POST['question-pk'])
+                q.questionText = question_text
+                q.questionLabel = question_title
+                grouping = grouping_pk(question_grouping)
+                items_changed = q.questionGrouping_id != grouping
+                q.questionGrouping_id = grouping
+                q.pubDate = timezone.now()
+                q.save()
+                items_changed = remove_other_items(q, question_type, question_grouping) or items_changed
+            elif Question.objects.filter(questionLabel=question_title).exists():
+                messages.add_message(request, messages.WARNING, "Error: A question with that title already exists.")
+                return HttpResponseRedirect('/questionAdmin')
+            else:
+                q = Question.objects.create(questionText=question_text,
+                                            pubDate=timezone.now(),
+                                            questionType_id=type_pk(question_type),
+                                            questionGrouping_id=grouping_pk(question_grouping),
+                                            questionLabel=question_title
+                                            )
+
+            if question_grouping == 'Label':
+                items_changed = save_labels(q, str(request.POST['question-labels']).split(";#")) or items_changed
+
+            if question_type == 'Choice':
+                save_choices(q, str(request.POST['question-choices']).split(";#"))
+            elif question_type == 'Rank':
+                save_item(Rank, q,
+                          firstWord=str(request.POST["rank-first"]),
+                          secondWord=str(request.POST["rank-second"]))
+            elif question_type == 'Rate':
+                save_item(Rate, q,
+                          topWord=request.POST['rate-first'],
+                          bottomWord=request.POST['rate-second'],
+                          optional=('rate-optional' in request.POST))
+            elif question_type == 'Freeform':
+                save_item(FreeformItem, q, freeformType=request.POST['freeform-type'])
+            questionnaires_changed()
+            if items_changed:
+                refresh_rounds(q)
 
     messages.add_message(request, messages.SUCCESS, "Question saved successfully")
     return HttpResponseRedirect('/questionAdmin')
@@ -1,11 +1,19 @@
+import json
+
 from django.contrib import messages
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import JsonResponse, Http404
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 
 from peer_review.decorators.userRequired import user_required
+from peer_review.questionnaireCache import get_questionnaire
+from peer_review.responseStore import save_responses
+from peer_review.roundArchive import archive_of
+from peer_review.teamProgress import record_progress
 
-from ..models import Question, RoundDetail, QuestionOrder, User, TeamDetail, Response, Label
+from ..models import Question, RoundDetail, QuestionOrder, Questionnaire, User, TeamDetail, Response, \
+    LatestResponse
 
 
 @user_required
@@ -13,12 +21,6 @@ def questionnaire(request, round_pk):
     user = request.user
     try:
         round_object = RoundDetail.objects.get(pk=round_pk)
-        questionnaire_object = round_object.questionnaire
-
-        q_orders = QuestionOrder.objects.filter(questionnaire=questionnaire_object)
-        team_name = TeamDetail.objects.get(user=user, roundDetail=RoundDetail.objects.get(pk=round_pk)).teamName
-        q_team = User.objects.filter(teamdetail__teamName=team_name,
-                                     teamdetail__roundDetail=RoundDetail.objects.get(pk=round_pk))
 
         # Does the user have access to this page?
         # Has the questionnaire expired / is it in the future?
@@ -30,29 +32,45 @@ def questionnaire(request, round_pk):
             messages.add_message(request, messages.ERROR, "That questionnaire has expired.")
             return redirect('activeRounds')
 
-        context = {'questionOrders': q_orders, 'teamMembers': q_team, 'questionnaire': questionnaire_object,
+        team_name = TeamDetail.objects.get(user=user, roundDetail=round_object).teamName
+        q_team = list(User.objects.filter(teamdetail__teamName=team_name,
+                                          teamdetail__roundDetail=round_object))
+        compiled = get_questionnaire(round_object.questionnaire_id)
+
+        context = {'questionOrders': compiled.question_orders, 'teamMembers': q_team,
+                   'questionnaire': compiled.questionnaire,
                    'currentUser': user,
-                   'round': round_pk}
+                   'round': round_pk,
+                   'savedResponses': json_for_script(latest_answers(user, round_object, compiled))}
         return render(request, 'peer_review/questionnaire.html', context)
 
-    except (RoundDetail.DoesNotExist, QuestionOrder.DoesNotExist, TeamDetail.DoesNotExist, User.DoesNotExist):
+    except (RoundDetail.DoesNotExist, Questionnaire.DoesNotExist, QuestionOrder.DoesNotExist,
+            TeamDetail.DoesNotExist, User.DoesNotExist):
         messages.add_message(request, messages.ERROR, "The questionnaire is currently unavailable.")
         return redirect('activeRounds')
 
 
+# Answers are only accepted while a round is open, and never once its answers have been archived
+def accepts_answers(round_detail):
+    now = timezone.now()
+    return round_detail.startingDate <= now <= round_detail.endingDate and archive_of(round_detail.pk) is None
+
+
 # Returning a JsonResponse with a result field of 1 indicates an error in saving the questionnaire progress
 # A 0 indicates success
 @user_required
 def save_questionnaire_progress(request):
     if request.method == "POST":
         try:
-            question = Question.objects.get(pk=request.POST.get('questionPk'))
             round_detail = RoundDetail.objects.get(pk=request.POST.get('roundPk'))
+            if not accepts_answers(round_detail):
+                return JsonResponse({'result': 1})
+            compiled = get_questionnaire(round_detail.questionnaire_id)
+            question = compiled.questions[int(request.POST.get('questionPk'))]
             team_detail = TeamDetail.objects.get(user=User.objects.get(user_id=request.user.user_id),
                                                  roundDetail=request.POST.get('roundPk'))
-            team_detail.status = TeamDetail.IN_PROGRESS
-            team_detail.save()
-        except (Question.DoesNotExist, RoundDetail.DoesNotExist, TeamDetail.DoesNotExist):
+        except (KeyError, TypeError, ValueError, RoundDetail.DoesNotExist, Questionnaire.DoesNotExist,
+                TeamDetail.DoesNotExist):
             return JsonResponse({'result': 1})
         user = request.user
         # user = User.objects.get(userId='14035548')  # TEST
@@ -64,9 +82,12 @@ def save_questionnaire_progress(request):
         # If grouping == Label, there is a label but no subjectUser
         elif question.questionGrouping.grouping == "Label":
             try:
-                label = Label.objects.get(pk=request.POST.get('label'))
+                label = compiled.labels[int(request.POST.get('label'))]
                 subject_user = None
-            except Label.DoesNotExist:
+            except (KeyError, TypeError, ValueError):
+                return JsonResponse({'result': 1})
+            # The label has to be one of this question's own
+            if label.question_id != question.pk:
                 return JsonResponse({'result': 1})
         # If grouping == Rest || All, there is a subjectUser but no label
         else:
@@ -77,38 +98,150 @@ def save_questionnaire_progress(request):
                 return JsonResponse({'result': 1})
         answer = request.POST.get('answer')
         batch_id = request.POST.get('batch_id')
-        Response.objects.create(question=question,
-                                roundDetail=round_detail,
-                                user=user,
-                                subjectUser=subject_user,
-                                label=label,
-                                answer=answer,
-                                batch_id=batch_id)
+        team_member_ids = TeamDetail.objects.filter(roundDetail=round_detail,
+                                                    teamName=team_detail.teamName).values_list('user_id', flat=True)
+        with transaction.atomic():
+            save_responses([Response(question=question,
+                                     roundDetail=round_detail,
+                                     user=user,
+                                     subjectUser=subject_user,
+                                     label=label,
+                                     answer=answer,
+                                     batch_id=batch_id)])
+            record_progress(team_detail, compiled, team_member_ids)
         return JsonResponse({'result': 0})
     else:
         return JsonResponse({'result': 1})
 
 
+# Saves every answer on the questionnaire page in a single request. The request body is a JSON object:
+# {'roundPk': ..., 'answers': [{'questionPk', 'label', 'subjectUser', 'answer', 'batch_id'}, ...]}
+# Every answer is validated before anything is written, so a batch is either saved completely or not at all.
+# The result field follows save_questionnaire_progress; on failure 'errors' holds the indices of the bad answers.
+@user_required
+def save_questionnaire_batch(request):
+    if request.method != "POST":
+        return JsonResponse({'result': 1})
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+        answers = payload['answers']
+        round_detail = RoundDetail.objects.get(pk=payload['roundPk'])
+        if not accepts_answers(round_detail):
+            return JsonResponse({'result': 1})
+        team_detail = TeamDetail.objects.get(user=request.user, roundDetail=round_detail)
+        compiled = get_questionnaire(round_detail.questionnaire_id)
+    except (ValueError, KeyError, TypeError, RoundDetail.DoesNotExist, TeamDetail.DoesNotExist,
+            Questionnaire.DoesNotExist):
+        return JsonResponse({'result': 1})
+    if not isinstance(answers, list):
+        return JsonResponse({'result': 1})
+
+    # Everything an answer may refer to is loaded up front, so validation needs no further queries
+    questions = compiled.questions
+    labels = compiled.labels
+    team_members = {member.pk: member for member in User.objects.filter(
+        teamdetail__roundDetail=round_detail, teamdetail__teamName=team_detail.teamName)}
+
+    responses = []
+    errors = []
+    for index, item in enumerate(answers):
+        response = build_response(item, round_detail, request.user, questions, labels, team_members)
+        if response is None:
+            errors.append(index)
+        else:
+            responses.append(response)
+    if errors:
+        return JsonResponse({'result': 1, 'errors': errors})
+
+    with transaction.atomic():
+        save_responses(responses)
+        record_progress(team_detail, compiled, team_members)
+    return JsonResponse({'result': 0, 'saved': len(responses), 'status': team_detail.status})
+
+
+# Builds an unsaved Response from one answer of a batch, or returns None if the answer does not belong to
+# the round's questionnaire or refers to a label or subject user the question does not allow
+def build_response(item, round_detail, user, questions, labels, team_members):
+    try:
+        question = questions.get(int(item['questionPk']))
+        batch_id = int(item['batch_id'])
+        answer = item['answer']
+    except (KeyError, TypeError, ValueError):
+        return None
+    if question is None or answer is None:
+        return None
+
+    label = None
+    subject_user = None
+    grouping = question.questionGrouping.grouping
+    if grouping == "Label":
+        try:
+            label = labels.get(int(item.get('label')))
+        except (TypeError, ValueError):
+            return None
+        if label is None or label.question_id != question.pk:
+            return None
+    elif grouping != "None":
+        subject_user = team_members.get(str(item.get('subjectUser')))
+        if subject_user is None:
+            return None
+
+    return Response(question=question,
+                    roundDetail=round_detail,
+                    user=user,
+                    subjectUser=subject_user,
+                    label=label,
+                    answer=str(answer),
+                    batch_id=batch_id)
+
+
+# Returns the user's latest answers to every question of the round's questionnaire in one query, as a dict from
+# question pk to the same answers/labelOrUserIds/labelOrUserNames lists that get_responses returns
+def latest_answers(user, round_detail, compiled):
+    answers = {}
+    rows = LatestResponse.objects.filter(user=user, roundDetail=round_detail).order_by('pk').values_list(
+        'question_id', 'label_id', 'subjectUser_id', 'subjectUser__name', 'subjectUser__surname', 'answer')
+    for question_pk, label_pk, subject_pk, subject_name, subject_surname, answer in rows:
+        question = compiled.questions.get(question_pk)
+        if question is None:
+            continue
+        question_answers = answers.setdefault(question_pk, {'answers': [], 'labelOrUserIds': [],
+                                                            'labelOrUserNames': []})
+        question_answers['answers'].append(answer)
+        if question.questionGrouping.grouping == "Label":
+            question_answers['labelOrUserNames'].append(compiled.label_text(label_pk))
+            question_answers['labelOrUserIds'].append(label_pk)
+        elif question.questionGrouping.grouping != "None":
+            question_answers['labelOrUserNames'].append(subject_name + ' ' + subject_surname)
+            question_answers['labelOrUserIds'].append(subject_pk)
+    return answers
+
+
+# JSON that can be placed inside a <script> element: the characters that could close it early are escaped
+def json_for_script(data):
+    return json.dumps(data).replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
+# Returns the latest answers of the user to all the questions of a round, keyed by question pk
+@user_required
+def get_round_responses(request):
+    round_detail = get_object_or_404(RoundDetail, pk=request.GET.get('roundPk'))
+    try:
+        compiled = get_questionnaire(round_detail.questionnaire_id)
+    except Questionnaire.DoesNotExist:
+        raise Http404("No Questionnaire matches the given query.")
+    return JsonResponse({'responses': latest_answers(request.user, round_detail, compiled)})
+
+
 @user_required
 def get_responses(request):
     question = get_object_or_404(Question, pk=request.GET.get('questionPk'))
     round_detail = get_object_or_404(RoundDetail, pk=request.GET.get('roundPk'))
     user = request.user
 
-    responses = Response.objects.filter(user=user,
-                                        roundDetail=round_detail,
-                                        question=question).order_by('batch_id').reverse()
-    batch_id = 0
-    count = 0
-
-    for r in responses:
-        if batch_id == 0:
-            batch_id = r.batch_id
-        elif not (batch_id == r.batch_id):
-            break
-        count += 1
-    responses = responses[0:count]
-    print(responses)
+    responses = LatestResponse.objects.filter(user=user,
+                                              roundDetail=round_detail,
+                                              question=question).select_related('label', 'subjectUser')
     json = {'answers': [], 'labelOrUserIds': [], 'labelOrUserNames': []}
     for r in responses:
         json['answers'].append(r.answer)
@@ -118,4 +251,4 @@ def get_responses(request):
         elif question.questionGrouping.grouping != "None":
             json['labelOrUserNames'].append(r.subjectUser.name + ' ' + r.subjectUser.surname)
             json['labelOrUserIds'].append(r.subjectUser.user_id)
-    return JsonResponse(json)
\ No newline at end of file
+    return JsonResponse(json)
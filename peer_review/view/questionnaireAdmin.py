@@ -1,7 +1,9 @@
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
+from peer_review.bulkDelete import delete_questionnaires, find, preview_deletion
 from peer_review.decorators.adminRequired import admin_required
+from peer_review.questionnaireCache import get_questionnaire, questionnaires_changed
 
 from ..models import Question, Questionnaire, RoundDetail, QuestionOrder, User, TeamDetail
 
@@ -20,8 +22,11 @@ def questionnaire_preview(request, questionnaire_pk):
     bob = User(title='Mr', initials='B', name='Bob', surname='Test', user_id='Bob')
     carol = User(title='Miss', initials='C', name='Carol', surname='Test', user_id='Carol')
     
-    questionnaire = get_object_or_404(Questionnaire, pk=questionnaire_pk)
-    q_orders = get_object_or_404(QuestionOrder, questionnaire=questionnaire)
+    try:
+        compiled = get_questionnaire(int(questionnaire_pk))
+    except Questionnaire.DoesNotExist:
+        raise Http404("No Questionnaire matches the given query.")
+    questionnaire = compiled.questionnaire
     
     mock_round = RoundDetail(name='Preview Round', questionnaire=questionnaire, description='This is a preview round')
     
@@ -31,11 +36,12 @@ def questionnaire_preview(request, questionnaire_pk):
     TeamDetail(user=carol, roundDetail=mock_round, teamName=team_name)
     
     q_team = [alice, bob, carol]
-    context = {'questionOrders': q_orders,
+    context = {'questionOrders': compiled.question_orders,
                'teamMembers': q_team,
                'questionnaire': questionnaire,
                'currentUser': alice,
                'round': 0,
+               'savedResponses': '{}',
                'preview': 1}
     return render(request, 'peer_review/questionnaire.html', context)
 
@@ -64,6 +70,7 @@ def save_questionnaire(request):
                 QuestionOrder.objects.create(questionnaire=q,
                                              question=get_object_or_404(Question, pk=question),
                                              order=index)
+        questionnaires_changed()
         messages.add_message(request, messages.SUCCESS, "Questionnaire saved successfully.")
     return HttpResponseRedirect('/questionnaireAdmin')
 
@@ -80,19 +87,24 @@ def edit_questionnaire(request, questionnaire_pk):
     return render(request, 'peer_review/questionnaireAdmin.html', context)
 
 
-# Delete a questionnaire
+# Delete the questionnaires, and the rounds that use them, in one transaction. With the preview flag set nothing is
+# deleted; the number of rows of each kind the deletion would remove is returned instead.
 @admin_required
 def delete_questionnaire(request):
     if request.method == "POST":
         pks = request.POST['pk'].split(';#')
-        for pk in pks:
-            if str(pk).isdigit():
-                get_object_or_404(Questionnaire, pk=pk).delete()
-            else:
-                messages.add_message(request, messages.WARNING,
-                                     "Error: Something went wrong when deleting the questionnaire")
-                return HttpResponseRedirect('/questionnaireAdmin')
-        messages.add_message(request, messages.SUCCESS, str(len(pks)) + " questionnaire(s) deleted successfully")
+        if not all(str(pk).isdigit() for pk in pks):
+            messages.add_message(request, messages.WARNING,
+                                 "Error: Something went wrong when deleting the questionnaire")
+            return HttpResponseRedirect('/questionnaireAdmin')
+        questionnaires = find(Questionnaire, pks)
+        if questionnaires is None:
+            raise Http404("Questionnaire does not exist")
+        if request.POST.get('preview'):
+            return JsonResponse({'counts': preview_deletion(questionnaires)})
+        delete_questionnaires(questionnaires)
+        messages.add_message(request, messages.SUCCESS,
+                             str(len(questionnaires)) + " questionnaire(s) deleted successfully")
         return HttpResponseRedirect('/questionnaireAdmin')
     else:
         return HttpResponseRedirect('/questionnaireAdmin')
@@ -1,11 +1,55 @@
-from django.shortcuts import render
+from django.http import FileResponse, JsonResponse, Http404
+from django.shortcuts import render, get_object_or_404
 from peer_review.decorators.adminRequired import admin_required
 
-from peer_review.models import RoundDetail, Questionnaire
+from peer_review.exportJobs import fail_stale_jobs, request_export
+from peer_review.models import RoundDetail, Questionnaire, ExportJob
+from peer_review.roundExport import EXPORT_FORMATS, available_formats
+from peer_review.view.userFunctions import user_error
 
 
 @admin_required
 def maintain_round(request):
     context = {'roundDetail': RoundDetail.objects.all(),
-               'questionnaires': Questionnaire.objects.all()}
-    return render(request, 'peer_review/maintainRound.html', context)
\ No newline at end of file
+               'questionnaires': Questionnaire.objects.all(),
+               'exportFormats': available_formats()}
+    return render(request, 'peer_review/maintainRound.html', context)
+
+
+def export_job_json(job):
+    return {'jobId': job.pk,
+            'status': job.status,
+            'progress': job.progress,
+            'error': job.error}
+
+
+# Start building a round dump in the background, or reuse a dump that is still current
+@admin_required
+def start_round_export(request):
+    if request.method == "POST":
+        current_round = get_object_or_404(RoundDetail, pk=request.POST.get("roundPk"))
+        export_format = request.POST.get("format", "csv")
+        if export_format not in available_formats():
+            return JsonResponse({'error': "That dump format is not available"}, status=400)
+        return JsonResponse(export_job_json(request_export(current_round.pk, export_format)))
+    return user_error(request)
+
+
+@admin_required
+def round_export_status(request, job_pk):
+    fail_stale_jobs(ExportJob.objects.filter(pk=job_pk))
+    return JsonResponse(export_job_json(get_object_or_404(ExportJob, pk=job_pk)))
+
+
+@admin_required
+def download_round_export(request, job_pk):
+    job = get_object_or_404(ExportJob.objects.select_related('roundDetail'), pk=job_pk, status=ExportJob.DONE)
+    try:
+        dump_file = open(job.dumpFile, 'rb')
+    except OSError:
+        raise Http404("The dump has been removed")
+    extension, content_type = EXPORT_FORMATS[job.exportFormat]
+    response = FileResponse(dump_file, content_type=content_type)
+    response['Content-Disposition'] = "attachment; filename=" + job.finished.strftime("%Y-%m-%d %H.%M.%S") \
+                                      + ' round_' + job.roundDetail.name + "." + extension
+    return response
@@ -1,14 +1,14 @@
 import base64
 from django.conf import settings
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.core.signing import TimestampSigner
 from django.http import HttpResponseForbidden
 from django.shortcuts import render, redirect, get_object_or_404
 from peer_review.decorators.userRequired import user_required
+from peer_review.email import email_template
+from peer_review.emailOutbox import queue_email
 from peer_review.forms import ResetForm
 from peer_review.models import RoundDetail, TeamDetail, User
-from pinocchio import baseSettings
 
 
 @user_required
@@ -89,34 +89,21 @@ def unsign_user_id(b64_user_id, max_age=None):
         return None
 
 
-# Sends a password-reset email containing a signed
+# Queues a password-reset email containing a signed
 # key as authentication. Returns a boolean;
-# True = email sent,
+# True = email queued,
 # False = error
 def send_password_request_email(user_id, email_address, post_name, post_surname):
     try:
-        fn = "{first_name}"
-        ln = "{last_name}"
-        url = "{url}"
-
         request_url = settings.EXTERNAL_URL + 'recoverPassword/' + sign_user_id(user_id)
 
-        file_path = baseSettings.BASE_DIR + '/peer_review/text/password_request.txt'
-        file = open(file_path, 'a+')
-        file.seek(0)
-        email_text = file.read()
-        file.close()
-
         email_subject = "Pinocchio Password Reset Request"
 
-        email_text = email_text.replace(fn, post_name)
-        email_text = email_text.replace(ln, post_surname)
-        email_text = email_text.replace(url, request_url)
-
-        print(email_text)
+        email_text = email_template('password_request.txt').render(first_name=post_name, last_name=post_surname,
+                                                                   url=request_url)
 
-        # Emails are sent here
-        send_mail(email_subject, email_text, 'pinocchio@cs.up.ac.za', [email_address], fail_silently=False)
+        # Emails are queued here and delivered by the outbox sender
+        queue_email(email_subject, email_text, email_address)
 
         return True
     except Exception as e:
@@ -1,26 +1,32 @@
-import csv
-import os
 import time
-import mimetypes
-from wsgiref.util import FileWrapper
 
 from django.conf import settings
+from django.db.models import Q
 from django.contrib import messages
 from django.contrib.auth import authenticate, login as django_login, logout
-from django.db.models.aggregates import Max
-from django.http import HttpResponse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 
+from peer_review.bulkDelete import delete_users, find, preview_deletion
 from peer_review.decorators.adminRequired import admin_required
+from peer_review.email import email_template, save_email_template
 from peer_review.forms import RecoverPasswordForm
+from peer_review.peerScoring import peer_scores, scores_csv
+from peer_review.questionnaireCache import get_questionnaire
+from peer_review.roundAnalytics import live_statistics
+from peer_review.roundExport import EXPORT_FORMATS, available_formats, export_chunks
+from peer_review.teamProgress import required_by_team
 from peer_review.view.userFunctions import unsign_user_id, sign_user_id
 from .forms import DocumentForm, UserForm, LoginForm
-from .models import RoundDetail, TeamDetail, Response
+from .models import RoundDetail, TeamDetail
 from .models import Questionnaire
 from .models import User
 
+# Users per page of the user administration table
+USER_PAGE_SIZE = 50
+MAX_USER_PAGE_SIZE = 500
 
 # Moved these views into separate files
 
@@ -162,22 +168,43 @@ def get_questionnaire_for_team(request):
         return redirect('accountDetails')
 
 
+# The users themselves are loaded by the page a page at a time through get_users
 @admin_required
 def user_list(request):
-    users = User.objects.all
     user_form = UserForm()
     doc_form = DocumentForm()
 
-    module_dir = os.path.dirname(__file__)
-    file_path = os.path.join(module_dir)
-    file = open(file_path + '/text/otp_email.txt', 'r+')
-    email_text = file.read()
-    file.close()
+    email_text = email_template('otp_email.txt').text
 
     reset_link = '/recoverPassword/' + sign_user_id(request.user.user_id)
     return render(request, 'peer_review/userAdmin.html',
-                  {'users': users, 'userForm': user_form, 'docForm': doc_form, 'email_text': email_text,
-                   'reset_link': reset_link})
+                  {'userForm': user_form, 'docForm': doc_form, 'email_text': email_text, 'reset_link': reset_link})
+
+
+# Returns one page of users ordered by user_id as {'users': [...], 'next': ...}. The page starts after the user_id
+# given as 'after' ('order=desc' reverses the order, and 'after' then means before). 'search' keeps the users whose
+# user_id, surname or email starts with it. 'next' is the 'after' of the following page, or None on the last page.
+@admin_required
+def get_users(request):
+    descending = request.GET.get('order') == 'desc'
+    users = User.objects.order_by('-user_id' if descending else 'user_id')
+    after = request.GET.get('after')
+    if after:
+        users = users.filter(user_id__lt=after) if descending else users.filter(user_id__gt=after)
+    search = request.GET.get('search', '').strip()
+    if search:
+        users = users.filter(Q(user_id__startswith=search) | Q(surname__istartswith=search) |
+                             Q(email__istartswith=search))
+    try:
+        page_size = min(MAX_USER_PAGE_SIZE, max(1, int(request.GET.get('pageSize', USER_PAGE_SIZE))))
+    except ValueError:
+        page_size = USER_PAGE_SIZE
+
+    # One extra row tells whether there is another page
+    page = list(users.values('user_id', 'title', 'initials', 'name', 'surname', 'cell', 'email',
+                             'status')[:page_size + 1])
+    return JsonResponse({'users': page[:page_size],
+                         'next': page[page_size - 1]['user_id'] if len(page) > page_size else None})
 
 
 @admin_required()
@@ -217,75 +244,35 @@ def user_profile(request, user_id):
         return HttpResponseRedirect('../')
 
 
+# Deletes the selected users, with their team places and answers, in one transaction. With the preview flag set
+# nothing is deleted; the number of rows of each kind the deletion would remove is returned instead.
 @admin_required
 def user_delete(request):
     if request.method == "POST":
-        to_delete = request.POST.getlist("toDelete[]")
-
-        for userPk in to_delete:
-            user = get_object_or_404(User, pk=userPk)
-
-            user.delete()
+        users = find(User, request.POST.getlist("toDelete[]"))
+        if users is None:
+            raise Http404("User does not exist")
+        if request.POST.get('preview'):
+            return JsonResponse({'counts': preview_deletion(users)})
+        delete_users(users)
 
     return HttpResponseRedirect('../')
 
 
-def write_dump(round_pk):
-
-    current_round = RoundDetail.objects.get(id=round_pk)
-    dump_file = 'media/dumps/' + time.strftime("%Y-%m-%d %H:%M:%S") + 'round_' + str(current_round.name) + '.csv'
-    data = [['ResponseID', 'Respondent', 'QuestionTitle', 'LabelTitle', 'SubjectUser', 'Answer']]
-
-    # First, find the row id of the most recent answer to each question
-    distinct_responses = Response.objects.filter(roundDetail=round_pk).values(
-        "question_id", "user_id", "label_id", "subjectUser_id").annotate(max_id=Max('id'))
-
-    # Filter response id's
-    distinct_response_ids = [x['max_id'] for x in distinct_responses]
-
-    # Fetch the most recent responses separately
-    round_data = Response.objects.filter(id__in=distinct_response_ids).order_by(
-        "user_id", "question_id", "label_id", "subjectUser_id")
-    distinct_round_data = round_data.values('user_id', 'question_id', 'label_id', 'subjectUser_id', 'id')
-
-    if len(distinct_round_data) > 0:
-        for item_id in distinct_round_data:
-            item = round_data.get(id=item_id['id'])
-            response_id = item.id
-            user_id = item.user.user_id
-            question_label = item.question.questionLabel
-            label = item.label
-
-            subject_id = ""
-            if item.subjectUser:
-                subject_id = item.subjectUser.user_id
-            answer = item.answer
-
-            data.append([response_id, user_id, question_label, label, subject_id, answer])
-    else:
-        data.append(['NO DATA'])
-
-    with open(dump_file, 'w', newline='') as csv_file:
-        writer = csv.writer(csv_file, delimiter=',', quoting=csv.QUOTE_ALL)
-        writer.writerows(data)
-
-    csv_file.close()
-    return str(dump_file)  # Returns dump filename
-
-
 @admin_required
 def round_dump(request):
     if request.method == "POST":
         round_pk = request.POST.get("roundPk")
-        dump_file = write_dump(round_pk)
-        # Download Dump
-        wrapper = FileWrapper(open(dump_file))
-        content_type = mimetypes.guess_type(dump_file)[0]
-        response = HttpResponse(wrapper, content_type=content_type)
+        export_format = request.POST.get("format", "csv")
         current_round = get_object_or_404(RoundDetail, id=round_pk)
-        # response['Content-Length'] = os.path.getsize(dump_file)
+        if export_format not in available_formats():
+            return redirect('maintainRoundWithError', error=2)
+
+        # Stream the dump to the browser as it is read from the database
+        extension, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(export_chunks(round_pk, export_format), content_type=content_type)
         response['Content-Disposition'] = "attachment; filename=" + time.strftime("%Y-%m-%d %H.%M.%S") \
-                                          + ' round_' + current_round.name + ".csv"
+                                          + ' round_' + current_round.name + "." + extension
         return response
     return user_error(request)
 
@@ -294,13 +281,7 @@ def round_dump(request):
 def update_email(request):
     if request.method == "POST":
         email_text = request.POST.get("emailText")
-
-        module_dir = os.path.dirname(__file__)
-        file_path = os.path.join(module_dir)
-        file = open(file_path + '/text/otp_email.txt', 'w+')
-
-        file.write(email_text)
-        file.close()
+        save_email_template('otp_email.txt', email_text)
     return HttpResponseRedirect('../')
 
 
@@ -402,11 +383,14 @@ def create_round(request):
 def maintain_round_with_error(request, error):
     if error == '1':  # Incorrect Date format
         str_error = "Incorrect Date Format yyyy-mm-dd hh"
+    elif error == '2':  # Dump format not available
+        str_error = "That dump format is not available"
     else:
         str_error = "Unknown Error"
 
     context = {'roundDetail': RoundDetail.objects.all(),
                'questionnaires': Questionnaire.objects.all(),
+               'exportFormats': available_formats(),
                'error': str_error}
     return render(request, 'peer_review/maintainRound.html', context)
 
@@ -449,3 +433,62 @@ def report(request):
             "rounds": RoundDetail.objects.all()
         }
     return render(request, 'peer_review/report.html', context)
+
+
+# Returns everything the report page shows for a round in one response: the questionnaire's title and every
+# team with its members, their statuses and answer counts, how many answers each member has to give and how many
+# members have each status
+@admin_required
+def get_report_roster(request, round_pk):
+    current_round = get_object_or_404(RoundDetail.objects.select_related('questionnaire'), pk=round_pk)
+    members = TeamDetail.objects.filter(roundDetail=current_round).select_related('user').order_by(
+        'teamName', 'user__surname', 'user__name')
+
+    teams = []
+    for member in members:
+        if not teams or teams[-1]['teamName'] != member.teamName:
+            teams.append({'teamName': member.teamName, 'size': 0, 'members': [],
+                          'completion': {status: 0 for status, _ in TeamDetail.STATUS_CHOICES}})
+        team = teams[-1]
+        team['size'] += 1
+        team['completion'][member.status] = team['completion'].get(member.status, 0) + 1
+        team['members'].append({'user_id': member.user.user_id,
+                                'name': member.user.name,
+                                'surname': member.user.surname,
+                                'status': member.status,
+                                'answered': member.answered})
+
+    required = required_by_team(get_questionnaire(current_round.questionnaire_id),
+                                {team['teamName']: team['size'] for team in teams})
+    for team in teams:
+        team['required'] = required[team['teamName']]
+
+    questionnaire = current_round.questionnaire
+    return JsonResponse({'questionnaire': questionnaire.label if questionnaire else '', 'teams': teams})
+
+
+# Returns the rating, ranking and choice statistics of every team in a round, from the running totals
+@admin_required
+def get_round_statistics(request, round_pk):
+    try:
+        return JsonResponse(live_statistics(round_pk))
+    except RoundDetail.DoesNotExist:
+        raise Http404("No RoundDetail matches the given query.")
+
+
+# Returns the WebPA scores and adjustment factors of every student in a round
+@admin_required
+def get_peer_scores(request, round_pk):
+    try:
+        return JsonResponse(peer_scores(round_pk))
+    except RoundDetail.DoesNotExist:
+        raise Http404("No RoundDetail matches the given query.")
+
+
+# Downloads the WebPA scores and adjustment factors of a round as CSV
+@admin_required
+def download_peer_scores(request, round_pk):
+    current_round = get_object_or_404(RoundDetail, pk=round_pk)
+    response = HttpResponse(scores_csv(round_pk), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="' + current_round.name + '_peer_scores.csv"'
+    return response
@@ -14,3 +14,79 @@ Please note the trailing slash!
 TODO: CHANGE IN PRODUCTION
 """
 EXTERNAL_URL = 'http://pinocchio.cs.up.ac.za/'
+
+"""
+Round dumps are built by a pool of background
+threads. EXPORT_WORKERS is the number of threads;
+set it to 0 to build dumps inside the request.
+"""
+EXPORT_WORKERS = 2
+
+"""
+Finished dumps are kept in media/dumps/jobs and
+reused while the round's responses are unchanged.
+Dumps older than EXPORT_DUMP_MAX_AGE seconds are
+deleted, as are the oldest dumps once all of them
+together take more than EXPORT_DUMP_MAX_BYTES.
+"""
+EXPORT_DUMP_MAX_AGE = 7 * 24 * 60 * 60
+EXPORT_DUMP_MAX_BYTES = 500 * 1024 * 1024
+
+"""
+How long, in seconds, a compiled questionnaire is
+kept in the Django cache. Editing questions or
+questionnaires replaces cached copies regardless.
+"""
+QUESTIONNAIRE_CACHE_AGE = 24 * 60 * 60
+
+"""
+How long, in seconds, the peer assessment of a
+round is cached. A cached assessment is only used
+while the round's responses and teams are unchanged.
+"""
+PEER_SCORE_CACHE_AGE = 24 * 60 * 60
+
+"""
+Passwords of users created in bulk, such as a
+class imported from a CSV file, are hashed by a
+pool of PASSWORD_HASH_WORKERS processes. Set it
+to 0 or 1 to hash them inside the request. If the
+pool hands back no hash for PASSWORD_HASH_TIMEOUT
+seconds, the rest are hashed inside the request.
+"""
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_TIMEOUT = 30
+
+"""
+Emails are queued in the database and delivered
+by a background thread. OUTBOX_SENDER turns the
+thread off, leaving the queue to the send_emails
+command. Each batch of up to OUTBOX_BATCH_SIZE
+emails shares one SMTP connection, and at most
+OUTBOX_RATE_LIMIT emails are sent per second
+(0 for no limit). A failed email is retried after
+OUTBOX_RETRY_DELAY seconds, doubling the wait
+every time, and given up after OUTBOX_MAX_ATTEMPTS.
+"""
+OUTBOX_SENDER = True
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_RATE_LIMIT = 5
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_MAX_ATTEMPTS = 6
+
+"""
+User and team CSV files are read directly from
+the upload. Files larger than CSV_UPLOAD_MAX_BYTES
+are refused. With CSV_UPLOAD_ARCHIVE on, a copy
+of every upload is kept in media/documents.
+"""
+CSV_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+CSV_UPLOAD_ARCHIVE = False
+
+"""
+The archive_rounds command moves the responses of
+rounds that ended more than ARCHIVE_AFTER_DAYS days
+ago into compressed files in media/archive. Exports
+of archived rounds read the files instead.
+"""
+ARCHIVE_AFTER_DAYS = 365
@@ -3,12 +3,14 @@ from django.conf.urls import include, url
 from django.conf.urls.static import static
 from django.contrib import admin
 from peer_review.view.maintainTeam import maintain_team, get_teams_for_round, change_user_team_for_round, \
-    change_team_status, submit_team_csv, get_teams
+    submit_team_csv, get_teams
 from peer_review.view.questionAdmin import save_question, edit_question, question_admin, delete_question
-from peer_review.view.questionnaire import save_questionnaire_progress, get_responses
+from peer_review.view.questionnaire import save_questionnaire_progress, save_questionnaire_batch, get_responses, \
+    get_round_responses
 from peer_review.view.questionnaireAdmin import save_questionnaire, questionnaire_preview, delete_questionnaire, \
     questionnaire_admin, edit_questionnaire
-from peer_review.view.roundManagement import maintain_round
+from peer_review.view.roundManagement import maintain_round, start_round_export, round_export_status, \
+    download_round_export
 from peer_review.view.userAdmin import submit_csv
 from peer_review.view.userFunctions import user_reset_password, active_rounds, get_team_members, account_details, \
     member_details
@@ -40,7 +42,9 @@ urlpatterns = [
     url(r'^questionnaire/(?P<round_pk>[0-9]+)/?$', peer_review.view.questionnaire.questionnaire, name='questionnaire'),
     url(r'^questionnaire/saveProgress', save_questionnaire_progress,
         name='saveQuestionnaireProgress'),
+    url(r'^questionnaire/saveBatch', save_questionnaire_batch, name='saveQuestionnaireBatch'),
     url(r'^questionnaire/getResponses', get_responses, name='getResponses'),
+    url(r'^questionnaire/getRoundResponses', get_round_responses, name='getRoundResponses'),
     url(r'^login/$', views.login, name='login'),
     # url(r'^questionnaire/(?P<questionnaire_pk>[0-9]+)/?$', views.questionnaire, name='questionnaire'),
     url(r'^activeRounds/$', active_rounds, name='activeRounds'),
@@ -60,6 +64,7 @@ urlpatterns = [
     # url(r'^userAdmin/resetPassword/(?P<userId>[0-9a-zA-Z]+)/?$',
     # views.reset_password, name='resetPassword'),
     url(r'^userAdmin/updateEmail/$', views.update_email, name='updateEmail'),
+    url(r'^userAdmin/users/?$', views.get_users, name='getUsers'),
     url(r'^userAdmin/$', views.user_list, name='userAdmin'),
 
     url(r'^questionAdmin/save', save_question, name='saveQuestion'),
@@ -76,6 +81,10 @@ urlpatterns = [
     url(r'^questionnaireAdmin/$', questionnaire_admin, name='questionnaireAdmin'),
 
     url(r'^maintainRound/dump/?$', views.round_dump, name='dumpRound'),
+    url(r'^maintainRound/export/?$', start_round_export, name='startRoundExport'),
+    url(r'^maintainRound/export/(?P<job_pk>[0-9]+)/?$', round_export_status, name='roundExportStatus'),
+    url(r'^maintainRound/export/(?P<job_pk>[0-9]+)/download/?$', download_round_export,
+        name='downloadRoundExport'),
     url(r'^maintainRound/delete/$', views.round_delete, name='deleteRound'),
     url(r'^maintainRound/update/(?P<round_pk>[0-9]+)/?$', views.round_update, name='updateRound'),
     url(r'^maintainTeam/getTeamsForRound/(?P<round_pk>[0-9]+)/?$', get_teams_for_round,
@@ -87,11 +96,13 @@ urlpatterns = [
         r'^maintainTeam/changeUserTeamForRound/(?P<round_pk>[0-9]+)/(?P<user_id>[0-9a-zA-Z]+)/(?P<team_name>[a-zA-Z0-9]+)/?$',
         change_user_team_for_round, name='changeUserTeamForRound'),
     url(r'^maintainTeam/getTeams/?$', get_teams, name='getTeams'),
-    url(r'^maintainTeam/changeTeamStatus/(?P<team_pk>[0-9]+)/(?P<status>[a-zA-Z0-9]+)/?$',
-        change_team_status, name='changeTeamStatus'),
     url(r'^maintainTeam/submitTeamCSV/$', submit_team_csv, name='submitTeamCSV'),
     url(r'^report/?$', views.report, name='report'),
     url(r'^report/getUser/(?P<user_id>[0-9a-zA-Z]+)/?$', views.get_user, name='getUserReport'),
+    url(r'^report/roster/(?P<round_pk>[0-9]+)/?$', views.get_report_roster, name='reportRoster'),
+    url(r'^report/statistics/(?P<round_pk>[0-9]+)/?$', views.get_round_statistics, name='roundStatistics'),
+    url(r'^report/scores/(?P<round_pk>[0-9]+)/?$', views.get_peer_scores, name='peerScores'),
+    url(r'^report/scores/(?P<round_pk>[0-9]+)/csv/?$', views.download_peer_scores, name='downloadPeerScores'),
     url(r'^login/auth/$', views.auth, name='auth'),
 
     url(r'^maintainRound/delete/$', views.round_delete),
@@ -0,0 +1,27 @@
+// Asks the server what deleting the items of a delete form would remove, and submits the form or calls onConfirm
+// once the admin has agreed. The delete views answer a POST with a preview field with the number of rows of each
+// kind that would be deleted.
+function deletionMessage(counts) {
+    var message = "Are you sure? This will delete:\n";
+    $.each(counts, function(name, count) {
+        message += count + " " + name + "\n";
+    });
+    return message;
+}
+
+// data is either an object of fields or a serialized form; the preview request sends the same fields plus preview
+function confirmDeletion(url, data, onConfirm) {
+    var preview = $.isPlainObject(data) ? $.extend({}, data, {preview: 1}) : data + "&preview=1";
+    $.post(url, preview, function(response) {
+        if (confirm(deletionMessage(response.counts))) {
+            onConfirm();
+        }
+    });
+}
+
+function confirmDeleteForm(form) {
+    // Serialized as the submit would send it, so repeated field names keep every value
+    confirmDeletion(form.attr("action"), form.serialize(), function() {
+        form.submit();
+    });
+}
@@ -1,5 +1,5 @@
 $(document).on("ready", function() {
-    $(".edit").on("click", function () {
+    $(document).on("click", ".edit", function () {
         var pk = $(this).data("pk");
         $("#more").attr("data-pk", pk);
         var token = $(this).data("csrf");